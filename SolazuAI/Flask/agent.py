@@ -5,11 +5,17 @@ import tiktoken
 import re
 import datetime
 import uuid
+import asyncio
+import threading
+import time
+import itertools
+import httpx
+from collections import OrderedDict
 from langchain.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_chroma import Chroma
 from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 from langchain.schema import HumanMessage
 from langchain_community.document_loaders import WebBaseLoader
@@ -19,7 +25,11 @@ from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
-from database import getPromptwithAgent, get_session_history, store_message, getDetailsfromDatabase, insertClarifyQuestionHistory, getClarifyQuestionHistory
+from vectorindex import get_retriever, corpus_version, retrieval_version, get_embeddings, get_project_index
+from resultcache import CachedGeneration
+from contextbudget import ContextAssembler, count_tokens
+from database import getPromptwithAgent, get_session_history, store_message, getDetailsfromDatabase, insertClarifyQuestionHistory, insertClarifyQuestionsBulk, getClarifyQuestionHistory, getEpicTicketKeys
+from asyncdatabase import aget_session_history, agetClarifyQuestionHistory, agetPromptVersion, agetIndexVersion
 from dotenv import load_dotenv
 from flask import jsonify
 
@@ -28,7 +38,26 @@ load_dotenv()
 LANGCHAIN_TRACING_V2 = os.getenv("LANGCHAIN_TRACING_V2")
 LANGCHAIN_API_KEY = os.getenv("LANGCHAIN_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-llm = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0)
+LLM_CONNECTION_POOLS = int(os.getenv('LLM_CONNECTION_POOLS', 8))  # async OpenAI calls are spread over this many pools
+
+class PooledTransport(httpx.AsyncBaseTransport):
+    '''
+    Sends requests round-robin through several connection pools. httpcore scans every
+    connection of a pool each time a request starts or ends, so one pool shared by the
+    agent calls in flight costs the event loop time quadratic in their number
+    '''
+    def __init__(self, pools):
+        self.transports = [httpx.AsyncHTTPTransport() for _ in range(pools)]
+        self.next_transport = itertools.cycle(self.transports)
+
+    async def handle_async_request(self, request):
+        return await next(self.next_transport).handle_async_request(request)
+
+    async def aclose(self):
+        for transport in self.transports:
+            await transport.aclose()
+
+llm = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0, http_async_client=httpx.AsyncClient(transport=PooledTransport(LLM_CONNECTION_POOLS)))
 tokenizer = tiktoken.get_encoding("cl100k_base")
 # ----------------------------------------------------------------------------
 
@@ -36,8 +65,21 @@ tokenizer = tiktoken.get_encoding("cl100k_base")
 
 # ------------------------ SETUP LANGCHAIN & OPENAI ------------------------
 
-def setup_prompts(role, question = None):
+# Compiled templates per role, reused until getPromptwithAgent reports a new version
+_prompt_templates = {}
+
+def setup_prompts(role):
+    # The CHAT clarify question stays a {question} input, filled in at invoke time
     prompt = getPromptwithAgent(role)
+    version = prompt.get('version')
+    cached = _prompt_templates.get(role)
+    if cached is None or cached[0] != version or 'error' in prompt:
+        cached = (version, build_prompts(role, prompt))
+        if 'error' not in prompt:
+            _prompt_templates[role] = cached
+    return cached[1]
+
+def build_prompts(role, prompt):
     context = prompt.get('contextualize_q_system_prompt')
     qa = prompt.get('qa_system_prompt')
     if (role == 'CHAT'):
@@ -50,7 +92,7 @@ def setup_prompts(role, question = None):
             ]
         )
     
-        qa_system_prompt = qa + f"\nThis is the question that you should ask user to clarify {question}" + """\n\n{context}"""
+        qa_system_prompt = qa + "\nThis is the question that you should ask user to clarify {question}" + """\n\n{context}"""
         qa_prompt = ChatPromptTemplate.from_messages(
             [
                 ("system", qa_system_prompt),
@@ -76,44 +118,169 @@ def setup_prompts(role, question = None):
         )
     return contextualize_q_prompt, qa_prompt
 
-def setup_retriver(project_name, epic_key, ticket_key = None, url = None):
-
-    text_data = load_text_from_database(project_name, epic_key, ticket_key, url)
-    docs = [Document(page_content=f"Title: {entry['title']}\nContent: {entry['content']}") for entry in text_data]
-    
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    splits = []
-    
-    for doc in docs:
-        splits.extend(text_splitter.split_documents([doc]))
-    
-    vectorstore = Chroma.from_documents(documents=splits, embedding=OpenAIEmbeddings())
-    retriever = vectorstore.as_retriever()
+def setup_retriver(project_name, epic_key, ticket_key = None, url = None, role = None):
+    # Chunks are indexed at ingestion; a request only searches its scope, in the role's retrieval mode
+    retriever = get_retriever(project_name, epic_key, ticket_key, url, role)
     return retriever
 
-def rag_chains_chat(question, project_name, epic_key, ticket_key = None, url = None):
+class SessionHistory(BaseChatMessageHistory):
+    '''
+    Session messages for RunnableWithMessageHistory, read through the sync or the async
+    driver depending on how the chain runs. store_message persists the turns, so adding
+    messages here keeps nothing
+    '''
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+
+    @property
+    def messages(self):
+        return get_session_history(self.session_id).messages
+
+    async def aget_messages(self):
+        return (await aget_session_history(self.session_id)).messages
 
-    retriever = setup_retriver(project_name, epic_key, ticket_key, url)
-    contextualize_q_prompt, qa_prompt = setup_prompts('CHAT', question)
+    def add_messages(self, messages):
+        pass
+
+    async def aadd_messages(self, messages):
+        pass
+
+    def clear(self):
+        pass
+
+def system_prompt_text(qa_prompt):
+    return qa_prompt.messages[0].prompt.template
+
+class ContextStep(RunnableLambda):
+    '''
+    A ContextAssembler step. It calls no runnable, so it reports no dependencies: for a
+    plain RunnableLambda langchain parses the function's source on every invoke to find them
+    '''
+    @property
+    def deps(self):
+        return []
+
+def rag_chains_chat(project_name, epic_key, ticket_key = None, url = None):
+    # The clarify question is left as a {question} input, so the chain can be shared by sessions
+    retriever = setup_retriver(project_name, epic_key, ticket_key, url, 'CHAT')
+    contextualize_q_prompt, qa_prompt = setup_prompts('CHAT')
     history_aware_retriever = create_history_aware_retriever(
             llm, 
             retriever, 
             contextualize_q_prompt)
     question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
-    rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+    # create_retrieval_chain, with the history and the retrieved chunks fitted to the token budget
+    assembler = ContextAssembler(system_prompt_text(qa_prompt))
+    rag_chain = (
+        ContextStep(assembler.trim_history)
+        | RunnablePassthrough.assign(context=history_aware_retriever.with_config(run_name="retrieve_documents"))
+        | ContextStep(assembler.trim_documents)
+        | RunnablePassthrough.assign(answer=question_answer_chain)
+    ).with_config(run_name="retrieval_chain")
 
-    return rag_chain
+    with_message_history = RunnableWithMessageHistory(
+        rag_chain,
+        SessionHistory,
+        input_messages_key="input",
+        history_messages_key="chat_history",
+        output_messages_key="answer",
+    )
+    return with_message_history
+
+def cached_generation(role, project_name, qa_prompt):
+    # Answers are reused while the prompt, model, retrieved context and question are unchanged
+    return CachedGeneration(
+        qa_prompt | llm | StrOutputParser(),
+        role,
+        getPromptwithAgent(role).get('version'),
+        llm.model_name,
+        project_name,
+        get_embeddings()
+    )
 
 def rag_chains_without_history(role, project_name, epic_key, ticket_key = None, url = None):
-    retriever = setup_retriver(project_name, epic_key, ticket_key, url)
+    retriever = setup_retriver(project_name, epic_key, ticket_key, url, role)
     contextualize_q_prompt, qa_prompt = setup_prompts(role)
+    generation = cached_generation(role, project_name, qa_prompt)
+    assembler = ContextAssembler(system_prompt_text(qa_prompt))
     rag_chain = ({"context": retriever, "input": RunnablePassthrough()}
-                    | qa_prompt
-                    | llm
-                    | StrOutputParser()
+                    | ContextStep(assembler.trim_documents)
+                    | generation
                 )
     return rag_chain
 
+def rag_chains_for_scopes(role, project_name):
+    '''
+    rag_chains_without_history for any scope of the project: the input carries epic_key,
+    ticket_key and url next to the message, so one chain can be batched over many tickets
+    '''
+    contextualize_q_prompt, qa_prompt = setup_prompts(role)
+    generation = cached_generation(role, project_name, qa_prompt)
+    assembler = ContextAssembler(system_prompt_text(qa_prompt))
+
+    def retrieve(inputs):
+        retriever = setup_retriver(project_name, inputs['epic_key'], inputs.get('ticket_key'), inputs.get('url'), role)
+        return {"context": retriever.invoke(inputs['input']), "input": inputs['input']}
+
+    return RunnableLambda(retrieve) | ContextStep(assembler.trim_documents) | generation
+
+# ------------------------ RAG CHAIN CACHE ------------------------
+RAG_CHAIN_CACHE_SIZE = int(os.getenv('RAG_CHAIN_CACHE_SIZE', 64))
+
+_chain_lock = threading.Lock()
+_chains = OrderedDict()
+_chain_stats = {"hits": 0, "misses": 0, "build_seconds": 0.0}
+
+def cached_rag_chain(key):
+    with _chain_lock:
+        chain = _chains.get(key)
+        if chain is not None:
+            _chains.move_to_end(key)
+            _chain_stats['hits'] += 1
+        return chain
+
+def get_rag_chain(role, project_name, epic_key, ticket_key = None, url = None):
+    '''
+    Ready-to-invoke chain for the role and scope, reused while the role's prompt version
+    and the project's index stay the same. Session state is only passed at invoke time
+    '''
+    version = getPromptwithAgent(role).get('version')
+    key = (role, version, project_name, epic_key, ticket_key, url, corpus_version(project_name, role))
+    chain = cached_rag_chain(key)
+    if chain is not None:
+        return chain
+
+    started = time.perf_counter()
+    if role == 'CHAT':
+        chain = rag_chains_chat(project_name, epic_key, ticket_key, url)
+    else:
+        chain = rag_chains_without_history(role, project_name, epic_key, ticket_key, url)
+    elapsed = time.perf_counter() - started
+
+    with _chain_lock:
+        _chain_stats['misses'] += 1
+        _chain_stats['build_seconds'] += elapsed
+        if version is not None:
+            _chains[key] = chain
+            while len(_chains) > RAG_CHAIN_CACHE_SIZE:
+                _chains.popitem(last=False)
+    return chain
+
+def get_chain_stats():
+    '''
+    Hit/miss counts and the setup time hits avoided, estimated from the average build time
+    '''
+    with _chain_lock:
+        misses = _chain_stats['misses']
+        average = _chain_stats['build_seconds'] / misses if misses else 0
+        return {
+            "hits": _chain_stats['hits'],
+            "misses": misses,
+            "cached_chains": len(_chains),
+            "average_build_seconds": round(average, 4),
+            "saved_seconds": round(_chain_stats['hits'] * average, 4)
+        }
+
 # ------------------------------LOAD CONTEXT FROM DATABASE (MANUAL ONLY)---------------------------------------
 '''
 def load_text_from_database():
@@ -137,7 +304,111 @@ def load_text_from_database(project_name, epic_key, ticket_key = None, url = Non
     ]
     return text_data
 
+# ------------------------ AGENT CALLS ------------------------
+'''
+Every agent comes in four variants: sync, streaming, async and async streaming. What they
+share is built once per request as an AgentCall: the chain and its input, the history
+saved around the answer and the result payload. The runners below only differ in how
+they call the chain. Streaming runners yield (event, data) pairs: one "token" event per
+answer token, then a "done" event with the result and token counts, or an "error" event
+'''
+
+class AgentCall:
+    def __init__(self, chain, message, finish, input = None, config = None, key = None, partial = None):
+        self.chain = chain
+        self.message = message  # what the user asked, for the token counts
+        self.input = message if input is None else input
+        self.config = config
+        self.key = key  # the answer's key in the chain's output, if it is a dict
+        self.finish = finish  # answer -> result payload
+        self.partial = partial  # keeps an answer cut short by the client going away
+
+def agent_error(e):
+    print(f"An error occurred: {str(e)}")
+    return {"error": str(e)}
+
+def with_token_counts(result, message, response):
+    return {**result, "input_tokens": count_tokens(message), "output_tokens": count_tokens(response)}
+
+def answer_of(call, response):
+    return response if call.key is None else response[call.key]
+
+def stream_answer(chunks, key = None):
+    for chunk in chunks:
+        token = chunk.get(key) if key is not None else chunk
+        if token:
+            yield token
+
+async def astream_answer(chunks, key = None):
+    async for chunk in chunks:
+        token = chunk.get(key) if key is not None else chunk
+        if token:
+            yield token
+
+def run_agent(prepare):
+    try:
+        call = prepare()
+        return call.finish(answer_of(call, call.chain.invoke(call.input, config=call.config)))
+    except Exception as e:
+        return agent_error(e)
+
+def stream_agent(prepare):
+    call = None
+    answer = []
+    finished = False
+    try:
+        call = prepare()
+        for token in stream_answer(call.chain.stream(call.input, config=call.config), call.key):
+            answer.append(token)
+            yield "token", {"token": token}
+        response = "".join(answer)
+        result = call.finish(response)
+        finished = True
+        yield "done", with_token_counts(result, call.message, response)
+    except Exception as e:
+        yield "error", agent_error(e)
+    finally:
+        if call is not None and call.partial is not None and answer and not finished:
+            call.partial("".join(answer))
+
+async def arun_agent(prepare):
+    try:
+        call = await prepare()
+        return call.finish(answer_of(call, await call.chain.ainvoke(call.input, config=call.config)))
+    except Exception as e:
+        return agent_error(e)
+
+async def astream_agent(prepare):
+    call = None
+    answer = []
+    finished = False
+    try:
+        call = await prepare()
+        async for token in astream_answer(call.chain.astream(call.input, config=call.config), call.key):
+            answer.append(token)
+            yield "token", {"token": token}
+        response = "".join(answer)
+        result = call.finish(response)
+        finished = True
+        yield "done", with_token_counts(result, call.message, response)
+    except Exception as e:
+        yield "error", agent_error(e)
+    finally:
+        if call is not None and call.partial is not None and answer and not finished:
+            call.partial("".join(answer))
+
+async def aget_rag_chain(role, project_name, epic_key, ticket_key = None, url = None):
+    # A cached chain is found with motor reads; building one touches the index, so that
+    # runs in a worker thread
+    version = await agetPromptVersion(role)
+    chain = cached_rag_chain((role, version, project_name, epic_key, ticket_key, url, retrieval_version(role, await agetIndexVersion(project_name))))
+    if chain is not None:
+        return chain
+    return await asyncio.to_thread(get_rag_chain, role, project_name, epic_key, ticket_key, url)
+
 # ------------------------ CLARIFY AGENT ------------------------
+CLARIFY_INSTRUCTION = "Generate questions from the context. Return the questions in the following format: 1. Question one?\n2. Question two?\n..."
+
 def format_questions(response_text, project_name, epic_key, ticket_key=None, url=None):
     # Split the response text into individual questions
     questions = re.split(r'\n\d+\.\s', response_text)
@@ -154,27 +425,69 @@ def format_questions(response_text, project_name, epic_key, ticket_key=None, url
     } for q in questions]
     return formatted_questions
 
-def CLARIFY_AGENT(project_name, epic_key, ticket_key = None, url = None):
-    try:
-        rag_chain = rag_chains_without_history('CLARIFY', project_name, epic_key, ticket_key, url)
-        response = rag_chain.invoke("Generate questions from the context. Return the questions in the following format: 1. Question one?\n2. Question two?\n...")
+def question_sessions(formatted_questions):
+    # Each question is its own chat session; the client replies to it with this id
+    return [{"question": question['question'], "sessionId": question['sessionID']} for question in formatted_questions]
+
+def clarify_call(rag_chain, project_name, epic_key, ticket_key = None, url = None):
+    def finish(response):
         formatted_questions = format_questions(response, project_name, epic_key, ticket_key, url)
         insertClarifyQuestionHistory(formatted_questions)
-        return {"success": "Questions generated successfully", "response": response}
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        return {"error": str(e)}
+        return {"success": "Questions generated successfully", "response": response, "questions": question_sessions(formatted_questions)}
+    return AgentCall(rag_chain, CLARIFY_INSTRUCTION, finish)
+
+def CLARIFY_AGENT(project_name, epic_key, ticket_key = None, url = None):
+    return run_agent(lambda: clarify_call(get_rag_chain('CLARIFY', project_name, epic_key, ticket_key, url), project_name, epic_key, ticket_key, url))
     
-# ------------------------ SUGGESTION AGENT ------------------------
-def SUGGESTION_AGENT(session_id, project_name, epic_key, ticket_key = None, url = None):
+BULK_CLARIFY_CONCURRENCY = int(os.getenv('BULK_CLARIFY_CONCURRENCY', 8))
+
+def CLARIFY_AGENT_BULK(project_name, epic_key):
+    '''
+    Generate clarify questions for the epic and each of its tickets with one batched chain,
+    at most BULK_CLARIFY_CONCURRENCY at a time. Yields (event, data) pairs like the
+    streaming agents: a "result" or "error" event per ticket as it finishes, then "done".
+    A ticket's questions are stored before its result is sent, so their session ids can
+    be replied to right away
+    '''
     try:
-        rag_chain = rag_chains_without_history('SUGGESTION', project_name, epic_key, ticket_key, url)
-        question = getClarifyQuestionHistory(session_id, project_name, epic_key, ticket_key, url)
-        response = rag_chain.invoke(f"Generate suggestions answer for this question {question} from context")
-        return {"success": "Questions generated successfully", "question": question, "response": response}
+        ticket_keys = [None] + getEpicTicketKeys(project_name, epic_key)
+        get_project_index(project_name, build=True)
+        rag_chain = rag_chains_for_scopes('CLARIFY', project_name)
     except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        return {"error": str(e)}
+        yield "error", agent_error(e)
+        return
+
+    inputs = [{"epic_key": epic_key, "ticket_key": ticket_key, "input": CLARIFY_INSTRUCTION} for ticket_key in ticket_keys]
+    questions = 0
+    failed = 0
+    unstored = 0
+    for position, response in rag_chain.batch_as_completed(inputs, config={"max_concurrency": BULK_CLARIFY_CONCURRENCY}, return_exceptions=True):
+        ticket_key = ticket_keys[position]
+        if isinstance(response, Exception):
+            failed += 1
+            yield "error", {"epic_key": epic_key, "ticket_key": ticket_key, "error": str(response)}
+            continue
+        formatted_questions = format_questions(response, project_name, epic_key, ticket_key)
+        stored = insertClarifyQuestionsBulk(formatted_questions).get('code') == 200
+        questions += len(formatted_questions)
+        unstored += 0 if stored else len(formatted_questions)
+        yield "result", {"epic_key": epic_key, "ticket_key": ticket_key, "response": response, "questions": question_sessions(formatted_questions), "stored": stored}
+
+    yield "done", {"tickets": len(ticket_keys), "failed": failed, "questions": questions, "stored": unstored == 0}
+
+# ------------------------ SUGGESTION AGENT ------------------------
+def suggestion_call(rag_chain, question):
+    return AgentCall(
+        rag_chain,
+        f"Generate suggestions answer for this question {question} from context",
+        lambda response: {"success": "Questions generated successfully", "question": question, "response": response}
+    )
+
+def SUGGESTION_AGENT(session_id, project_name, epic_key, ticket_key = None, url = None):
+    return run_agent(lambda: suggestion_call(
+        get_rag_chain('SUGGESTION', project_name, epic_key, ticket_key, url),
+        getClarifyQuestionHistory(session_id, project_name, epic_key, ticket_key, url)
+    ))
 
 # ------------------------ CHAT AGENT ------------------------
 
@@ -184,41 +497,90 @@ def generate_session_id():
     session_id = f"{now.strftime('%d%m%Y-%H%M%S')}-{random_part}"
     return session_id
 
+def store_answer(session_id, response):
+    store_message(session_id, 'agent', response, 0, count_tokens(response))
+
+def chat_call(with_message_history, question, session_id, user_message):
+    # The message is saved before the chain runs, the answer once it is complete
+    store_message(session_id, 'human', user_message, count_tokens(user_message), 0)
+
+    def finish(response):
+        store_answer(session_id, response)
+        return {"response": response}
+    return AgentCall(
+        with_message_history,
+        user_message,
+        finish,
+        input={"input": HumanMessage(content=user_message), "question": str(question)},
+        config={"configurable": {"session_id": session_id}},
+        key="answer",
+        partial=lambda answer: store_answer(session_id, answer)
+    )
+
 def CHAT_AGENT(session_id, user_message, project_name, epic_key, ticket_key = None, url = None):
-    try:
-        question = getClarifyQuestionHistory(session_id, project_name, epic_key, ticket_key, url)
-        rag_chain = rag_chains_chat(question, project_name, epic_key, ticket_key, url)
-
-        def get_session_history_wrapper(session_id: str) -> BaseChatMessageHistory:
-            return get_session_history(session_id)
-
-        with_message_history = RunnableWithMessageHistory(
-            rag_chain,
-            get_session_history_wrapper,
-            input_messages_key="input",
-            history_messages_key="chat_history",
-            output_messages_key="answer",
-        )
+    return run_agent(lambda: chat_call(
+        get_rag_chain('CHAT', project_name, epic_key, ticket_key, url),
+        getClarifyQuestionHistory(session_id, project_name, epic_key, ticket_key, url),
+        session_id,
+        user_message
+    ))
+    
+# ------------------------ STREAMING AGENTS ------------------------
 
-        def get_response(message: str):
-            store_message(session_id, 'human', message, len(tokenizer.encode(message)), 0)
-            human_message = HumanMessage(content=message)
-            response = with_message_history.invoke({"input": human_message}, config={"configurable": {"session_id": session_id}})
-            store_message(session_id, 'agent', response["answer"], 0, len(tokenizer.encode(response["answer"])))
-            return response["answer"]
+def CLARIFY_AGENT_STREAM(project_name, epic_key, ticket_key = None, url = None):
+    return stream_agent(lambda: clarify_call(get_rag_chain('CLARIFY', project_name, epic_key, ticket_key, url), project_name, epic_key, ticket_key, url))
 
-        response = get_response(user_message)
+def SUGGESTION_AGENT_STREAM(session_id, project_name, epic_key, ticket_key = None, url = None):
+    return stream_agent(lambda: suggestion_call(
+        get_rag_chain('SUGGESTION', project_name, epic_key, ticket_key, url),
+        getClarifyQuestionHistory(session_id, project_name, epic_key, ticket_key, url)
+    ))
 
-        result = {
-            "response": response,
-        }
+def CHAT_AGENT_STREAM(session_id, user_message, project_name, epic_key, ticket_key = None, url = None):
+    return stream_agent(lambda: chat_call(
+        get_rag_chain('CHAT', project_name, epic_key, ticket_key, url),
+        getClarifyQuestionHistory(session_id, project_name, epic_key, ticket_key, url),
+        session_id,
+        user_message
+    ))
+
+# ------------------------ ASYNC AGENTS ------------------------
+'''
+Same results as the agents above for the asyncio server: the LLM runs through ainvoke and
+astream, and session lookups through motor
+'''
 
-        return result
+async def aclarify_call(project_name, epic_key, ticket_key = None, url = None):
+    return clarify_call(await aget_rag_chain('CLARIFY', project_name, epic_key, ticket_key, url), project_name, epic_key, ticket_key, url)
+
+async def asuggestion_call(session_id, project_name, epic_key, ticket_key = None, url = None):
+    return suggestion_call(
+        await aget_rag_chain('SUGGESTION', project_name, epic_key, ticket_key, url),
+        await agetClarifyQuestionHistory(session_id, project_name, epic_key, ticket_key, url)
+    )
+
+async def achat_call(session_id, user_message, project_name, epic_key, ticket_key = None, url = None):
+    question = await agetClarifyQuestionHistory(session_id, project_name, epic_key, ticket_key, url)
+    return chat_call(await aget_rag_chain('CHAT', project_name, epic_key, ticket_key, url), question, session_id, user_message)
+
+async def CLARIFY_AGENT_ASYNC(project_name, epic_key, ticket_key = None, url = None):
+    return await arun_agent(lambda: aclarify_call(project_name, epic_key, ticket_key, url))
+
+async def SUGGESTION_AGENT_ASYNC(session_id, project_name, epic_key, ticket_key = None, url = None):
+    return await arun_agent(lambda: asuggestion_call(session_id, project_name, epic_key, ticket_key, url))
+
+async def CHAT_AGENT_ASYNC(session_id, user_message, project_name, epic_key, ticket_key = None, url = None):
+    return await arun_agent(lambda: achat_call(session_id, user_message, project_name, epic_key, ticket_key, url))
+
+def CLARIFY_AGENT_STREAM_ASYNC(project_name, epic_key, ticket_key = None, url = None):
+    return astream_agent(lambda: aclarify_call(project_name, epic_key, ticket_key, url))
+
+def SUGGESTION_AGENT_STREAM_ASYNC(session_id, project_name, epic_key, ticket_key = None, url = None):
+    return astream_agent(lambda: asuggestion_call(session_id, project_name, epic_key, ticket_key, url))
+
+def CHAT_AGENT_STREAM_ASYNC(session_id, user_message, project_name, epic_key, ticket_key = None, url = None):
+    return astream_agent(lambda: achat_call(session_id, user_message, project_name, epic_key, ticket_key, url))
 
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        return {"error": str(e)}
-    
 '''
         {
             
@@ -1,12 +1,18 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 import requests
 import re  # Regular expression library for parsing
 from flask_cors import CORS
-from utils import handle_webhook, load_repository_contents, get_confluence_details, get_google_docs_details
+from utils import handle_webhook, load_repository_contents, parse_github_url, stream_repository_contents, get_confluence_details, get_google_docs_details
 from dotenv import load_dotenv
+from datetime import datetime, timezone
 import os
-from database import connect_to_mongodb, addDataToMongoDB, getProjectListDatabase, getEpicListDatabase, getTicketListDatabase, getLinkfromDatabase, setPromptwithAgent, deleteSessionHistory, getClarifyQuestionHistory
-from agent import CLARIFY_AGENT, CHAT_AGENT, SUGGESTION_AGENT
+import json
+from database import connect_to_mongodb, storeProjectData, getSyncWatermark, getProjectListDatabase, getEpicListDatabase, getTicketListDatabase, checkEpicViews, getLinkfromDatabase, decodeLinkCursor, GET_LINK_PAGE_SIZE, setPromptwithAgent, deleteSessionHistory, getClarifyQuestionHistory
+from jobs import submit_job, get_job
+from transport import get_request_counters
+from vectorindex import sync_project_index, get_embeddings
+from resultcache import get_result_cache_stats
+from agent import CLARIFY_AGENT, CLARIFY_AGENT_BULK, CHAT_AGENT, SUGGESTION_AGENT, CLARIFY_AGENT_STREAM, CHAT_AGENT_STREAM, SUGGESTION_AGENT_STREAM, get_chain_stats
 
 load_dotenv()
 app = Flask(__name__)
@@ -16,7 +22,49 @@ CORS(app)  # Enable CORS for all routes
 def load_repository():
     github_url = request.args.get('githubLink')
     return load_repository_contents(github_url)
+
+@app.route('/loadGithubStream', methods=['GET'])
+def stream_repository():
+    github_url = request.args.get('githubLink')
+    if not github_url:
+        return jsonify({'error': 'GitHub URL is required'}), 400
+    repository = parse_github_url(github_url)
+    if not repository:
+        return jsonify({'error': 'Invalid GitHub URL'}), 400
+    return Response(stream_with_context(stream_repository_contents(*repository)), mimetype='application/x-ndjson')
     
+def ingestProject(job, projectName, githubLink, jiraLink, docsLink, confluenceLink, mode):
+    '''
+    Crawl the project and store it, reporting progress on the job
+    '''
+    with app.app_context():
+        syncStartedAt = datetime.now(timezone.utc)
+        watermark = getSyncWatermark(projectName) if mode == 'delta' else None
+        data = handle_webhook(projectName, githubLink, jiraLink, docsLink, confluenceLink, updatedSince=watermark, progress=job.update)
+        if not isinstance(data, dict):
+            response, code = data
+            job.result = {**response.get_json(), "code": code}
+            job.fail(response.get_json())
+            return
+
+        job.update('storing')
+        # A delta sync only upserts the changed issues and keeps the others
+        data['last_synced'] = syncStartedAt
+        job.result, touched = storeProjectData(data, replaceIssues=watermark is None)
+        if 'error' in job.result and job.result.get('code') != 304:
+            job.fail(job.result)
+            return
+
+        job.update('indexing')
+        try:
+            # A full sync may have removed issues, so it compares the whole index; a delta
+            # sync only the issues it stored
+            job.result['index'] = sync_project_index(projectName, None if watermark is None else touched)
+        except Exception as e:
+            # The data is stored; the next sync or request fills the index in
+            job.errors.append({"error": "Indexing failed", "details": str(e)})
+        job.update('done')
+
 # Sua lai neu trung ten thi khong load database nua
 @app.route('/addToDatabase', methods=['POST'])
 def addToDatabase():
@@ -29,9 +77,19 @@ def addToDatabase():
     jiraLink = data.get('jiraLink') or None
     docsLink = data.get('docsLink') or None
     confluenceLink = data.get('confluenceLink') or None
+    # mode 'delta' only fetches issues updated since the last successful sync
+    mode = data.get('mode') or 'full'
+
+    # A second submit while the project is being crawled attaches to the running job
+    job, attached = submit_job(projectName, ingestProject, projectName, githubLink, jiraLink, docsLink, confluenceLink, mode)
+    return jsonify({**job.status(), "attached": attached}), 202
 
-    data = handle_webhook(projectName, githubLink, jiraLink, docsLink, confluenceLink)
-    return addDataToMongoDB(data)
+@app.route('/ingestionStatus', methods=['GET'])
+def ingestionStatus():
+    job = get_job(request.args.get('jobId'))
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.status())
 
 @app.route('/getProjectsList', methods=['GET'])
 def getProjectList():
@@ -56,6 +114,14 @@ def getTicketList():
     return getTicketListDatabase(projectName, epicKey)
 
 
+@app.route('/checkEpicViews', methods=['GET'])
+def checkEpicViewList():
+    projectName = request.args.get('projectName')
+    if projectName is None:
+        return jsonify({"error": "Project name is required"}), 400
+    return jsonify({"projectName": projectName, "mismatched": checkEpicViews(projectName)})
+
+
 @app.route('/getContentData', methods=['GET'])
 def getContent():
     link = request.args.get('link')
@@ -78,10 +144,19 @@ def getLink():
         return jsonify({"error": "Project name is required"}), 400
     epicKey = data.get('epicKey') or None
     ticketKey = data.get('ticketKey') or None
-    print(f"Received request for project: {projectName}, epic: {epicKey}, ticket: {ticketKey}")
+    cursor = data.get('cursor') or None
+    try:
+        limit = int(data.get('limit') or GET_LINK_PAGE_SIZE)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Limit must be an integer"}), 400
+    if cursor is not None:
+        try:
+            decodeLinkCursor(cursor)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
     
     try:
-        links = getLinkfromDatabase(projectName, epicKey, ticketKey)
+        links = getLinkfromDatabase(projectName, epicKey, ticketKey, cursor=cursor, limit=limit)
         if not links:
             return jsonify({"error": "No links found"}), 404
         return jsonify(links), 200
@@ -127,11 +202,76 @@ def getQuestion():
     url = data.get('url') or None
     return CLARIFY_AGENT(project_name, epic_key, ticket_key=ticket_key, url=url)
 
+def event_stream(events):
+    '''
+    Format an agent's (event, data) pairs as Server-Sent Events
+    '''
+    for event, data in events:
+        yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    return Response(stream_with_context(event_stream(events)), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/getClarifyStream', methods=['POST'])
+def getClarifyStream():
+    data = request.json
+    session_id = data.get('sessionId')
+    user_message = data.get('userMessage')
+    project_name = data.get('projectName')
+    epic_key = data.get('epicKey')
+    ticket_key = data.get('ticketKey') or None
+    url = data.get('url') or None
+    return sse_response(CHAT_AGENT_STREAM(session_id, user_message, project_name, epic_key, ticket_key=ticket_key, url=url))
+
+@app.route('/getSuggestionStream', methods=['POST'])
+def getSuggestionStream():
+    data = request.json
+    session_id = data.get('sessionId')
+    project_name = data.get('projectName')
+    epic_key = data.get('epicKey')
+    ticket_key = data.get('ticketKey') or None
+    url = data.get('url') or None
+    return sse_response(SUGGESTION_AGENT_STREAM(session_id, project_name, epic_key, ticket_key=ticket_key, url=url))
+
+@app.route('/getQuestionStream', methods=['POST'])
+def getQuestionStream():
+    data = request.json
+    project_name = data.get('projectName')
+    epic_key = data.get('epicKey')
+    ticket_key = data.get('ticketKey') or None
+    url = data.get('url') or None
+    return sse_response(CLARIFY_AGENT_STREAM(project_name, epic_key, ticket_key=ticket_key, url=url))
+
+@app.route('/getQuestionsForEpic', methods=['POST'])
+def getQuestionsForEpic():
+    data = request.json
+    project_name = data.get('projectName')
+    epic_key = data.get('epicKey')
+    if not project_name or not epic_key:
+        return jsonify({"error": "Project name and epic key are required"}), 400
+    return sse_response(CLARIFY_AGENT_BULK(project_name, epic_key))
+
 @app.route('/deteleSessionId', methods=['POST'])
 def deleteSessionId():
     sessionId = request.args.get('sessionId')
     return deleteSessionHistory(sessionId)
 
+@app.route('/connectorStats', methods=['GET'])
+def connectorStats():
+    return jsonify(get_request_counters())
+
+@app.route('/embeddingStats', methods=['GET'])
+def embeddingStats():
+    return jsonify(get_embeddings().stats())
+
+@app.route('/chainStats', methods=['GET'])
+def chainStats():
+    return jsonify(get_chain_stats())
+
+@app.route('/resultCacheStats', methods=['GET'])
+def resultCacheStats():
+    return jsonify(get_result_cache_stats())
+
 # ------------------------ TEST API ------------------------
 @app.route('/test', methods=['POST'])
 def webhook():
@@ -0,0 +1,104 @@
+import os
+import time
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from database import (
+    MONGODB_MAX_POOL_SIZE, MONGODB_MIN_POOL_SIZE, MONGODB_MAX_IDLE_TIME_MS,
+    HISTORY_WINDOW_MESSAGES, HISTORY_WINDOW_TOKENS, SESSION_HISTORY_PROJECTION, AGENT_RESULT_MAX_ENTRIES, PROMPT_CACHE_TTL, _prompt_cache,
+    pendingSessionMessages, buildSessionHistory, pendingClarifyQuestion
+)
+
+load_dotenv()
+
+# ----------------- ASYNC DATABASE (PRODUCTION SERVER) -----------------
+'''
+Reads on the agent paths, and the agent result cache, for the asyncio server. Each
+worker process and event loop gets its own motor client; history writes still go
+through the write-behind buffer
+'''
+
+_motor_client = None
+
+def get_async_mongo_client():
+    global _motor_client
+    if _motor_client is None:
+        _motor_client = AsyncIOMotorClient(
+            os.getenv('MONGODB_URI'),
+            maxPoolSize=MONGODB_MAX_POOL_SIZE,
+            minPoolSize=MONGODB_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS
+        )
+    return _motor_client
+
+def get_async_db():
+    return get_async_mongo_client()['project_db']
+
+async def aget_session_history(session_id, max_messages=HISTORY_WINDOW_MESSAGES, max_tokens=HISTORY_WINDOW_TOKENS):
+    db = get_async_db()
+    messages_collection = db['history_messages']
+    pending = pendingSessionMessages(session_id)
+    cursor = messages_collection.find({"sessionID": session_id}, SESSION_HISTORY_PROJECTION).sort("seq", -1).limit(max_messages or 0)
+    stored = await cursor.to_list(length=None)
+    return buildSessionHistory(pending, stored, max_messages, max_tokens)
+
+async def agetClarifyQuestionHistory(sessionId, project_name, epic_key, ticket_key = None, url = None):
+    db = get_async_db()
+    projects_collection = db['history']
+    try:
+        query = {"sessionID": sessionId, "project_name": project_name, "epic_key": epic_key, "ticket_key": ticket_key, "url": url}
+        pending = pendingClarifyQuestion(query)
+        if pending:
+            return pending.get('question')
+        clarify_question = await projects_collection.find_one(query)
+        return clarify_question.get('question')
+    except Exception as e:
+        return {"error": "Failed to get clarify question", "details": str(e), "code": 500}
+
+async def agetPromptVersion(role):
+    '''
+    The version getPromptwithAgent reports for the role. Its cached prompt is checked
+    against the stored version once older than PROMPT_CACHE_TTL
+    '''
+    cached = _prompt_cache.get(role)
+    if cached and time.monotonic() - cached['checked_at'] < PROMPT_CACHE_TTL:
+        return cached['prompt']['version']
+    db = get_async_db()
+    current = await db['prompts'].find_one({"role": role}, {"version": 1})
+    if current is None:
+        return None
+    version = current.get('version', 0)
+    if cached and cached['prompt']['version'] == version:
+        cached['checked_at'] = time.monotonic()
+    return version
+
+async def agetIndexVersion(projectName):
+    db = get_async_db()
+    project = await db['projects'].find_one({"project_name": projectName}, {"index_version": 1})
+    return project.get('index_version') if project else None
+
+# --------------------- AGENT RESULT CACHE ---------------------
+'''
+The agent result cache of database.py, read and written without leaving the event loop
+'''
+
+async def agetAgentResult(key):
+    db = get_async_db()
+    results_collection = db['agent_results']
+    return await results_collection.find_one_and_update({"_id": key}, {"$set": {"last_used": datetime.now(timezone.utc)}}, projection={"response": 1})
+
+async def agetAgentResultCandidates(scope_key):
+    db = get_async_db()
+    results_collection = db['agent_results']
+    cursor = results_collection.find({"scope_key": scope_key, "question_embedding": {"$exists": True}}, {"response": 1, "question_embedding": 1})
+    return await cursor.to_list(length=None)
+
+async def astoreAgentResult(result):
+    db = get_async_db()
+    results_collection = db['agent_results']
+    now = datetime.now(timezone.utc)
+    await results_collection.replace_one({"_id": result['_id']}, {**result, "created_at": now, "last_used": now}, upsert=True)
+    surplus = await results_collection.estimated_document_count() - AGENT_RESULT_MAX_ENTRIES
+    if surplus > 0:
+        oldest = [result['_id'] async for result in results_collection.find({}, {"_id": 1}).sort("last_used", 1).limit(surplus)]
+        await results_collection.delete_many({"_id": {"$in": oldest}})
@@ -0,0 +1,212 @@
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from flask import Flask
+from langchain.schema import HumanMessage, AIMessage
+from langchain_community.chat_message_histories import ChatMessageHistory
+from pymongo import MongoClient
+from dotenv import load_dotenv
+import database
+from utils import build_issue_tree
+
+load_dotenv()
+
+# ------------------------ DATABASE BENCHMARKS ------------------------
+'''
+Per-call latency of the database layer against the access patterns it replaced. Runs on
+MONGODB_URI in a scratch database that is dropped afterwards; when MONGODB_URI is unset
+the in-memory mongomock stands in. mongomock has no connections and uses no indexes, so
+sections measuring those are skipped on it and the others show data volume, not I/O.
+Run with: python bench_database.py [section ...]
+'''
+
+BENCH_REPEAT = int(os.getenv('BENCH_REPEAT', 50))
+BENCH_ISSUE_COUNTS = [int(count) for count in os.getenv('BENCH_ISSUE_COUNTS', '100,1000,5000').split(',')]
+BENCH_HISTORY_SIZES = [int(size) for size in os.getenv('BENCH_HISTORY_SIZES', '10,100,1000,5000').split(',')]
+BENCH_DB = 'bench_project_db'
+BACKEND = 'mongod' if os.getenv('MONGODB_URI') else 'mongomock'
+
+if BACKEND == 'mongomock':
+    import mongomock
+    database._mongo_client = mongomock.MongoClient()
+
+def get_bench_db():
+    return database.get_mongo_client()[BENCH_DB]
+
+database.get_db = get_bench_db
+
+def measure(call, repeat=BENCH_REPEAT):
+    '''
+    Median and p95 of call in milliseconds, after one warm-up call
+    '''
+    call()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {"median_ms": round(timings[len(timings) // 2], 3), "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3)}
+
+# ---------------------------- CLIENT ----------------------------
+
+def bench_client():
+    '''
+    A prompt lookup on a client built for the call, as every function did before, and on
+    the shared pooled client; then a session lookup without and with its index
+    '''
+    if BACKEND != 'mongod':
+        return {"skipped": "needs MONGODB_URI: mongomock has no connections to pool and no indexes"}
+    db = get_bench_db()
+    db['prompts'].insert_one({"role": "CLARIFY", "contextualize_q_system_prompt": "c", "qa_system_prompt": "q", "version": 1})
+
+    def per_call_client():
+        client = MongoClient(os.getenv('MONGODB_URI'))
+        try:
+            client[BENCH_DB]['prompts'].find_one({"role": "CLARIFY"})
+        finally:
+            client.close()
+
+    def pooled_client():
+        get_bench_db()['prompts'].find_one({"role": "CLARIFY"})
+
+    db['history'].insert_many([{"sessionID": f"session-{number}", "question": "q"} for number in range(50000)])
+
+    def session_lookup():
+        get_bench_db()['history'].find_one({"sessionID": "session-49999"})
+
+    result = {
+        "per_call_client": measure(per_call_client),
+        "pooled_client": measure(pooled_client),
+        "session_lookup_unindexed": measure(session_lookup)
+    }
+    database.ensure_indexes()
+    result["session_lookup_indexed"] = measure(session_lookup)
+    return result
+
+# ---------------------------- ISSUES ----------------------------
+
+def synthetic_issues(count):
+    '''
+    count issues in epics of 50: each epic with 49 tasks, each issue with a 1 KB
+    description and a Confluence link
+    '''
+    issues = []
+    for number in range(count):
+        epic = number - number % 50
+        issues.append({
+            "key": f"BENCH-{number}",
+            "summary": f"Issue {number}",
+            "reporter": "bench",
+            "description": f"Issue {number} " + "x" * 1000,
+            "status": "To Do",
+            "issue_type": "Epic" if number == epic else "Task",
+            "assignee": None,
+            "parent": None if number == epic else f"BENCH-{epic}",
+            "source": {"confluence": [{"url": f"https://wiki/{number}", "id": str(number), "title": f"Page {number}", "version": 1}], "googleDocs": [], "otherLinks": []}
+        })
+    return issues
+
+def legacy_epic_list(project_name):
+    project = get_bench_db()['legacy_projects'].find_one({"project_name": project_name}, {"issues": 1})
+    return [{'name': issue.get('summary'), 'key': issue.get('key')} for issue in project.get('issues', []) if issue.get('issue_type') == 'Epic']
+
+def legacy_ticket_list(project_name, epic_key):
+    project = get_bench_db()['legacy_projects'].find_one({"project_name": project_name}, {"issues": 1})
+    epic = next(issue for issue in project.get('issues', []) if issue.get('key') == epic_key and issue.get('issue_type') == 'Epic')
+    return [{"name": issue.get('summary'), "key": issue.get("key"), "type": issue.get('issue_type')} for issue in epic.get('tasks', [])]
+
+def legacy_details(project_name, epic_key, ticket_key):
+    project = get_bench_db()['legacy_projects'].find_one({"project_name": project_name})
+    epic = next(epic for epic in project.get('issues', []) if epic.get('key') == epic_key)
+    ticket = next(ticket for ticket in epic.get('tasks', []) if ticket.get('key') == ticket_key)
+    return {"content": ticket.get('description'), "title": ticket.get('summary')}
+
+def bench_issues():
+    '''
+    Epic list, ticket list and ticket details read from one project document holding the
+    whole issue tree, as before, and from the issues collection, by project size. The
+    epic and ticket looked up are the last ones
+    '''
+    database.ensure_indexes()
+    results = {}
+    with Flask(__name__).app_context():
+        for count in BENCH_ISSUE_COUNTS:
+            project_name = f"BENCH_{count}"
+            issues = synthetic_issues(count)
+            epic_key = issues[(count - 1) - (count - 1) % 50]['key']
+            ticket_key = issues[-1]['key']
+            tree = build_issue_tree(issues)
+            get_bench_db()['legacy_projects'].insert_one({"project_name": project_name, "issues": tree})
+            database.addDataToMongoDB({"project_name": project_name, "github_link": [], "jira_link": [], "docs_link": [], "confluence_link": [], "issues": tree, "confluence_pages": []})
+            database.getTicketListDatabase(project_name, epic_key)  # materializes the epic view
+            results[count] = {
+                "epic_list": {"before": measure(lambda: legacy_epic_list(project_name)), "after": measure(lambda: database.getEpicListDatabase(project_name))},
+                "ticket_list": {"before": measure(lambda: legacy_ticket_list(project_name, epic_key)), "after_view": measure(lambda: database.getTicketListDatabase(project_name, epic_key)), "after_rebuild": measure(lambda: database.computeEpicView(project_name, epic_key))},
+                "details": {"before": measure(lambda: legacy_details(project_name, epic_key, ticket_key)), "after": measure(lambda: database.getDetailsfromDatabase(project_name, epic_key, ticket_key))}
+            }
+    return results
+
+# ---------------------------- HISTORY ----------------------------
+
+def legacy_store_message(session_id, sender, content):
+    get_bench_db()['legacy_history'].update_one(
+        {"sessionID": session_id},
+        {"$push": {"messages": {"sender": sender, "content": content, "input_token": 10, "output_token": 10, "timestamp": datetime.now()}}},
+        upsert=True
+    )
+
+def legacy_session_history(session_id):
+    session = get_bench_db()['legacy_history'].find_one({"sessionID": session_id})
+    history = ChatMessageHistory()
+    for message in session.get("messages", []):
+        if message['sender'] == 'human':
+            history.add_message(HumanMessage(content=message['content']))
+        else:
+            history.add_message(AIMessage(content=message['content']))
+    return history
+
+def bench_history():
+    '''
+    Appending to and loading a session by its length: one history document with a
+    messages array, as before, against a document per message written through the
+    write-behind buffer and read back as the newest HISTORY_WINDOW_MESSAGES. Appends are
+    flushed one by one, so they include the write and not only the enqueue
+    '''
+    database.ensure_indexes()
+    results = {}
+    for size in BENCH_HISTORY_SIZES:
+        session_id = f"bench-session-{size}"
+        content = "m" * 500
+        get_bench_db()['legacy_history'].insert_one({"sessionID": session_id, "messages": [{"sender": "human" if number % 2 == 0 else "ai", "content": content, "input_token": 10, "output_token": 10, "timestamp": datetime.now()} for number in range(size)]})
+        for number in range(size):
+            database.store_message(session_id, "human" if number % 2 == 0 else "ai", content, 10, 10)
+        database._history_writes.flush()
+
+        def append():
+            database.store_message(session_id, "human", content, 10, 10)
+            database._history_writes.flush()
+
+        results[size] = {
+            "append": {"before": measure(lambda: legacy_store_message(session_id, "human", content)), "after": measure(append)},
+            "load": {"before": measure(lambda: legacy_session_history(session_id)), "after": measure(lambda: database.get_session_history(session_id))}
+        }
+    return results
+
+SECTIONS = {
+    "client": bench_client,
+    "issues": bench_issues,
+    "history": bench_history
+}
+
+if __name__ == '__main__':
+    results = {"backend": BACKEND, "repeat": BENCH_REPEAT}
+    for name in sys.argv[1:] or SECTIONS:
+        database.get_mongo_client().drop_database(BENCH_DB)
+        try:
+            results[name] = SECTIONS[name]()
+        finally:
+            database.get_mongo_client().drop_database(BENCH_DB)
+    print(json.dumps(results, indent=2))
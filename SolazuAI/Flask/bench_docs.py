@@ -0,0 +1,68 @@
+import json
+import os
+import time
+from utils import read_paragraph_element, read_structural_elements
+
+# ------------------------ GOOGLE DOCS EXTRACTION BENCHMARK ------------------------
+'''
+Text extraction from a synthetic Docs API body: paragraphs of several text runs, with a
+table of nested paragraphs and a table of contents every BENCH_DOCS_SECTION paragraphs.
+The recursive += extractor read_structural_elements used before is measured against the
+current one, which appends fragments to one list and joins them once.
+Run with: python bench_docs.py
+'''
+
+BENCH_REPEAT = int(os.getenv('BENCH_REPEAT', 5))
+BENCH_DOCS_PARAGRAPHS = [int(count) for count in os.getenv('BENCH_DOCS_PARAGRAPHS', '1000,10000,50000').split(',')]
+BENCH_DOCS_SECTION = 50
+
+def paragraph(number):
+    return {"paragraph": {"elements": [{"textRun": {"content": f"Requirement {number} part {part}. "}} for part in range(4)] + [{"textRun": {"content": "\n"}}]}}
+
+def synthetic_body(paragraphs):
+    content = []
+    for number in range(paragraphs):
+        content.append(paragraph(number))
+        if number % BENCH_DOCS_SECTION == 0:
+            content.append({"tableOfContents": {"content": [paragraph(number)]}})
+            content.append({"table": {"tableRows": [{"tableCells": [{"content": [paragraph(number), paragraph(number)]} for _ in range(3)]} for _ in range(3)]}})
+    return content
+
+def legacy_read_structural_elements(elements):
+    text = ''
+    for value in elements:
+        if 'paragraph' in value:
+            for elem in value.get('paragraph').get('elements'):
+                text += read_paragraph_element(elem)
+        elif 'table' in value:
+            for row in value.get('table').get('tableRows'):
+                for cell in row.get('tableCells'):
+                    text += legacy_read_structural_elements(cell.get('content'))
+        elif 'tableOfContents' in value:
+            text += legacy_read_structural_elements(value.get('tableOfContents').get('content'))
+    return text
+
+def measure(call, repeat=BENCH_REPEAT):
+    '''
+    Median of call in milliseconds, after one warm-up call
+    '''
+    call()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return round(timings[len(timings) // 2], 3)
+
+if __name__ == '__main__':
+    results = {"repeat": BENCH_REPEAT}
+    for paragraphs in BENCH_DOCS_PARAGRAPHS:
+        body = synthetic_body(paragraphs)
+        assert legacy_read_structural_elements(body) == read_structural_elements(body)
+        results[paragraphs] = {
+            "text_chars": len(read_structural_elements(body)),
+            "before_ms": measure(lambda: legacy_read_structural_elements(body)),
+            "after_ms": measure(lambda: read_structural_elements(body))
+        }
+    print(json.dumps(results, indent=2))
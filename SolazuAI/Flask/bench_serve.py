@@ -0,0 +1,247 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import socket
+import tempfile
+import time
+import numpy as np
+
+# ------------------------ LOAD TEST (serve.py) ------------------------
+'''
+Load test for serve.py against local stub servers. An OpenAI-compatible stub answers chat
+completions and embeddings after BENCH_STUB_LATENCY seconds; MongoDB is MONGODB_URI or, when
+it is unset, an in-memory mongomock, shared with motor through mongomock_motor. Every
+request asks /getQuestion about a different ticket, so none is answered from the result
+cache. The same load is run against the Flask app on the threaded development server
+app.py used before, as the baseline. Each server runs in its own process;
+server_cpu_ms_per_request is the CPU time it used.
+The ttfb section then times the first byte of /getQuestion and of /getQuestionStream, for
+which the stub streams its answer: the first token after BENCH_STUB_FIRST_TOKEN seconds,
+the last after BENCH_STUB_LATENCY. It runs BENCH_TTFB_CONCURRENCY users.
+Run with: python bench_serve.py
+'''
+
+BENCH_REQUESTS = int(os.getenv('BENCH_REQUESTS', 200))
+BENCH_CONCURRENCY = int(os.getenv('BENCH_CONCURRENCY', 50))
+BENCH_STUB_LATENCY = float(os.getenv('BENCH_STUB_LATENCY', 0.5))  # seconds per completion
+BENCH_STUB_FIRST_TOKEN = float(os.getenv('BENCH_STUB_FIRST_TOKEN', 0.1))  # seconds to the first streamed token
+BENCH_TTFB_REQUESTS = int(os.getenv('BENCH_TTFB_REQUESTS', 50))  # per server and endpoint
+BENCH_TTFB_CONCURRENCY = int(os.getenv('BENCH_TTFB_CONCURRENCY', 10))  # below saturation, where queueing would hide the first token
+BENCH_ROUNDS = int(os.getenv('BENCH_ROUNDS', 3))  # the round with the median throughput is reported
+BENCH_EMBEDDING_SIZE = 64
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+STUB_PORT = free_port()
+SERVE_BENCH_PORT = free_port()
+FLASK_BENCH_PORT = free_port()
+
+os.environ['OPENAI_API_KEY'] = 'stub'
+os.environ['OPENAI_API_BASE'] = f'http://127.0.0.1:{STUB_PORT}/v1'
+os.environ['OPENAI_BASE_URL'] = os.environ['OPENAI_API_BASE']
+os.environ.setdefault('CHROMA_PERSIST_DIR', tempfile.mkdtemp())
+os.environ.setdefault('ANONYMIZED_TELEMETRY', 'False')
+os.environ.setdefault('EMBEDDING_CACHE_PATH', os.path.join(tempfile.mkdtemp(), 'embeddings.sqlite3'))
+
+import uvicorn
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from werkzeug.serving import make_server
+import asyncdatabase
+import database
+
+if not os.getenv('MONGODB_URI'):
+    import mongomock
+    import mongomock_motor
+    database._mongo_client = mongomock.MongoClient()
+    asyncdatabase._motor_client = mongomock_motor.AsyncMongoMockClient(mock_mongo_client=database._mongo_client)
+
+# ---------------------------- STUB OPENAI ----------------------------
+
+STUB_ANSWER = "1. What is the expected behaviour?\n2. Which users are affected?\n3. How is it tested?"
+STUB_TOKENS = re.findall(r'\S+\s*', STUB_ANSWER)
+
+def stub_embedding(text):
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:4], 'little')
+    return np.random.default_rng(seed).standard_normal(BENCH_EMBEDDING_SIZE).astype(np.float32)
+
+async def completion_chunks(model):
+    # The answer a word at a time, finishing after BENCH_STUB_LATENCY like a plain completion
+    delay = (BENCH_STUB_LATENCY - BENCH_STUB_FIRST_TOKEN) / max(len(STUB_TOKENS) - 1, 1)
+    chunk = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+    for position, token in enumerate(STUB_TOKENS):
+        await asyncio.sleep(BENCH_STUB_FIRST_TOKEN if position == 0 else delay)
+        yield f"data: {json.dumps({**chunk, 'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]})}\n\n"
+    yield f"data: {json.dumps({**chunk, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n"
+    yield "data: [DONE]\n\n"
+
+async def chat_completions(request):
+    body = await request.json()
+    if body.get('stream'):
+        return StreamingResponse(completion_chunks(body.get('model')), media_type='text/event-stream')
+    await asyncio.sleep(BENCH_STUB_LATENCY)
+    return JSONResponse({
+        "id": "stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get('model'),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": STUB_ANSWER}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+    })
+
+async def embeddings(request):
+    body = await request.json()
+    inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+    data = []
+    for index, text in enumerate(inputs):
+        vector = stub_embedding(json.dumps(text))
+        embedding = base64.b64encode(vector.tobytes()).decode() if body.get('encoding_format') == 'base64' else vector.tolist()
+        data.append({"object": "embedding", "index": index, "embedding": embedding})
+    return JSONResponse({"object": "list", "data": data, "model": body.get('model'), "usage": {"prompt_tokens": 1, "total_tokens": 1}})
+
+stub_app = Starlette(routes=[
+    Route('/v1/chat/completions', chat_completions, methods=['POST']),
+    Route('/v1/embeddings', embeddings, methods=['POST']),
+])
+
+def run_stub():
+    uvicorn.run(stub_app, host='127.0.0.1', port=STUB_PORT, log_level='warning')
+
+def start_process(target, port):
+    # Its own process, so the stub, the server under test and the load generator do not
+    # compete for one GIL
+    process = multiprocessing.get_context('fork').Process(target=target, daemon=True)
+    process.start()
+    while True:
+        try:
+            with socket.create_connection(('127.0.0.1', port)):
+                return process
+        except OSError:
+            time.sleep(0.05)
+
+def cpu_seconds(process):
+    with open(f'/proc/{process.pid}/stat') as stat:
+        fields = stat.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+# ---------------------------- FIXTURE ----------------------------
+
+def seed_project(project_name, tickets):
+    from utils import build_issue_tree
+    from vectorindex import sync_project_index
+    flat_issues = [{"key": "EPIC-1", "summary": "Checkout epic", "description": "Rework the checkout flow", "issue_type": "Epic", "parent": None, "source": {}}]
+    for number in range(tickets):
+        flat_issues.append({
+            "key": f"TASK-{number}",
+            "summary": f"Checkout task {number}",
+            "description": f"{project_name} task {number}: validate the cart, apply discount code {number} and show the receipt",
+            "issue_type": "Task",
+            "parent": "EPIC-1",
+            "source": {}
+        })
+    database.ensure_indexes()
+    database.addDataToMongoDB({"project_name": project_name, "github_link": [], "jira_link": [], "docs_link": [], "confluence_link": [], "issues": build_issue_tree(flat_issues), "confluence_pages": []})
+    for role in ('CHAT', 'CLARIFY', 'SUGGESTION'):
+        database.setPromptwithAgent("Rewrite the question to stand alone.", "Answer from the context:\n\n{context}" + (" {question}" if role == 'CHAT' else ""), role)
+    sync_project_index(project_name)
+
+# ---------------------------- LOAD ----------------------------
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return round(values[max(int(len(values) * fraction) - 1, 0)], 3)
+
+async def run_load(base_url, project_name, first_ticket, path='/getQuestion', requests=BENCH_REQUESTS, concurrency=BENCH_CONCURRENCY):
+    latencies = []
+    first_bytes = []
+    failures = 0
+    tickets = iter(range(first_ticket, first_ticket + requests))
+
+    async def user(client):
+        nonlocal failures
+        for number in tickets:
+            started = time.perf_counter()
+            try:
+                async with client.stream('POST', path, json={"projectName": project_name, "epicKey": "EPIC-1", "ticketKey": f"TASK-{number}"}) as response:
+                    body = b""
+                    async for chunk in response.aiter_bytes():
+                        if not body:
+                            first_bytes.append(time.perf_counter() - started)
+                        body += chunk
+            except httpx.HTTPError:
+                failures += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            # A stream reports a failure as an error event
+            if response.status_code != 200 or b'"error"' in body:
+                failures += 1
+
+    # One client and connection per simulated user: a pool shared by all of them scans every
+    # connection on each request, and the load generator becomes the bottleneck. They are
+    # created before the clock starts, as each builds an SSL context
+    clients = [httpx.AsyncClient(base_url=base_url, timeout=120) for _ in range(concurrency)]
+    started = time.perf_counter()
+    await asyncio.gather(*(user(client) for client in clients))
+    elapsed = time.perf_counter() - started
+    for client in clients:
+        await client.aclose()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "stub_latency_s": BENCH_STUB_LATENCY,
+        "failures": failures,
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_s": percentile(latencies, 0.5),
+        "p95_s": percentile(latencies, 0.95),
+        "ttfb_p50_s": percentile(first_bytes, 0.5),
+        "ttfb_p95_s": percentile(first_bytes, 0.95)
+    }
+
+def measure(process, port, project_name, first_ticket):
+    before = cpu_seconds(process)
+    result = asyncio.run(run_load(f'http://127.0.0.1:{port}', project_name, first_ticket))
+    result["server_cpu_ms_per_request"] = round((cpu_seconds(process) - before) * 1000 / BENCH_REQUESTS, 1)
+    return result
+
+def median_round(rounds):
+    return sorted(rounds, key=lambda result: result["requests_per_second"])[len(rounds) // 2]
+
+if __name__ == '__main__':
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    stub = start_process(run_stub, STUB_PORT)
+    # One project per target with its own ticket texts, and new tickets every round, so no
+    # request is served from an earlier one's results
+    load_tickets = BENCH_REQUESTS * BENCH_ROUNDS
+    seed_project('BENCH_FLASK', load_tickets + 2 * BENCH_TTFB_REQUESTS)
+    seed_project('BENCH_SERVE', load_tickets + 2 * BENCH_TTFB_REQUESTS)
+    import serve
+    targets = {
+        "flask_dev_server": (start_process(make_server('127.0.0.1', FLASK_BENCH_PORT, serve.flask_app, threaded=True).serve_forever, FLASK_BENCH_PORT), FLASK_BENCH_PORT, 'BENCH_FLASK'),
+        "serve": (start_process(lambda: uvicorn.run(serve.asgi_app, host='127.0.0.1', port=SERVE_BENCH_PORT, log_level='warning'), SERVE_BENCH_PORT), SERVE_BENCH_PORT, 'BENCH_SERVE')
+    }
+    rounds = {name: [] for name in targets}
+    # Rounds alternate between the targets, so drift on the machine affects both alike
+    for number in range(BENCH_ROUNDS):
+        for name, (process, port, project_name) in targets.items():
+            rounds[name].append(measure(process, port, project_name, number * BENCH_REQUESTS))
+    results = {name: {**median_round(results), "rounds_rps": [result["requests_per_second"] for result in results]} for name, results in rounds.items()}
+    results["ttfb"] = {name: {} for name in targets}
+    for offset, path in enumerate(('/getQuestion', '/getQuestionStream')):
+        for name, (process, port, project_name) in targets.items():
+            load = asyncio.run(run_load(f'http://127.0.0.1:{port}', project_name, load_tickets + offset * BENCH_TTFB_REQUESTS, path, BENCH_TTFB_REQUESTS, BENCH_TTFB_CONCURRENCY))
+            results["ttfb"][name][path] = {key: load[key] for key in ("failures", "ttfb_p50_s", "ttfb_p95_s", "p50_s", "p95_s")}
+    print(json.dumps(results, indent=2))
+    for process, _, _ in targets.values():
+        process.terminate()
+    stub.terminate()
+    os._exit(0)
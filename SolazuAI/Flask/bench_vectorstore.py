@@ -0,0 +1,212 @@
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from lexical import BM25Index, BM25Retriever, HybridRetriever
+from numpystore import NumpyVectorStore
+from vectorindex import load_scope_store
+
+# ------------------------ VECTOR STORE BENCHMARKS ------------------------
+'''
+Retrieval from one request scope by the number of vectors it holds. Random unit vectors
+stand in for embeddings, so no embedding API is called. Memory is the growth of the
+resident set of the searching process, which includes Chroma's native HNSW index and not
+only Python objects. The bm25 section uses synthetic chunks of Zipf-distributed words.
+Run with: python bench_vectorstore.py [section ...]
+'''
+
+BENCH_REPEAT = int(os.getenv('BENCH_REPEAT', 50))
+BENCH_VECTOR_COUNTS = [int(count) for count in os.getenv('BENCH_VECTOR_COUNTS', '100,10000,100000').split(',')]
+BENCH_VECTOR_DIM = int(os.getenv('BENCH_VECTOR_DIM', 1536))  # OpenAIEmbeddings' dimensions
+BENCH_ADD_BATCH_SIZE = 5000  # below Chroma's largest batch
+BENCH_K = 4
+
+class RandomEmbeddings(Embeddings):
+    '''
+    Queries are passed as vectors; only the store constructors need an embedding
+    '''
+    def embed_documents(self, texts):
+        return random_vectors(len(texts)).tolist()
+
+    def embed_query(self, text):
+        return random_vectors(1)[0].tolist()
+
+def random_vectors(count, seed=None):
+    vectors = np.random.default_rng(seed).standard_normal((count, BENCH_VECTOR_DIM), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def resident_mb():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+def peak_resident_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+def measure(call, repeat=BENCH_REPEAT):
+    '''
+    Median and p95 of call in milliseconds, after one warm-up call
+    '''
+    call()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {"median_ms": round(timings[len(timings) // 2], 3), "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3)}
+
+def timed(call):
+    started = time.perf_counter()
+    value = call()
+    return value, round((time.perf_counter() - started) * 1000, 1)
+
+def fill_chroma(directory, count):
+    '''
+    A project collection holding count chunks of one epic, persisted in directory
+    '''
+    index = Chroma(collection_name="bench", embedding_function=RandomEmbeddings(), persist_directory=directory)
+    vectors = random_vectors(count, seed=count)
+    for start in range(0, count, BENCH_ADD_BATCH_SIZE):
+        end = min(start + BENCH_ADD_BATCH_SIZE, count)
+        index._collection.add(
+            ids=[f"issue:BENCH-{number}:0" for number in range(start, end)],
+            embeddings=vectors[start:end].tolist(),
+            documents=[f"Title: Issue {number}\nContent: " + "x" * 200 for number in range(start, end)],
+            metadatas=[{"source_id": f"issue:BENCH-{number}", "epic_key": "BENCH-0", "ticket_key": f"BENCH-{number}"} for number in range(start, end)]
+        )
+
+# ---------------------------- VECTOR ----------------------------
+
+def search_chroma(directory, where, queries):
+    index = Chroma(collection_name="bench", embedding_function=RandomEmbeddings(), persist_directory=directory)
+    index.get(limit=1)  # the SQLite connection is not counted
+    before = resident_mb()
+    _, first_ms = timed(lambda: index.similarity_search_by_vector(queries[0], k=BENCH_K, filter=where))
+    position = iter(queries[1:])
+    return {
+        "first_query_ms": first_ms,
+        "query": measure(lambda: index.similarity_search_by_vector(next(position), k=BENCH_K, filter=where)),
+        "rss_growth_mb": round(resident_mb() - before, 1)
+    }
+
+def search_numpy(directory, where, queries, quantize):
+    index = Chroma(collection_name="bench", embedding_function=RandomEmbeddings(), persist_directory=directory)
+    index.get(limit=1)  # the SQLite connection is not counted
+    before = resident_mb()
+    store, load_ms = timed(lambda: load_scope_store(index, where, quantize))
+    load_peak_mb = round(peak_resident_mb() - before, 1)
+    position = iter(queries[1:])
+    return {
+        "load_ms": load_ms,
+        "load_peak_mb": load_peak_mb,
+        "query": measure(lambda: store.similarity_search_by_vector(next(position), k=BENCH_K)),
+        "vectors_mb": round(store.nbytes / 2 ** 20, 1),
+        "rss_growth_mb": round(resident_mb() - before, 1)
+    }
+
+def send_result(connection, call, args):
+    connection.send(call(*args))
+    connection.close()
+
+def in_fresh_process(call, *args):
+    '''
+    call(*args) in a new process, as a new worker would run it; what it returned, or how
+    the process died, as when the kernel kills it for lack of memory
+    '''
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=send_result, args=(sender, call, args))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    return result if process.exitcode == 0 else {"failed": f"exit code {process.exitcode}"}
+
+def bench_vector():
+    '''
+    Top-k search of an epic scope on the project's Chroma collection, as with
+    VECTOR_STORE_BACKEND=chroma, and on the NumpyVectorStore get_scope_store loads from it,
+    plain and quantized. Each is measured in a fresh process opening the persisted
+    collection; load_ms and load_peak_mb are the one-off cost of a scope cache miss
+    '''
+    where = {"epic_key": "BENCH-0"}
+    queries = random_vectors(BENCH_REPEAT + 2, seed=0).tolist()
+    results = {}
+    for count in BENCH_VECTOR_COUNTS:
+        directory = tempfile.mkdtemp(prefix='bench-chroma-')
+        try:
+            in_fresh_process(fill_chroma, directory, count)
+            results[count] = {
+                "chroma": in_fresh_process(search_chroma, directory, where, queries),
+                "numpy": in_fresh_process(search_numpy, directory, where, queries, False),
+                "numpy_quantized": in_fresh_process(search_numpy, directory, where, queries, True)
+            }
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+# ---------------------------- BM25 ----------------------------
+
+BENCH_VOCABULARY = 5000
+BENCH_CHUNK_WORDS = 150  # about one INDEX_CHUNK_SIZE chunk
+BENCH_QUERY_WORDS = 6
+
+def synthetic_chunks(count):
+    '''
+    count chunks of words drawn from a Zipf-like vocabulary, as Document objects with ids
+    '''
+    rng = np.random.default_rng(count)
+    words = np.array([f"term{number}" for number in range(BENCH_VOCABULARY)])
+    weights = 1 / np.arange(1, BENCH_VOCABULARY + 1)
+    draws = rng.choice(words, size=(count, BENCH_CHUNK_WORDS), p=weights / weights.sum())
+    return [Document(page_content=" ".join(row), metadata={"source_id": f"issue:BENCH-{number}"}, id=f"issue:BENCH-{number}:0") for number, row in enumerate(draws)]
+
+def bench_bm25():
+    '''
+    The BM25Index get_scope_bm25 builds on a scope cache miss, by the number of chunks in
+    the scope, and one query with each retrieval mode on it: bm25 alone, hybrid, which
+    also scores every chunk of the scope by cosine similarity, and vector on the
+    NumpyVectorStore alone for reference
+    '''
+    rng = np.random.default_rng(0)
+    results = {}
+    for count in BENCH_VECTOR_COUNTS:
+        documents = synthetic_chunks(count)
+        index, build_ms = timed(lambda: BM25Index(documents))
+        store = NumpyVectorStore(RandomEmbeddings())
+        store.add_embeddings([document.page_content for document in documents], random_vectors(count, seed=count), [document.metadata for document in documents], [document.id for document in documents])
+        queries = iter([" ".join(f"term{number}" for number in rng.integers(0, BENCH_VOCABULARY // 10, BENCH_QUERY_WORDS)) for _ in range(3 * (BENCH_REPEAT + 1))])
+        retrievers = {
+            "bm25": BM25Retriever(index=index),
+            "hybrid": HybridRetriever(index=index, vectorstore=store, alpha=0.5),
+            "vector": store.as_retriever()
+        }
+        results[count] = {
+            "build_ms": build_ms,
+            "terms": len(index.postings),
+            **{name: measure(lambda: retriever.invoke(next(queries))) for name, retriever in retrievers.items()}
+        }
+        del index, store, retrievers
+    return results
+
+SECTIONS = {
+    "vector": bench_vector,
+    "bm25": bench_bm25
+}
+
+if __name__ == '__main__':
+    results = {"repeat": BENCH_REPEAT, "dimensions": BENCH_VECTOR_DIM}
+    for name in sys.argv[1:] or SECTIONS:
+        results[name] = SECTIONS[name]()
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import tiktoken
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 12000))  # gpt-3.5-turbo-0125 accepts 16k
+CONTEXT_RESPONSE_RESERVE = int(os.getenv('CONTEXT_RESPONSE_RESERVE', 1024))  # left for the answer
+CONTEXT_HISTORY_SHARE = float(os.getenv('CONTEXT_HISTORY_SHARE', 0.4))  # most of the budget history may take
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv('TOKEN_COUNT_CACHE_SIZE', 20000))
+MESSAGE_OVERHEAD_TOKENS = 4  # role and separators the chat format adds per message
+
+tokenizer = tiktoken.get_encoding("cl100k_base")
+
+# ---------------------------- TOKEN COUNTS ----------------------------
+
+_counts_lock = threading.Lock()
+_counts = OrderedDict()
+
+def count_tokens(text):
+    '''
+    cl100k_base token count of text, memoized so history messages are not encoded again every turn
+    '''
+    text = text if isinstance(text, str) else str(text)
+    key = hashlib.sha1(text.encode('utf-8')).digest()
+    with _counts_lock:
+        count = _counts.get(key)
+        if count is not None:
+            _counts.move_to_end(key)
+            return count
+    count = len(tokenizer.encode(text))
+    with _counts_lock:
+        _counts[key] = count
+        while len(_counts) > TOKEN_COUNT_CACHE_SIZE:
+            _counts.popitem(last=False)
+    return count
+
+def content(value):
+    return value.content if hasattr(value, 'content') else value
+
+def message_tokens(message):
+    return count_tokens(content(message)) + MESSAGE_OVERHEAD_TOKENS
+
+# ---------------------------- CONTEXT ASSEMBLY ----------------------------
+
+class ContextAssembler:
+    '''
+    Fits the chain inputs into the token budget around a system prompt. History keeps its
+    newest turns within CONTEXT_HISTORY_SHARE of what the prompt, question and input leave;
+    retrieved chunks keep their best-ranked within the rest
+    '''
+    def __init__(self, system_prompt, budget=CONTEXT_TOKEN_BUDGET, reserve=CONTEXT_RESPONSE_RESERVE, history_share=CONTEXT_HISTORY_SHARE):
+        self.system_tokens = count_tokens(system_prompt)
+        self.budget = budget
+        self.reserve = reserve
+        self.history_share = history_share
+
+    def available(self, inputs):
+        fixed = self.system_tokens + message_tokens(inputs.get('input', ''))
+        if inputs.get('question') is not None:
+            fixed += count_tokens(inputs['question'])
+        return max(0, self.budget - self.reserve - fixed)
+
+    def trim_history(self, inputs):
+        history = inputs.get('chat_history') or []
+        limit = int(self.available(inputs) * self.history_share)
+        kept = []
+        used = 0
+        for message in reversed(history):
+            tokens = message_tokens(message)
+            if used + tokens > limit:
+                break
+            used += tokens
+            kept.append(message)
+        kept.reverse()
+        # A history that starts with an answer has lost its question
+        while kept and getattr(kept[0], 'type', None) == 'ai':
+            kept.pop(0)
+        return {**inputs, 'chat_history': kept} if 'chat_history' in inputs else inputs
+
+    def trim_documents(self, inputs):
+        documents = inputs.get('context') or []
+        limit = self.available(inputs) - sum(message_tokens(message) for message in inputs.get('chat_history') or [])
+        kept = []
+        used = 0
+        for document in documents:
+            tokens = count_tokens(document.page_content)
+            if used + tokens > limit:
+                break
+            used += tokens
+            kept.append(document)
+        return {**inputs, 'context': kept}
@@ -1,54 +1,203 @@
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
+from pymongo import ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
+import threading
+import time
+import base64
+import json
+import logging
+from itertools import chain, islice
+from bson import ObjectId
+from bson.errors import InvalidId
 from dotenv import load_dotenv
 from flask import jsonify
-from datetime import datetime
+from datetime import datetime, timezone
 from langchain.schema import HumanMessage, AIMessage
 from langchain_community.chat_message_histories import ChatMessageHistory
+from writebehind import WriteBehindBuffer
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 # ----------------- CONNECT TO DATABASE -----------------
 
+MONGODB_MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', 50))
+MONGODB_MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', 0))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv('MONGODB_MAX_IDLE_TIME_MS', 300000))
+
+_client_lock = threading.Lock()
+_mongo_client = None
+
+def get_mongo_client():
+    '''
+    Return the process-wide MongoClient; its connection pool is shared by every request
+    '''
+    global _mongo_client
+    if _mongo_client is None:
+        with _client_lock:
+            if _mongo_client is None:
+                _mongo_client = MongoClient(
+                    os.getenv('MONGODB_URI'),
+                    maxPoolSize=MONGODB_MAX_POOL_SIZE,
+                    minPoolSize=MONGODB_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS
+                )
+    return _mongo_client
+
+def get_db():
+    return get_mongo_client()['project_db']
+
+AGENT_RESULT_TTL_SECONDS = int(os.getenv('AGENT_RESULT_TTL_SECONDS', 7 * 24 * 3600))
+AGENT_RESULT_MAX_ENTRIES = int(os.getenv('AGENT_RESULT_MAX_ENTRIES', 50000))
+
+def ensure_indexes():
+    '''
+    Create the indexes the queries rely on. create_index is a no-op when the index exists
+    '''
+    db = get_db()
+    db['projects'].create_index("project_name")
+    db['history'].create_index("sessionID")
+    db['prompts'].create_index("role")
+    db['confluence_pages'].create_index("id", unique=True)
+    db['issues'].create_index([("project_name", 1), ("key", 1)], unique=True)
+    db['issues'].create_index([("project_name", 1), ("issue_type", 1)])
+    db['issues'].create_index([("project_name", 1), ("parent", 1)])
+    db['epic_views'].create_index([("project_name", 1), ("epic_key", 1)], unique=True)
+    db['history_messages'].create_index([("sessionID", 1), ("seq", 1)], unique=True)
+    db['agent_results'].create_index("created_at", expireAfterSeconds=AGENT_RESULT_TTL_SECONDS)
+    db['agent_results'].create_index("scope_key")
+    db['agent_results'].create_index("last_used")
+    db['agent_results'].create_index([("project_name", 1), ("source_ids", 1)])
+    db['ingestion_jobs'].create_index("finished_at")
+
 def connect_to_mongodb():
-    uri = os.getenv('MONGODB_URI')
-    client = MongoClient(uri)
+    client = get_mongo_client()
     try:
         client.admin.command('ping')
         print("Pinged your deployment. You successfully connected to MongoDB!")
+        ensure_indexes()
+        migrateProjectIssues()
+        migrateSessionHistory()
     except Exception as e:
         print(e)
     return client
 
 # ----------------- ADD DATA TO DATABASE -----------------
 
-def addDataToMongoDB(data):
-    mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-    db = mongo_client['project_db']
+def addDataToMongoDB(data, replaceIssues=True):
+    return storeProjectData(data, replaceIssues)[0]
+
+def storeProjectData(data, replaceIssues=True):
+    '''
+    Store a project document from handle_webhook. Its issue tree is split into the issues
+    collection; with replaceIssues the stored issues missing from data are removed.
+    Returns the result and the keys of the issues whose stored data may have changed
+    '''
+    db = get_db()
     projects_collection = db['projects']
     
     # Check if a project with the same name already exists in the database
     project_name = data.get('project_name')
     if project_name is None:
-        return {"error": "Project name is required", "code": 400}
-
-    existing_project = projects_collection.find_one({"project_name": project_name})
+        return {"error": "Project name is required", "code": 400}, set()
+
+    # Confluence pages are stored once in their own collection, issues only reference them
+    storeConfluencePages(data.pop('confluence_pages', []))
+    issues = data.pop('issues', None)
+    touched = set()
+    if issues is not None:
+        try:
+            touched = storeIssues(project_name, flattenIssues(issues), replaceIssues)
+        except Exception as e:
+            return {"error": "Failed to add issues to MongoDB", "details": str(e), "code": 500}, set()
+
+    # Project links are part of every epic's view, and a full sync may have removed issues
+    existing_project = projects_collection.find_one({"project_name": project_name}, {field: 1 for field in PROJECT_LINK_FIELDS})
+    linksChanged = linksAdded(existing_project or {}, data)
     if existing_project:
-        return updateData(project_name, data)
-
-    try:
-        # Insert the data as no existing project with the same name was found
-        projects_collection.insert_one(data)
-        return {"success": "Data added to MongoDB successfully", "code": 200}
-    except Exception as e:
-        return {"error": "Failed to add data to MongoDB", "details": str(e), "code": 500}
+        result = updateData(project_name, data)
+    else:
+        try:
+            # Insert the data as no existing project with the same name was found
+            projects_collection.insert_one(data)
+            result = {"success": "Data added to MongoDB successfully", "code": 200}
+        except Exception as e:
+            return {"error": "Failed to add data to MongoDB", "details": str(e), "code": 500}, touched
+
+    if replaceIssues or linksChanged or not existing_project:
+        rebuildEpicViews(project_name)
+    elif touched:
+        rebuildEpicViews(project_name, touched)
+    return result, touched
+
+def flattenIssues(issues):
+    '''
+    Return every issue of an epic/task/subtask tree once, without the nested lists
+    '''
+    flat = {}
+
+    def visit(issue_data):
+        if issue_data['key'] in flat:
+            return
+        flat[issue_data['key']] = {k: v for k, v in issue_data.items() if k not in ('tasks', 'subtasks')}
+        for child in issue_data.get('tasks', []) + issue_data.get('subtasks', []):
+            visit(child)
+
+    for issue_data in issues:
+        visit(issue_data)
+    return list(flat.values())
+
+def storeIssues(projectName, issues, replaceIssues=False):
+    '''
+    Upsert one document per issue. Existing issues keep their _id, so listing by _id
+    keeps the order they were first ingested in. Returns the keys whose views may change
+    '''
+    db = get_db()
+    issues_collection = db['issues']
+    keys = [issue['key'] for issue in issues]
+    # The stored issues, their old parents and new parents are the ones whose views change
+    touched = set(keys) | {issue.get('parent') for issue in issues}
+    touched |= {issue.get('parent') for issue in issues_collection.find({"project_name": projectName, "key": {"$in": keys}}, {"parent": 1})}
+    touched.discard(None)
+    if issues:
+        issues_collection.bulk_write([
+            ReplaceOne({"project_name": projectName, "key": issue['key']}, {**issue, "project_name": projectName}, upsert=True)
+            for issue in issues
+        ], ordered=False)
+    if replaceIssues:
+        issues_collection.delete_many({"project_name": projectName, "key": {"$nin": keys}})
+    return touched
+
+def migrateProjectIssues():
+    '''
+    Move the issues array of project documents written before the issues collection
+    existed into it. Projects already migrated are skipped, so this is safe to rerun
+    '''
+    db = get_db()
+    projects_collection = db['projects']
+    for project in projects_collection.find({"issues": {"$exists": True}}, {"project_name": 1, "issues": 1}):
+        storeIssues(project['project_name'], flattenIssues(project.get('issues', [])), replaceIssues=True)
+        projects_collection.update_one({"_id": project['_id']}, {"$unset": {"issues": ""}})
+        print(f"Migrated issues of project {project['project_name']}")
+    
+def storeConfluencePages(pages):
+    if not pages:
+        return
+    db = get_db()
+    pages_collection = db['confluence_pages']
+    pages_collection.bulk_write([ReplaceOne({"id": page.get('id')}, page, upsert=True) for page in pages], ordered=False)
+
+def getConfluencePage(page_id):
+    db = get_db()
+    pages_collection = db['confluence_pages']
+    return pages_collection.find_one({"id": page_id})
     
 # ----------------- UPDATE DATA IN DATABASE -----------------
 
 def updateData(projectName, newData):
-    mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-    db = mongo_client['project_db']
+    db = get_db()
     projects_collection = db['projects']
     
     # Check if a project with the given name exists in the database
@@ -59,10 +208,8 @@ def updateData(projectName, newData):
     try:
         # Update the existing project with the new data
         data = projects_collection.find_one({"project_name": projectName})
-        newData['github_link'] = data.get('github_link', []) + newData.get('github_link', [])
-        newData['jira_link'] = data.get('jira_link', []) + newData.get('jira_link', [])
-        newData['docs_link'] = data.get('docs_link', []) + newData.get('docs_link', [])
-        newData['confluence_link'] = data.get('confluence_link', []) + newData.get('confluence_link', [])
+        for field in PROJECT_LINK_FIELDS:
+            newData[field] = mergeLinks(data.get(field, []), newData.get(field, []))
         result = projects_collection.update_one({"project_name": projectName}, {"$set": newData})
         if result.matched_count == 0:
             # No document matched the query to update
@@ -76,11 +223,110 @@ def updateData(projectName, newData):
         return {"error": "Failed to update data in MongoDB", "details": str(e), "code": 500}
     
 
+PROJECT_LINK_FIELDS = ('github_link', 'jira_link', 'docs_link', 'confluence_link')
+
+def linksAdded(project, newData):
+    '''
+    Whether merging newData into the stored project adds a url to any of its link lists
+    '''
+    for field in PROJECT_LINK_FIELDS:
+        urls = {link.get('url') for link in project.get(field) or []}
+        if any(link.get('url') not in urls for link in newData.get(field) or []):
+            return True
+    return False
+
+def mergeLinks(existingLinks, newLinks):
+    '''
+    Append the new link entries whose url is not stored yet, keeping the first day_added
+    '''
+    urls = {link.get('url') for link in existingLinks}
+    merged = list(existingLinks)
+    for link in newLinks:
+        if link.get('url') not in urls:
+            urls.add(link.get('url'))
+            merged.append(link)
+    return merged
+
+# ----------------- SYNC WATERMARK -----------------
+
+def getSyncWatermark(projectName):
+    '''
+    Return the start time of the last successful sync of the project, or None
+    '''
+    db = get_db()
+    projects_collection = db['projects']
+    project = projects_collection.find_one({"project_name": projectName}, {"last_synced": 1})
+    if not project or project.get('last_synced') is None:
+        return None
+    # Mongo hands datetimes back naive, in UTC
+    return project['last_synced'].replace(tzinfo=timezone.utc)
+
+# ----------------- INGESTION JOBS -----------------
+'''
+Ingestion jobs and the one running job per project live here rather than in the worker
+process, so every server process sees them. The running job of a project is held by a
+lock document keyed on the project name
+'''
+
+INGESTION_LOCK_SECONDS = int(os.getenv('INGESTION_LOCK_SECONDS', 1800))  # a lock its job stopped refreshing this long is taken over
+
+def claimIngestion(projectName, jobId):
+    '''
+    Make jobId the running ingestion of the project. Returns None once claimed, or the id
+    of the job already running for the project
+    '''
+    db = get_db()
+    locks_collection = db['ingestion_locks']
+    while True:
+        now = time.time()
+        try:
+            locks_collection.insert_one({"_id": projectName, "job_id": jobId, "heartbeat": now})
+            return None
+        except DuplicateKeyError:
+            pass
+        # The process running the previous job died without releasing it
+        if locks_collection.find_one_and_update({"_id": projectName, "heartbeat": {"$lt": now - INGESTION_LOCK_SECONDS}}, {"$set": {"job_id": jobId, "heartbeat": now}}):
+            return None
+        lock = locks_collection.find_one({"_id": projectName})
+        if lock is not None:
+            return lock['job_id']
+        # Released in between: claim again
+
+def releaseIngestion(projectName, jobId):
+    db = get_db()
+    db['ingestion_locks'].delete_one({"_id": projectName, "job_id": jobId})
+
+def storeIngestionJob(job):
+    '''
+    Save the job's progress, refreshing its project lock while it runs
+    '''
+    db = get_db()
+    db['ingestion_jobs'].replace_one({"_id": job['_id']}, job, upsert=True)
+    if job.get('finished_at') is None:
+        db['ingestion_locks'].update_one({"_id": job['project_name'], "job_id": job['_id']}, {"$set": {"heartbeat": time.time()}})
+
+def getIngestionJob(jobId):
+    db = get_db()
+    return db['ingestion_jobs'].find_one({"_id": jobId})
+
+def deleteIngestionJob(jobId):
+    db = get_db()
+    db['ingestion_jobs'].delete_one({"_id": jobId})
+
+def pruneIngestionJobs(keep):
+    '''
+    Delete finished jobs beyond the newest keep
+    '''
+    db = get_db()
+    jobs_collection = db['ingestion_jobs']
+    old = [job['_id'] for job in jobs_collection.find({"finished_at": {"$ne": None}}, {"_id": 1}).sort("finished_at", -1).skip(keep)]
+    if old:
+        jobs_collection.delete_many({"_id": {"$in": old}})
+
 # ----------------- GET PROJECT LIST FROM DATABASE -----------------
 
 def getProjectListDatabase():
-    mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-    db = mongo_client['project_db']
+    db = get_db()
     projects_collection = db['projects']
     project_list = projects_collection.distinct("project_name")
     return jsonify(project_list)
@@ -88,16 +334,16 @@ def getProjectListDatabase():
 # ----------------- GET EPIC LIST FROM DATABASE -----------------
 
 def getEpicListDatabase(projectName):
-    mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-    db = mongo_client['project_db']
+    db = get_db()
     projects_collection = db['projects']
-    project = projects_collection.find_one({"project_name": projectName}, {"issues": 1})
+    issues_collection = db['issues']
+    project = projects_collection.find_one({"project_name": projectName}, {"_id": 1})
     
     if not project:
         return None
     
-    issues = project.get('issues', [])
-    epics = [{'name':issue.get('summary'), 'key': issue.get('key')} for issue in issues if issue.get('issue_type') == 'Epic']
+    issues = issues_collection.find({"project_name": projectName, "issue_type": "Epic"}, {"summary": 1, "key": 1}).sort("_id", 1)
+    epics = [{'name':issue.get('summary'), 'key': issue.get('key')} for issue in issues]
     result = {
         "project_name": projectName,
         "epics": epics
@@ -108,76 +354,90 @@ def getEpicListDatabase(projectName):
 # ----------------- GET TICKET LIST FROM DATABASE -----------------
 
 def getTicketListDatabase(projectName, epicKey):
-    mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-    db = mongo_client['project_db']
+    '''
+    Serve the ticket list from the epic's materialized view, building it on a miss
+    '''
+    db = get_db()
+    views_collection = db['epic_views']
+    view = views_collection.find_one({"project_name": projectName, "epic_key": epicKey}, {"view": 1})
+    if view:
+        return jsonify(view['view'])
+
+    finalResult = computeEpicView(projectName, epicKey)
+    if 'error' in finalResult:
+        return finalResult
+    storeEpicView(projectName, epicKey, finalResult)
+    return jsonify(finalResult)
+
+def computeEpicView(projectName, epicKey):
+    '''
+    Build the ticket list of an epic: its tasks, bugs and stories, then the project
+    links and the links of the epic and its tasks
+    '''
+    db = get_db()
     projects_collection = db['projects']
+    issues_collection = db['issues']
     
     # Query to find the project by project_name
-    project = projects_collection.find_one({"project_name": projectName}, {"issues": 1})
+    record = projects_collection.find_one({"project_name": projectName}, {"github_link": 1, "docs_link": 1, "jira_link": 1, "confluence_link": 1})
     
-    if not project:
+    if not record:
         return {"error": "Project not found"}
     
-    issues = project.get('issues', [])
-    epic = next((issue for issue in issues if issue.get('key') == epicKey and issue.get('issue_type') == 'Epic'), None)
+    epic = issues_collection.find_one({"project_name": projectName, "key": epicKey, "issue_type": "Epic"}, {"summary": 1, "source": 1})
     
     if not epic:
         return {"error": "Epic not found in the project"}
     
-    related_issues = [issue for issue in issues if issue.get('parent') == epicKey]
-    ticket = [{"name": issue.get('summary'), "key": issue.get("key"), "type": issue.get('issue_type')} for issue in related_issues if (issue.get('issue_type') == 'Task' or issue.get('issue_type') == 'Bug' or issue.get('issue_type') == 'Story')]
-    related_issues = epic.get('tasks', [])
-    ticket.extend([{"name": issue.get('summary'), "key": issue.get("key"), "type": issue.get('issue_type')} for issue in related_issues if (issue.get('issue_type') == 'Task' or issue.get('issue_type') == 'Bug' or issue.get('issue_type') == 'Story')])
+    related_issues = list(issues_collection.find(
+        {"project_name": projectName, "parent": epicKey, "issue_type": {"$in": ["Task", "Bug", "Story"]}},
+        {"summary": 1, "key": 1, "issue_type": 1, "source": 1}
+    ).sort("_id", 1))
+    # Bugs and stories are listed before the epic's tasks
+    tasks = [issue for issue in related_issues if issue.get('issue_type') == 'Task']
+    ticket = [{"name": issue.get('summary'), "key": issue.get("key"), "type": issue.get('issue_type')} for issue in related_issues if issue.get('issue_type') != 'Task']
+    ticket.extend([{"name": issue.get('summary'), "key": issue.get("key"), "type": issue.get('issue_type')} for issue in tasks])
     
-    data = projects_collection.find({"project_name": projectName})
-    for record in data:
-        entry = []
-        i = 1
-        # Check github links
-        github_links = record.get('github_link', {})
-        if github_links:
-            for link in github_links:
-                entry.append({"url": link.get('url'), "name": "External Github " + str(i), "type": "Github"})
-                i += 1
-
-        i = 1
-        # Check docs links
-        docs_link = record.get('docs_link', {})
-        if docs_link:
-            for link in docs_link:
-                entry.append({"url": link.get('url'), "name": "External Docs " + str(i), "type": "Docs"})
-                i += 1
-
-        i = 1
-        # Check jira links
-        jira_link = record.get('jira_link', {})
-        if jira_link:
-            for link in jira_link:
-                entry.append({"url": link.get('url'), "name": "External Jira " + str(i), "type": "Jira"})
-                i += 1
-
-        i = 1
-        # Check confluence links
-        confluence_link = record.get('confluence_link', {})
-        if confluence_link:
-            for link in confluence_link:
-                entry.append({"url": link.get('url'), "name": "External Confluence " + str(i), "type": "Confluence"})
-                i += 1
-
-        # Check confluence links in issues
-        issues = record.get('issues', [])
-        epics = next((issue for issue in issues if issue.get('key') == epicKey and issue.get('issue_type') == 'Epic'), None)
-        entry.extend([{"url": j.get('url'), "name": j.get('title'), "type": "Confluence"} for j in [i for i in epics.get('source', {}).get('confluence', [])]])
-        entry.extend([{"url": j.get('url'), "name": j.get('title'), "type": "Docs"} for j in [i for i in epics.get('source', {}).get('googleDocs', [])]])
-        entry.extend([{"url": j.get('url'), "name": j.get('title'), "type": "Other"} for j in [i for i in epics.get('source', {}).get('otherLinks', [])]])
-
-        tasks = epic.get('tasks', [])
-        for task in tasks:
-            entry.extend([{"url": j.get('url'), "name": j.get('title'), "type": "Confluence"} for j in [i for i in task.get('source', {}).get('confluence', [])]])
-            entry.extend([{"url": j.get('url'), "name": j.get('title'), "type": "Docs"} for j in [i for i in task.get('source', {}).get('googleDocs', [])]])
-            entry.extend([{"url": j.get('url'), "name": j.get('title'), "type": "Other"} for j in [i for i in task.get('source', {}).get('otherLinks', [])]])
-
-        ticket.extend(entry)
+    entry = []
+    i = 1
+    # Check github links
+    github_links = record.get('github_link', {})
+    if github_links:
+        for link in github_links:
+            entry.append({"url": link.get('url'), "name": "External Github " + str(i), "type": "Github"})
+            i += 1
+
+    i = 1
+    # Check docs links
+    docs_link = record.get('docs_link', {})
+    if docs_link:
+        for link in docs_link:
+            entry.append({"url": link.get('url'), "name": "External Docs " + str(i), "type": "Docs"})
+            i += 1
+
+    i = 1
+    # Check jira links
+    jira_link = record.get('jira_link', {})
+    if jira_link:
+        for link in jira_link:
+            entry.append({"url": link.get('url'), "name": "External Jira " + str(i), "type": "Jira"})
+            i += 1
+
+    i = 1
+    # Check confluence links
+    confluence_link = record.get('confluence_link', {})
+    if confluence_link:
+        for link in confluence_link:
+            entry.append({"url": link.get('url'), "name": "External Confluence " + str(i), "type": "Confluence"})
+            i += 1
+
+    # Check confluence links in issues
+    for issue in [epic] + tasks:
+        entry.extend([{"url": j.get('url'), "name": j.get('title'), "type": "Confluence"} for j in issue.get('source', {}).get('confluence', [])])
+        entry.extend([{"url": j.get('url'), "name": j.get('title'), "type": "Docs"} for j in issue.get('source', {}).get('googleDocs', [])])
+        entry.extend([{"url": j.get('url'), "name": j.get('title'), "type": "Other"} for j in issue.get('source', {}).get('otherLinks', [])])
+
+    ticket.extend(entry)
 
     finalResult = {
         "projectName": projectName,
@@ -185,95 +445,179 @@ def getTicketListDatabase(projectName, epicKey):
         "tickets": ticket
     }
 
-    return jsonify(finalResult)
+    return finalResult
 
-# ----------------- GET LINK BASED ON DATA FROM DATABASE -----------------
+# ----------------- MATERIALIZED EPIC VIEWS -----------------
 
-def getLinkfromDatabase(projectName, epicKey=None, ticketKey=None):
-    mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-    db = mongo_client['project_db']
-    projects_collection = db['projects']
-    result = []
+def storeEpicView(projectName, epicKey, finalResult):
+    db = get_db()
+    views_collection = db['epic_views']
+    views_collection.replace_one(
+        {"project_name": projectName, "epic_key": epicKey},
+        {"project_name": projectName, "epic_key": epicKey, "view": finalResult},
+        upsert=True
+    )
 
-    data = projects_collection.find({"project_name": projectName})
-    data_list = list(data)  # Convert cursor to list for better logging
-    print(f"Query result for project {projectName}: {data_list}")
+def rebuildEpicViews(projectName, epicKeys=None):
+    '''
+    Recompute the views of the given keys that are epics, or of every epic of the
+    project when epicKeys is None. Views of epics that no longer exist are dropped
+    '''
+    db = get_db()
+    issues_collection = db['issues']
+    views_collection = db['epic_views']
+    query = {"project_name": projectName, "issue_type": "Epic"}
+    if epicKeys is not None:
+        query["key"] = {"$in": list(epicKeys)}
+    existing = [epic['key'] for epic in issues_collection.find(query, {"key": 1})]
+
+    for epicKey in existing:
+        finalResult = computeEpicView(projectName, epicKey)
+        if 'error' not in finalResult:
+            storeEpicView(projectName, epicKey, finalResult)
+
+    stale = {"project_name": projectName, "epic_key": {"$nin": existing}}
+    if epicKeys is not None:
+        stale["epic_key"]["$in"] = list(epicKeys)
+    views_collection.delete_many(stale)
+
+def checkEpicViews(projectName):
+    '''
+    Compare every stored view of the project with a fresh computation.
+    Returns the epic keys whose view is missing or differs
+    '''
+    db = get_db()
+    issues_collection = db['issues']
+    views_collection = db['epic_views']
+    views = {view['epic_key']: view['view'] for view in views_collection.find({"project_name": projectName})}
+    mismatched = []
+    for epic in issues_collection.find({"project_name": projectName, "issue_type": "Epic"}, {"key": 1}):
+        if views.pop(epic['key'], None) != computeEpicView(projectName, epic['key']):
+            mismatched.append(epic['key'])
+    # Views left over belong to epics that no longer exist
+    return mismatched + list(views)
 
-    for record in data_list:
-        entry = {
-            "project_name": record.get('project_name'),
-            "links_status": []
-        }
+# ----------------- GET LINK BASED ON DATA FROM DATABASE -----------------
 
-        # Function to process links
-        def process_links(links, parent):
-            for link in links:
-                entry["links_status"].append({
-                    "url": link.get('url'),
-                    "status": "OK",
-                    "date": datetime.strptime(link.get("created_date").split('T')[0], '%Y-%m-%d').strftime('%d-%m-%Y') if "created_date" in link else "N/A",
-                    "parent": parent
-                })
+GET_LINK_PAGE_SIZE = int(os.getenv('GET_LINK_PAGE_SIZE', 200))
+GET_LINK_MAX_PAGE_SIZE = 1000
+
+# dd-mm-yyyy from the ISO created_date of a link, computed by the server
+LINK_DATE = {"$cond": [
+    {"$gt": ["$links.created_date", None]},
+    {"$concat": [
+        {"$substr": ["$links.created_date", 8, 2]}, "-",
+        {"$substr": ["$links.created_date", 5, 2]}, "-",
+        {"$substr": ["$links.created_date", 0, 4]}
+    ]},
+    "N/A"
+]}
+
+def encodeLinkCursor(row):
+    return base64.urlsafe_b64encode(json.dumps([row['group'], str(row['_id']), row['idx']]).encode()).decode()
+
+def decodeLinkCursor(cursor):
+    '''
+    Position written by encodeLinkCursor. Raises ValueError when the cursor is malformed
+    '''
+    try:
+        group, order, idx = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(group, int) or not isinstance(idx, int):
+            raise ValueError("Invalid cursor")
+        return group, ObjectId(order), idx
+    except (ValueError, TypeError, AttributeError, InvalidId):
+        raise ValueError("Invalid cursor")
+
+def linkPipeline(match, links, group, parent, after, limit):
+    '''
+    Unwind the links of the matched documents into rows sorted by (group, _id, idx),
+    starting after the cursor position
+    '''
+    pipeline = [
+        {"$match": match},
+        {"$project": {"group": group, "parent": parent, "links": {"$concatArrays": [{"$ifNull": [field, []]} for field in links]}}},
+        {"$unwind": {"path": "$links", "includeArrayIndex": "idx"}},
+    ]
+    if after is not None:
+        group_after, order_after, idx_after = after
+        pipeline.append({"$match": {"$or": [
+            {"group": {"$gt": group_after}},
+            {"group": group_after, "_id": {"$gt": order_after}},
+            {"group": group_after, "_id": order_after, "idx": {"$gt": idx_after}}
+        ]}})
+    pipeline += [
+        {"$sort": {"group": 1, "_id": 1, "idx": 1}},
+        {"$limit": limit},
+        {"$project": {"group": 1, "idx": 1, "parent": 1, "url": "$links.url", "status": {"$literal": "OK"}, "date": LINK_DATE}}
+    ]
+    return pipeline
+
+def getLinkfromDatabase(projectName, epicKey=None, ticketKey=None, cursor=None, limit=GET_LINK_PAGE_SIZE):
+    '''
+    Return one page of the project links followed by the links of the epic and its
+    tickets (or of every issue when no epic is given). next_cursor resumes the listing
+    '''
+    db = get_db()
+    projects_collection = db['projects']
+    issues_collection = db['issues']
+    limit = max(1, min(limit, GET_LINK_MAX_PAGE_SIZE))
+    after = decodeLinkCursor(cursor) if cursor else None
+
+    if after is None and not projects_collection.find_one({"project_name": projectName}, {"_id": 1}):
+        return []
+
+    # One extra row tells whether there is a next page
+    rows = []
+    if after is None or after[0] == 0:
+        rows += projects_collection.aggregate(linkPipeline(
+            {"project_name": projectName},
+            ["$github_link", "$docs_link", "$jira_link", "$confluence_link"],
+            {"$literal": 0}, {"$literal": projectName}, after, limit + 1))
+
+    if len(rows) <= limit:
+        issue_match = {"project_name": projectName}
+        group = {"$literal": 1}
+        if epicKey:
+            # The epic comes first, then its tickets
+            tickets = {"parent": epicKey, "key": ticketKey} if ticketKey else {"parent": epicKey}
+            issue_match["$or"] = [{"key": epicKey, "issue_type": "Epic"}, tickets]
+            group = {"$cond": [{"$eq": ["$key", epicKey]}, 1, 2]}
+        rows += issues_collection.aggregate(linkPipeline(
+            issue_match,
+            ["$source.confluence", "$source.googleDocs", "$source.otherLinks"],
+            group, "$key", after if after and after[0] > 0 else None, limit + 1 - len(rows)))
+
+    next_cursor = encodeLinkCursor(rows[limit - 1]) if len(rows) > limit else None
+    entry = {
+        "project_name": projectName,
+        "links_status": [{"url": row.get('url'), "status": row['status'], "date": row['date'], "parent": row['parent']} for row in rows[:limit]],
+        "next_cursor": next_cursor
+    }
+    logger.info("getLink project=%s epic=%s ticket=%s links=%d next_cursor=%s", projectName, epicKey, ticketKey, len(entry["links_status"]), next_cursor is not None)
+    return [entry]
 
-        # Process general links
-        process_links(record.get('github_link', []), projectName)
-        process_links(record.get('docs_link', []), projectName)
-        process_links(record.get('jira_link', []), projectName)
-        process_links(record.get('confluence_link', []), projectName)
-
-        # Process issue links
-        issues = record.get('issues', [])
-        for epic in issues:
-            if epicKey and epic.get('key') == epicKey and epic.get('issue_type') == 'Epic':
-                process_links(epic.get('source', {}).get('confluence', []), epicKey)
-                process_links(epic.get('source', {}).get('googleDocs', []), epicKey)
-                process_links(epic.get('source', {}).get('otherLinks', []), epicKey)
-
-                if ticketKey:
-                    task = next((task for task in epic.get('tasks', []) if task.get('key') == ticketKey), None)
-                    if task:
-                        process_links(task.get('source', {}).get('confluence', []), ticketKey)
-                        process_links(task.get('source', {}).get('googleDocs', []), ticketKey)
-                        process_links(task.get('source', {}).get('otherLinks', []), ticketKey)
-                else:
-                    for task in epic.get('tasks', []):
-                        process_links(task.get('source', {}).get('confluence', []), task.get('key'))
-                        process_links(task.get('source', {}).get('googleDocs', []), task.get('key'))
-                        process_links(task.get('source', {}).get('otherLinks', []), task.get('key'))
-            else:
-                process_links(epic.get('source', {}).get('confluence', []), epic.get('key'))
-                process_links(epic.get('source', {}).get('googleDocs', []), epic.get('key'))
-                process_links(epic.get('source', {}).get('otherLinks', []), epic.get('key'))
-
-                for task in epic.get('tasks', []):
-                    process_links(task.get('source', {}).get('confluence', []), task.get('key'))
-                    process_links(task.get('source', {}).get('googleDocs', []), task.get('key'))
-                    process_links(task.get('source', {}).get('otherLinks', []), task.get('key'))
-
-        result.append(entry)
-        print(f"Processed record: {entry}")
-
-    return result
 # ---------------------------- PROMPT WITH AGENT ----------------------------
 def setPromptwithAgent(contextualize_q_system_prompt, qa_system_prompt, role):
-    mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-    db = mongo_client['project_db']
+    db = get_db()
     projects_collection = db['prompts']
     if role == "CLARIFY" or role == "CHAT" or role == "SUGGESTION":
         existing_role = projects_collection.find_one({"role": role})
         if existing_role:
             try:
+                # The version only moves when the text changes; caches compare it to reload
                 result = projects_collection.update_one(
-                    {"role": role},
+                    {"role": role, "$or": [
+                        {"contextualize_q_system_prompt": {"$ne": contextualize_q_system_prompt}},
+                        {"qa_system_prompt": {"$ne": qa_system_prompt}}
+                    ]},
                     {"$set": {
                         "contextualize_q_system_prompt": contextualize_q_system_prompt,
                         "qa_system_prompt": qa_system_prompt
-                    }}
+                    }, "$inc": {"version": 1}}
                 )
-                if result.matched_count == 0:
-                    return {"error": "No document found with the given role", "code": 404}
                 if result.modified_count == 0:
                     return {"success": "Prompt was not updated (it may already be up-to-date)", "code": 304}
+                _prompt_cache.pop(role, None)
                 return {"success": "Prompt updated successfully", "code": 200}
             except Exception as e:
                 return {"error": "Failed to update prompt", "details": str(e), "code": 500}
@@ -282,8 +626,10 @@ def setPromptwithAgent(contextualize_q_system_prompt, qa_system_prompt, role):
                 projects_collection.insert_one({
                     "role": role,
                     "contextualize_q_system_prompt": contextualize_q_system_prompt,
-                    "qa_system_prompt": qa_system_prompt
+                    "qa_system_prompt": qa_system_prompt,
+                    "version": 1
                 })
+                _prompt_cache.pop(role, None)
                 return {"success": "Prompt added successfully", "code": 200}
             except Exception as e:
                 return {"error": "Failed to add prompt", "details": str(e), "code": 500}
@@ -291,83 +637,196 @@ def setPromptwithAgent(contextualize_q_system_prompt, qa_system_prompt, role):
         return {"error": "Invalid role", "code": 400}
     
 # -------------------------- AGENT DATABASE FUNCTIONS --------------------------
+
+# Prompts are cached per role. Other workers see a /setPrompt once their cached entry
+# is older than PROMPT_CACHE_TTL seconds and the stored version has moved
+PROMPT_CACHE_TTL = float(os.getenv('PROMPT_CACHE_TTL', 30))
+_prompt_cache = {}
+
 def getPromptwithAgent(role):
-    mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-    db = mongo_client['project_db']
+    db = get_db()
     projects_collection = db['prompts']
     if role == "CLARIFY" or role == "CHAT" or role == "SUGGESTION":
+        cached = _prompt_cache.get(role)
+        if cached and time.monotonic() - cached['checked_at'] < PROMPT_CACHE_TTL:
+            return cached['prompt']
+        if cached:
+            # Cheap check: only the version is read
+            current = projects_collection.find_one({"role": role}, {"version": 1})
+            if current and current.get('version', 0) == cached['prompt']['version']:
+                cached['checked_at'] = time.monotonic()
+                return cached['prompt']
+
         existing_role = projects_collection.find_one({"role": role})
         if existing_role:
-            return {
+            prompt = {
                 "contextualize_q_system_prompt": "".join(existing_role.get('contextualize_q_system_prompt', [])),
-                "qa_system_prompt": "".join(existing_role.get('qa_system_prompt', []))
+                "qa_system_prompt": "".join(existing_role.get('qa_system_prompt', [])),
+                "version": existing_role.get('version', 0)
             }
+            _prompt_cache[role] = {"prompt": prompt, "checked_at": time.monotonic()}
+            return prompt
         else:
             return {"error": "Prompt not found", "code": 404}
     else:
         return {"error": "Invalid role", "code": 400}
 
 
+# Only the most recent messages of a session are loaded into the chat prompt
+HISTORY_WINDOW_MESSAGES = int(os.getenv('HISTORY_WINDOW_MESSAGES', 20))
+HISTORY_WINDOW_TOKENS = int(os.getenv('HISTORY_WINDOW_TOKENS', 0))  # 0 disables the token budget
+
+def flushHistoryWrites(batch):
+    '''
+    Write a batch of ("question", document) and ("message", document) entries from the
+    write-behind buffer. Questions go first, so a session's history document exists
+    before its messages reserve sequence numbers. Retried batches keep the _id and seq
+    they were given, and the duplicates are skipped
+    '''
+    db = get_db()
+    questions = [document for kind, document in batch if kind == 'question']
+    messages = [document for kind, document in batch if kind == 'message']
+    if questions:
+        insertIgnoringDuplicates(db['history'], questions)
+    if messages:
+        sessions = {}
+        for message in messages:
+            if 'seq' not in message:
+                sessions.setdefault(message['sessionID'], []).append(message)
+        for session_id, session_messages in sessions.items():
+            # One reservation per session covers all of its messages in the batch
+            session = db['history'].find_one_and_update(
+                {"sessionID": session_id},
+                {"$inc": {"message_count": len(session_messages)}},
+                projection={"message_count": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            first = session['message_count'] - len(session_messages) + 1
+            for seq, message in enumerate(session_messages, first):
+                message['seq'] = seq
+        insertIgnoringDuplicates(db['history_messages'], messages)
+
+def insertIgnoringDuplicates(collection, documents):
+    try:
+        collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+            raise
+
+_history_writes = WriteBehindBuffer(flushHistoryWrites)
+
 def store_message(session_id, sender, content, input_token, output_token):
-    mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-    db = mongo_client['project_db']
-    projects_collection = db['history']
-    message = {
+    '''
+    Append a message to the session as its own document. The write is queued and
+    batched; the sequence number is reserved when the batch is flushed
+    '''
+    _history_writes.add(("message", {
+        "sessionID": session_id,
         "sender": sender,
         "content": content,
         "input_token": input_token,
         "output_token": output_token,
         "timestamp": datetime.now()
-    }
-
-    projects_collection.update_one(
-        {"sessionID": session_id},
-        {"$push": {"messages": message}},
-        upsert=True
-    )
+    }))
 
 # Function to get session history from MongoDB
-def get_session_history(session_id):
-    mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-    db = mongo_client['project_db']
-    projects_collection = db['history']
-    session = projects_collection.find_one({"sessionID": session_id})
+SESSION_HISTORY_PROJECTION = {"sender": 1, "content": 1, "input_token": 1, "output_token": 1, "seq": 1}
+
+def pendingSessionMessages(session_id):
+    return [document for kind, document in _history_writes.pending(lambda item: item[0] == 'message' and item[1]['sessionID'] == session_id)]
+
+def buildSessionHistory(pending, stored, max_messages, max_tokens):
+    '''
+    Newest-first window over the pending and the stored messages (newest first), as a
+    ChatMessageHistory in conversation order
+    '''
+    # Messages still in the write-behind buffer are newer than anything stored
+    pending_seqs = {message['seq'] for message in pending if 'seq' in message}
+    stored = (message for message in stored if message['seq'] not in pending_seqs)
+
+    recent = []
+    used_tokens = 0
+    for message in islice(chain(reversed(pending), stored), max_messages or None):
+        tokens = (message.get('input_token') or 0) + (message.get('output_token') or 0)
+        if max_tokens and recent and used_tokens + tokens > max_tokens:
+            break
+        used_tokens += tokens
+        recent.append(message)
+
+    history = ChatMessageHistory()
+    for message in reversed(recent):
+        if message['sender'] == 'human':
+            history.add_message(HumanMessage(content=message['content']))
+        else:
+            history.add_message(AIMessage(content=message['content']))
+    return history
+
+def get_session_history(session_id, max_messages=HISTORY_WINDOW_MESSAGES, max_tokens=HISTORY_WINDOW_TOKENS):
+    '''
+    Load the newest max_messages messages of the session, stopping early once their
+    stored token counts exceed max_tokens
+    '''
+    db = get_db()
+    messages_collection = db['history_messages']
     try:
-        history = ChatMessageHistory()
-        if session and "messages" in session:
-            for message in session["messages"]:
-                if message['sender'] == 'human':
-                    history.add_message(HumanMessage(content=message['content']))
-                else:
-                    history.add_message(AIMessage(content=message['content']))
-        return history
+        pending = pendingSessionMessages(session_id)
+        cursor = messages_collection.find({"sessionID": session_id}, SESSION_HISTORY_PROJECTION).sort("seq", -1).limit(max_messages or 0)
+        return buildSessionHistory(pending, cursor, max_messages, max_tokens)
     except Exception as e:
         return {"error": "Failed to get session history", "details": str(e), "code": 500}
 
+def migrateSessionHistory():
+    '''
+    Move the messages array of history documents written before messages had their
+    own collection. Messages are keyed by (sessionID, seq), so a run interrupted between
+    the insert and the unset inserts only what is missing when it is rerun
+    '''
+    db = get_db()
+    projects_collection = db['history']
+    messages_collection = db['history_messages']
+    for session in projects_collection.find({"messages": {"$exists": True}}, {"sessionID": 1, "messages": 1}):
+        messages = session.get('messages', [])
+        if messages:
+            insertIgnoringDuplicates(messages_collection, [{"sessionID": session['sessionID'], "seq": seq, **message} for seq, message in enumerate(messages, 1)])
+        projects_collection.update_one({"_id": session['_id']}, {"$unset": {"messages": ""}, "$set": {"message_count": len(messages)}})
+
 def deleteSessionHistory(session_id):
-    mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-    db = mongo_client['project_db']
+    db = get_db()
     projects_collection = db['history']
+    messages_collection = db['history_messages']
     try:
+        _history_writes.flush()
         projects_collection.delete_one({"sessionID": session_id})
+        messages_collection.delete_many({"sessionID": session_id})
         return {"success": "Session history deleted successfully", "code": 200}
     except Exception as e:
         return {"error": "Failed to delete session history", "details": str(e), "code": 500}
 
 def insertClarifyQuestionHistory(formatted_questions):
-    mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-    db = mongo_client['project_db']
-    projects_collection = db['history']
     try:
         for question in formatted_questions:
-            projects_collection.insert_one(question)
+            _history_writes.add(("question", question))
         return {"success": "Clarify questions added successfully", "code": 200}
     except Exception as e:
         return {"error": "Failed to add clarify questions", "details": str(e), "code": 500}
     
+def insertClarifyQuestionsBulk(formatted_questions):
+    '''
+    Store a batch of generated questions with one insert_many, bypassing the write-behind buffer
+    '''
+    if not formatted_questions:
+        return {"success": "No clarify questions to add", "code": 200}
+    db = get_db()
+    projects_collection = db['history']
+    try:
+        projects_collection.insert_many(formatted_questions, ordered=False)
+        return {"success": "Clarify questions added successfully", "code": 200}
+    except Exception as e:
+        return {"error": "Failed to add clarify questions", "details": str(e), "code": 500}
+
 def deleteClarifyQuestionHistory(sessionId, project_name, epic_key, ticket_key = None, url = None):
-    mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-    db = mongo_client['project_db']
+    db = get_db()
     projects_collection = db['history']
     try:
         projects_collection.delete_one({"sessionID": sessionId, "project_name": project_name, "epic_key": epic_key, "ticket_key": ticket_key, "url": url})
@@ -375,32 +834,148 @@ def deleteClarifyQuestionHistory(sessionId, project_name, epic_key, ticket_key =
     except Exception as e:
         return {"error": "Failed to delete clarify question", "details": str(e), "code": 500}
     
+def pendingClarifyQuestion(query):
+    pending = _history_writes.pending(lambda item: item[0] == 'question' and all(item[1].get(field) == value for field, value in query.items()))
+    return pending[0][1] if pending else None
+
 def getClarifyQuestionHistory(sessionId, project_name, epic_key, ticket_key = None, url = None):
-    mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-    db = mongo_client['project_db']
+    db = get_db()
     projects_collection = db['history']
     try:
+        query = {"sessionID": sessionId, "project_name": project_name, "epic_key": epic_key, "ticket_key": ticket_key, "url": url}
+        pending = pendingClarifyQuestion(query)
+        if pending:
+            return pending.get('question')
         clarify_question = projects_collection.find_one({"sessionID": sessionId, "project_name": project_name, "epic_key": epic_key, "ticket_key": ticket_key, "url": url})
         return clarify_question.get('question')
     except Exception as e:
         return {"error": "Failed to get clarify question", "details": str(e), "code": 500}
+
+def issueKeyOrder(key):
+    # Jira keys sort by their number, so PROJ-2 comes before PROJ-10
+    prefix, _, number = key.rpartition('-')
+    return (prefix, int(number)) if number.isdigit() else (key, -1)
+
+def getEpicTicketKeys(projectName, epicKey):
+    db = get_db()
+    issues_collection = db['issues']
+    return sorted((issue['key'] for issue in issues_collection.find({"project_name": projectName, "parent": epicKey}, {"key": 1})), key=issueKeyOrder)
+
+def getIndexSources(projectName, keys=None):
+    '''
+    Yield the texts the retrieval index holds for a project, scoped the same way as
+    getDetailsfromDatabase: each ticket under its epic, and each Confluence page under
+    the issue that links it. With keys, only the sources of those issues
+    '''
+    db = get_db()
+    issues_collection = db['issues']
+    pages_collection = db['confluence_pages']
+    query = {"project_name": projectName}
+    if keys is not None:
+        query["key"] = {"$in": list(keys)}
+    issues = list(issues_collection.find(query, {"key": 1, "parent": 1, "summary": 1, "description": 1, "source.confluence": 1}))
+    page_ids = {link.get('id') for issue in issues for link in issue.get('source', {}).get('confluence', []) if 'content' not in link}
+    pages = {page['id']: page for page in pages_collection.find({"id": {"$in": list(page_ids)}}, {"id": 1, "content": 1})}
+    for issue in issues:
+        yield {
+            "source_id": f"issue:{issue['key']}",
+            "issue_key": issue['key'],
+            "epic_key": issue.get('parent') or issue['key'],
+            "ticket_key": issue['key'] if issue.get('parent') else "",
+            "url": "",
+            "title": issue.get('summary') or "",
+            "content": issue.get('description') or ""
+        }
+        for link in issue.get('source', {}).get('confluence', []):
+            # Older documents still embed the page content in the link entry
+            page = link if 'content' in link else pages.get(link.get('id'))
+            if not page or not link.get('url'):
+                continue
+            yield {
+                "source_id": f"page:{issue['key']}:{link['url']}",
+                "issue_key": issue['key'],
+                "epic_key": issue['key'],
+                "ticket_key": "",
+                "url": link['url'],
+                "title": link.get('title') or "",
+                "content": page.get('content') or ""
+            }
+
+def getIndexVersion(projectName):
+    '''
+    Version of the project's retrieval index, bumped by every sync that changes it and
+    shared by all processes. None until the index has been built
+    '''
+    db = get_db()
+    projects_collection = db['projects']
+    project = projects_collection.find_one({"project_name": projectName}, {"index_version": 1})
+    return project.get('index_version') if project else None
+
+def bumpIndexVersion(projectName):
+    db = get_db()
+    projects_collection = db['projects']
+    project = projects_collection.find_one_and_update({"project_name": projectName}, {"$inc": {"index_version": 1}}, projection={"index_version": 1}, return_document=ReturnDocument.AFTER)
+    return project.get('index_version') if project else None
+
+# --------------------- AGENT RESULT CACHE ---------------------
+
+def getAgentResult(key):
+    db = get_db()
+    results_collection = db['agent_results']
+    return results_collection.find_one_and_update({"_id": key}, {"$set": {"last_used": datetime.now(timezone.utc)}}, projection={"response": 1})
+
+def getAgentResultCandidates(scope_key):
+    '''
+    Cached results generated from the same role, prompt, model and context, for the
+    semantic lookup
+    '''
+    db = get_db()
+    results_collection = db['agent_results']
+    return list(results_collection.find({"scope_key": scope_key, "question_embedding": {"$exists": True}}, {"response": 1, "question_embedding": 1}))
+
+def storeAgentResult(result):
+    '''
+    Upsert a cached result and evict the least recently used once the collection holds
+    more than AGENT_RESULT_MAX_ENTRIES. Expired results are removed by the TTL index
+    '''
+    db = get_db()
+    results_collection = db['agent_results']
+    now = datetime.now(timezone.utc)
+    results_collection.replace_one({"_id": result['_id']}, {**result, "created_at": now, "last_used": now}, upsert=True)
+    surplus = results_collection.estimated_document_count() - AGENT_RESULT_MAX_ENTRIES
+    if surplus > 0:
+        oldest = [result['_id'] for result in results_collection.find({}, {"_id": 1}).sort("last_used", 1).limit(surplus)]
+        results_collection.delete_many({"_id": {"$in": oldest}})
+
+def invalidateAgentResults(projectName, sourceIds):
+    '''
+    Drop cached results whose context came from any of the given index sources
+    '''
+    if not sourceIds:
+        return 0
+    db = get_db()
+    results_collection = db['agent_results']
+    return results_collection.delete_many({"project_name": projectName, "source_ids": {"$in": list(sourceIds)}}).deleted_count
+
 # --------------------- GET LINK DETAILS FROM DATABASE ---------------------
 '''
 This supports only Confluence links in Epic and Ticket description for now
 '''
 def getDetailsfromDatabase(project_name, epic_key, ticket_key = None, url = None):
-    mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-    db = mongo_client['project_db']
-    projects_collection = db['projects']
+    db = get_db()
+    issues_collection = db['issues']
     try:
-        project = projects_collection.find_one({"project_name": project_name})
-        epic = next((epic for epic in project.get('issues', []) if epic.get('key') == epic_key), None)
         if ticket_key is not None:
-            ticket = next((ticket for ticket in epic.get('tasks', []) if ticket.get('key') == ticket_key), None)
+            ticket = issues_collection.find_one({"project_name": project_name, "key": ticket_key, "parent": epic_key}, {"description": 1, "summary": 1})
             return {"content": ticket.get('description', []), "title": ticket.get('summary', [])} if ticket is not None else {"error": "Ticket not found in the epic", "code": 404}
         elif url is not None:
+            epic = issues_collection.find_one({"project_name": project_name, "key": epic_key}, {"source.confluence": 1})
             data = next((link for link in epic.get('source', {}).get('confluence', []) if link.get('url') == url), None)
-            return {"content": data.get('content', []), "title": data.get('title', [])} if data is not None else {"error": "Link not found in the epic", "code": 404}
+            if data is None:
+                return {"error": "Link not found in the epic", "code": 404}
+            # Older documents still embed the page content in the link entry
+            page = getConfluencePage(data.get('id')) if 'content' not in data else data
+            return {"content": (page or {}).get('content', []), "title": data.get('title', [])}
     except Exception as e:
         return {"error": "Failed to get details from database (database is not available)", "details": str(e), "code": 500}
             
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+load_dotenv()
+
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', '.embedding_cache.sqlite3')
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', 200000))
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 256))  # texts per embedding request on a miss
+SQLITE_MAX_PARAMS = 500  # stays under SQLite's bound-parameter limit
+
+# ---------------------------- EMBEDDING CACHE ----------------------------
+
+class CachedEmbeddings(Embeddings):
+    '''
+    Embeddings in front of another Embeddings, keyed by model name and a hash of the
+    text. Vectors are stored as float32 in SQLite; past max_entries the least recently
+    used are evicted. Misses are deduplicated and embedded in batches
+    '''
+    def __init__(self, embeddings, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES, batch_size=EMBEDDING_BATCH_SIZE, model=None):
+        self.embeddings = embeddings
+        self.model = model or getattr(embeddings, 'model', None) or type(embeddings).__name__
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+        self._entries = self._connection.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model}\0{text}".encode('utf-8')).hexdigest()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "model": self.model,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+                "entries": self._entries,
+                "max_entries": self.max_entries
+            }
+
+    def _lookup(self, keys):
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), SQLITE_MAX_PARAMS):
+                batch = keys[start:start + SQLITE_MAX_PARAMS]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._connection.execute(f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', batch).fetchall()
+                found.update((key, np.frombuffer(vector, dtype=np.float32).tolist()) for key, vector in rows)
+            with self._connection:
+                self._connection.executemany('UPDATE embeddings SET last_used = ? WHERE key = ?', [(now, key) for key in found])
+        return found
+
+    def _store(self, vectors):
+        now = time.time()
+        with self._lock, self._connection:
+            before = self._connection.total_changes
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)',
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in vectors.items()]
+            )
+            self._entries += self._connection.total_changes - before
+            if self._entries > self.max_entries:
+                evicted = self._connection.execute(
+                    'DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)',
+                    (self._entries - self.max_entries,)
+                ).rowcount
+                self._entries -= evicted
+
+    def embed_documents(self, texts):
+        keys = [self.key(text) for text in texts]
+        vectors = self._lookup(list(dict.fromkeys(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        with self._lock:
+            self.hits += len(keys) - sum(1 for key in keys if key in missing)
+            self.misses += sum(1 for key in keys if key in missing)
+
+        missing_keys = list(missing)
+        for start in range(0, len(missing_keys), self.batch_size):
+            batch = missing_keys[start:start + self.batch_size]
+            # Rounded to float32 so a vector is the same whether it came from the cache or not
+            embedded = {key: np.asarray(vector, dtype=np.float32).tolist() for key, vector in zip(batch, self.embeddings.embed_documents([missing[key] for key in batch]))}
+            self._store(embedded)
+            vectors.update(embedded)
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
@@ -0,0 +1,112 @@
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from database import claimIngestion, releaseIngestion, storeIngestionJob, getIngestionJob, deleteIngestionJob, pruneIngestionJobs
+
+load_dotenv()
+
+INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', 2))
+INGESTION_JOB_HISTORY = int(os.getenv('INGESTION_JOB_HISTORY', 100))  # finished jobs kept for status lookups
+
+# ---------------------------- INGESTION JOBS ----------------------------
+'''
+A job runs in the process that accepted it, and its progress is saved to the database on
+every update, so the status endpoint and the one-job-per-project check work from any
+server process
+'''
+
+JOB_FIELDS = ('project_name', 'phase', 'issues_processed', 'errors', 'result', 'created_at', 'started_at', 'finished_at')
+
+class IngestionJob:
+    '''
+    Progress of one project ingestion, updated by the worker and read by the status endpoint
+    '''
+    def __init__(self, project_name):
+        self.id = uuid.uuid4().hex
+        self.project_name = project_name
+        self.phase = 'queued'
+        self.issues_processed = 0
+        self.errors = []
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @classmethod
+    def from_document(cls, document):
+        job = cls(document['project_name'])
+        job.id = document['_id']
+        for field in JOB_FIELDS:
+            setattr(job, field, document.get(field))
+        return job
+
+    def save(self):
+        storeIngestionJob({"_id": self.id, **{field: getattr(self, field) for field in JOB_FIELDS}})
+
+    @property
+    def finished(self):
+        return self.phase in ('done', 'failed')
+
+    def update(self, phase, issues_processed=None):
+        if self.started_at is None:
+            self.started_at = time.time()
+        self.phase = phase
+        if issues_processed is not None:
+            self.issues_processed = issues_processed
+        self.save()
+
+    def fail(self, error):
+        self.errors.append(error)
+        self.phase = 'failed'
+        self.save()
+
+    def status(self):
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0
+        return {
+            "jobId": self.id,
+            "project_name": self.project_name,
+            "phase": self.phase,
+            "issues_processed": self.issues_processed,
+            "elapsed_seconds": round(elapsed, 2),
+            "issues_per_second": round(self.issues_processed / elapsed, 2) if elapsed else 0,
+            "errors": self.errors,
+            "result": self.result
+        }
+
+_executor = ThreadPoolExecutor(max_workers=INGESTION_WORKERS)
+
+def submit_job(project_name, run, *args):
+    '''
+    Queue run(job, *args) for the project. Returns (job, attached), where attached is
+    True when a job for the same project was already running, in any process, and is
+    returned instead
+    '''
+    job = IngestionJob(project_name)
+    # Saved before the claim, so a submit attaching to it can always read it
+    job.save()
+    running_id = claimIngestion(project_name, job.id)
+    if running_id is not None:
+        deleteIngestionJob(job.id)
+        return get_job(running_id), True
+    pruneIngestionJobs(INGESTION_JOB_HISTORY)
+    _executor.submit(_run_job, job, run, args)
+    return job, False
+
+def _run_job(job, run, args):
+    try:
+        run(job, *args)
+        if not job.finished:
+            job.update('done')
+    except Exception as e:
+        job.fail({"error": "Ingestion failed", "details": str(e)})
+    finally:
+        job.finished_at = time.time()
+        job.save()
+        releaseIngestion(job.project_name, job.id)
+
+def get_job(job_id):
+    document = getIngestionJob(job_id)
+    return IngestionJob.from_document(document) if document is not None else None
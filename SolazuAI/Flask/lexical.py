@@ -0,0 +1,111 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Any, List
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+# ---------------------------- BM25 INDEX ----------------------------
+
+class BM25Index:
+    '''
+    Okapi BM25 over a fixed list of documents, with an inverted index so a query only
+    touches the postings of its own terms
+    '''
+    def __init__(self, documents, k1=BM25_K1, b=BM25_B):
+        self.documents = list(documents)
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # term -> [(position, term frequency)]
+        lengths = []
+        for position, document in enumerate(self.documents):
+            counts = Counter(tokenize(document.page_content))
+            lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                self.postings[term].append((position, frequency))
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.average_length = float(self.lengths.mean()) if lengths else 0.0
+        count = len(self.documents)
+        self.idf = {term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)) for term, postings in self.postings.items()}
+
+    def __len__(self):
+        return len(self.documents)
+
+    def scores(self, query):
+        '''
+        BM25 score of every document for the query, as an array in document order
+        '''
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        if not self.documents:
+            return scores
+        normalizer = self.k1 * (1 - self.b + self.b * self.lengths / (self.average_length or 1))
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            positions = np.fromiter((position for position, _ in postings), dtype=np.int64, count=len(postings))
+            frequencies = np.fromiter((frequency for _, frequency in postings), dtype=np.float32, count=len(postings))
+            scores[positions] += self.idf[term] * frequencies * (self.k1 + 1) / (frequencies + normalizer[positions])
+        return scores
+
+    def search(self, query, k=4):
+        '''
+        Top k (document, score) pairs with a positive score
+        '''
+        return top_documents(self.documents, self.scores(query), k, positive=True)
+
+def top_documents(documents, scores, k, positive=False):
+    candidates = np.flatnonzero(scores > 0) if positive else np.arange(len(scores))
+    if k < len(candidates):
+        candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+    candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+    return [(documents[position], float(scores[position])) for position in candidates]
+
+# ---------------------------- RETRIEVERS ----------------------------
+
+class BM25Retriever(BaseRetriever):
+    '''
+    Lexical retriever over a BM25Index. Needs no embedding calls
+    '''
+    index: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return [document for document, _ in self.index.search(query, self.k)]
+
+class HybridRetriever(BaseRetriever):
+    '''
+    Ranks a scope's chunks by alpha * BM25 + (1 - alpha) * cosine similarity, each
+    scaled to [0, 1] over the scope. The BM25 index and the vector store must hold the
+    same chunks, matched by id
+    '''
+    index: Any
+    vectorstore: Any
+    alpha: float = 0.5
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        documents = self.index.documents
+        if not documents:
+            return []
+        lexical = self.index.scores(query)
+        if lexical.max() > 0:
+            lexical = lexical / lexical.max()
+
+        vector = np.zeros(len(documents), dtype=np.float32)
+        positions = {document.id: position for position, document in enumerate(documents)}
+        for document, score in self.vectorstore.similarity_search_with_score(query, k=len(documents)):
+            if document.id in positions:
+                vector[positions[document.id]] = (score + 1) / 2
+
+        combined = self.alpha * lexical + (1 - self.alpha) * vector
+        return [document for document, _ in top_documents(documents, combined, self.k)]
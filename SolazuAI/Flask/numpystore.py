@@ -0,0 +1,158 @@
+import uuid
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+QUANTIZED_BLOCK_ROWS = 4096  # rows quantized, or dequantized when scoring, at a time
+
+# ---------------------------- NUMPY VECTOR STORE ----------------------------
+
+def matches(metadata, filter):
+    '''
+    Equality filter in the Chroma where syntax the retrievers use: {field: value} or
+    {"$and": [{field: value}, ...]}
+    '''
+    if not filter:
+        return True
+    if '$and' in filter:
+        return all(matches(metadata, condition) for condition in filter['$and'])
+    return all(metadata.get(field) == value for field, value in filter.items())
+
+def quantize_rows(vectors):
+    '''
+    int8 rows, float32 scale per row and norms of what is actually stored, so scores stay
+    true cosines. Works QUANTIZED_BLOCK_ROWS at a time, so the float temporaries stay small
+    '''
+    rows = np.empty(vectors.shape, dtype=np.int8)
+    scales = np.empty(len(vectors), dtype=np.float32)
+    norms = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), QUANTIZED_BLOCK_ROWS):
+        block = vectors[start:start + QUANTIZED_BLOCK_ROWS]
+        block_scales = np.abs(block).max(axis=1) / 127
+        block_scales[block_scales == 0] = 1
+        block_rows = np.round(block / block_scales[:, None]).astype(np.int8)
+        rows[start:start + len(block)] = block_rows
+        scales[start:start + len(block)] = block_scales
+        norms[start:start + len(block)] = np.linalg.norm(block_rows.astype(np.float32) * block_scales[:, None], axis=1)
+    return rows, scales, norms
+
+class NumpyVectorStore(VectorStore):
+    '''
+    Brute-force cosine search over one contiguous matrix, for corpora of a few thousand
+    chunks. With quantize, vectors are kept as int8 with a scale per row
+    '''
+    def __init__(self, embedding, quantize=False):
+        self.embedding = embedding
+        self.quantize = quantize
+        self._ids = []
+        self._texts = []
+        self._metadatas = []
+        self._matrix = None
+        self._scales = None
+        self._norms = np.zeros(0, dtype=np.float32)
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def nbytes(self):
+        if self._matrix is None:
+            return 0
+        return self._matrix.nbytes + self._norms.nbytes + (self._scales.nbytes if self._scales is not None else 0)
+
+    def add_embeddings(self, texts, vectors, metadatas=None, ids=None):
+        texts = list(texts)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+        ids = list(ids) if ids is not None else [uuid.uuid4().hex for _ in texts]
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+
+        if self.quantize:
+            rows, scales, norms = quantize_rows(vectors)
+            self._scales = scales if self._scales is None else np.concatenate([self._scales, scales])
+        else:
+            norms = np.linalg.norm(vectors, axis=1)
+            rows = vectors
+        self._matrix = rows if self._matrix is None else np.ascontiguousarray(np.vstack([self._matrix, rows]))
+        self._norms = np.concatenate([self._norms, norms.astype(np.float32)])
+        self._ids.extend(ids)
+        self._texts.extend(texts)
+        self._metadatas.extend(metadatas)
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        return self.add_embeddings(texts, self.embedding.embed_documents(texts), metadatas, ids)
+
+    def delete(self, ids=None, **kwargs):
+        if ids is None:
+            return False
+        drop = set(ids)
+        keep = np.array([id not in drop for id in self._ids], dtype=bool)
+        if keep.all():
+            return False
+        self._matrix = np.ascontiguousarray(self._matrix[keep])
+        self._norms = self._norms[keep]
+        if self._scales is not None:
+            self._scales = self._scales[keep]
+        self._ids = [id for id, kept in zip(self._ids, keep) if kept]
+        self._texts = [text for text, kept in zip(self._texts, keep) if kept]
+        self._metadatas = [metadata for metadata, kept in zip(self._metadatas, keep) if kept]
+        return True
+
+    def get_by_ids(self, ids):
+        positions = {id: position for position, id in enumerate(self._ids)}
+        return [self._document(positions[id]) for id in ids if id in positions]
+
+    def _document(self, position):
+        return Document(page_content=self._texts[position], metadata=self._metadatas[position], id=self._ids[position])
+
+    def _scores(self, query):
+        if self.quantize:
+            dots = np.empty(len(self._ids), dtype=np.float32)
+            for start in range(0, len(self._ids), QUANTIZED_BLOCK_ROWS):
+                block = self._matrix[start:start + QUANTIZED_BLOCK_ROWS]
+                dots[start:start + len(block)] = block.astype(np.float32) @ query
+            dots *= self._scales
+        else:
+            dots = self._matrix @ query
+        denominator = self._norms * (np.linalg.norm(query) or 1)
+        denominator[denominator == 0] = 1
+        return dots / denominator
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None):
+        if not self._ids:
+            return []
+        scores = self._scores(np.asarray(embedding, dtype=np.float32))
+        if filter:
+            mask = np.array([matches(metadata, filter) for metadata in self._metadatas], dtype=bool)
+            scores = np.where(mask, scores, -np.inf)
+            k = min(k, int(mask.sum()))
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self._document(position), float(scores[position])) for position in top]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k, filter)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        # Cosine similarity in [-1, 1] mapped to [0, 1]
+        return lambda score: (score + 1) / 2
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, quantize=False, **kwargs):
+        store = cls(embedding, quantize=quantize)
+        store.add_texts(texts, metadatas, ids)
+        return store
@@ -0,0 +1,180 @@
+import hashlib
+import logging
+import os
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.runnables import Runnable
+from database import getAgentResult, getAgentResultCandidates, storeAgentResult
+from asyncdatabase import agetAgentResult, agetAgentResultCandidates, astoreAgentResult
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Cosine similarity above which a cached answer to a different question is reused for the
+# same context. 0 turns the semantic lookup off
+AGENT_RESULT_SEMANTIC_THRESHOLD = float(os.getenv('AGENT_RESULT_SEMANTIC_THRESHOLD', 0))
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "semantic_hits": 0, "misses": 0}
+
+def record(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+def get_result_cache_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+def digest(*parts):
+    return hashlib.sha256("\0".join(parts).encode('utf-8')).hexdigest()
+
+# ---------------------------- CACHED GENERATION ----------------------------
+
+class CachedGeneration(Runnable):
+    '''
+    Generation step of a RAG chain that takes {"context": documents, "input": question}
+    and reuses a stored answer when the role, prompt version, model, retrieved context
+    and question are all the same. Without a prompt version nothing is cached
+    '''
+    def __init__(self, generation, role, prompt_version, model, project_name, embeddings=None):
+        self.generation = generation
+        self.role = role
+        self.prompt_version = prompt_version
+        self.model = model
+        self.project_name = project_name
+        self.embeddings = embeddings
+
+    def _keys(self, inputs):
+        documents = inputs.get('context') or []
+        context_hash = digest(*(document.page_content for document in documents))
+        scope_key = digest(self.role, str(self.prompt_version), self.model, context_hash)
+        source_ids = sorted({document.metadata.get('source_id') for document in documents if document.metadata.get('source_id')})
+        return scope_key, digest(scope_key, str(inputs.get('input'))), source_ids
+
+    def _hit(self, cached, name):
+        record(name)
+        return cached['response'], None
+
+    def _closest(self, candidates, embedding):
+        best, best_score = None, AGENT_RESULT_SEMANTIC_THRESHOLD
+        for candidate in candidates:
+            vector = np.asarray(candidate['question_embedding'], dtype=np.float32)
+            score = float(vector @ embedding / ((np.linalg.norm(vector) * np.linalg.norm(embedding)) or 1))
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def _semantic(self):
+        return bool(AGENT_RESULT_SEMANTIC_THRESHOLD) and self.embeddings is not None
+
+    def _lookup(self, scope_key, key, question):
+        cached = getAgentResult(key)
+        if cached is not None:
+            return self._hit(cached, 'hits')
+        embedding = None
+        if self._semantic():
+            embedding = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+            best = self._closest(getAgentResultCandidates(scope_key), embedding)
+            if best is not None:
+                return self._hit(best, 'semantic_hits')
+        record('misses')
+        return None, embedding
+
+    async def _alookup(self, scope_key, key, question):
+        # _lookup on the event loop: the reads go through motor
+        cached = await agetAgentResult(key)
+        if cached is not None:
+            return self._hit(cached, 'hits')
+        embedding = None
+        if self._semantic():
+            embedding = np.asarray(await self.embeddings.aembed_query(question), dtype=np.float32)
+            best = self._closest(await agetAgentResultCandidates(scope_key), embedding)
+            if best is not None:
+                return self._hit(best, 'semantic_hits')
+        record('misses')
+        return None, embedding
+
+    def _result(self, scope_key, key, source_ids, question, response, embedding):
+        result = {
+            "_id": key,
+            "scope_key": scope_key,
+            "role": self.role,
+            "prompt_version": self.prompt_version,
+            "model": self.model,
+            "project_name": self.project_name,
+            "source_ids": source_ids,
+            "question": question,
+            "response": response
+        }
+        if embedding is not None:
+            result['question_embedding'] = embedding.tolist()
+        return result
+
+    def _store(self, *fields):
+        try:
+            storeAgentResult(self._result(*fields))
+        except Exception:
+            logger.exception("Failed to store the %s result", self.role)
+
+    async def _astore(self, *fields):
+        try:
+            await astoreAgentResult(self._result(*fields))
+        except Exception:
+            logger.exception("Failed to store the %s result", self.role)
+
+    def invoke(self, inputs, config=None, **kwargs):
+        if self.prompt_version is None:
+            return self.generation.invoke(inputs, config, **kwargs)
+        scope_key, key, source_ids = self._keys(inputs)
+        question = str(inputs.get('input'))
+        response, embedding = self._lookup(scope_key, key, question)
+        if response is None:
+            response = self.generation.invoke(inputs, config, **kwargs)
+            self._store(scope_key, key, source_ids, question, response, embedding)
+        return response
+
+    def stream(self, inputs, config=None, **kwargs):
+        if self.prompt_version is None:
+            yield from self.generation.stream(inputs, config, **kwargs)
+            return
+        scope_key, key, source_ids = self._keys(inputs)
+        question = str(inputs.get('input'))
+        response, embedding = self._lookup(scope_key, key, question)
+        if response is not None:
+            yield response
+            return
+        tokens = []
+        for token in self.generation.stream(inputs, config, **kwargs):
+            tokens.append(token)
+            yield token
+        self._store(scope_key, key, source_ids, question, "".join(tokens), embedding)
+
+    async def ainvoke(self, inputs, config=None, **kwargs):
+        if self.prompt_version is None:
+            return await self.generation.ainvoke(inputs, config, **kwargs)
+        scope_key, key, source_ids = self._keys(inputs)
+        question = str(inputs.get('input'))
+        response, embedding = await self._alookup(scope_key, key, question)
+        if response is None:
+            response = await self.generation.ainvoke(inputs, config, **kwargs)
+            await self._astore(scope_key, key, source_ids, question, response, embedding)
+        return response
+
+    async def astream(self, inputs, config=None, **kwargs):
+        if self.prompt_version is None:
+            async for token in self.generation.astream(inputs, config, **kwargs):
+                yield token
+            return
+        scope_key, key, source_ids = self._keys(inputs)
+        question = str(inputs.get('input'))
+        response, embedding = await self._alookup(scope_key, key, question)
+        if response is not None:
+            yield response
+            return
+        tokens = []
+        async for token in self.generation.astream(inputs, config, **kwargs):
+            tokens.append(token)
+            yield token
+        await self._astore(scope_key, key, source_ids, question, "".join(tokens), embedding)
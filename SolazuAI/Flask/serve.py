@@ -0,0 +1,127 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import uvicorn
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from app import app as flask_app
+from database import connect_to_mongodb
+from agent import (
+    CLARIFY_AGENT_ASYNC, CHAT_AGENT_ASYNC, SUGGESTION_AGENT_ASYNC,
+    CLARIFY_AGENT_STREAM_ASYNC, CHAT_AGENT_STREAM_ASYNC, SUGGESTION_AGENT_STREAM_ASYNC
+)
+
+load_dotenv()
+
+# ------------------------ PRODUCTION SERVER ------------------------
+'''
+Serves the same routes as app.py. The agent routes run on the event loop with ainvoke and
+astream, so one worker holds many chats in flight; every other route is the Flask app,
+run in a thread. Start with: python serve.py
+
+Blocking work left on the agent paths (chain setup, retrieval, context trimming) and the
+Flask routes run on the event loop's default executor, sized to SERVE_AGENT_CONCURRENCY
+so it does not queue the agent calls the semaphore lets through. Ingestion jobs are kept in
+MongoDB, so any worker answers /ingestionStatus. History writes are buffered per worker
+(writebehind.py) and reach the other workers within WRITE_BEHIND_FLUSH_INTERVAL
+'''
+
+SERVE_HOST = os.getenv('SERVE_HOST', '0.0.0.0')
+SERVE_PORT = int(os.getenv('SERVE_PORT', 5000))
+SERVE_WORKERS = int(os.getenv('SERVE_WORKERS', 1))  # processes
+SERVE_MAX_CONNECTIONS = int(os.getenv('SERVE_MAX_CONNECTIONS', 1000))  # per worker, answered with 503 beyond
+SERVE_AGENT_CONCURRENCY = int(os.getenv('SERVE_AGENT_CONCURRENCY', 128))  # agent calls in flight per worker; the rest wait
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    '''
+    asgiref runs every WSGI request on one shared thread; here they run side by side on
+    the default executor, as on the threaded development server
+    '''
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False)
+
+_agent_slots = None
+
+def agent_slots():
+    global _agent_slots
+    if _agent_slots is None:
+        _agent_slots = asyncio.Semaphore(SERVE_AGENT_CONCURRENCY)
+    return _agent_slots
+
+def request_scope(data):
+    return {
+        "project_name": data.get('projectName'),
+        "epic_key": data.get('epicKey'),
+        "ticket_key": data.get('ticketKey') or None,
+        "url": data.get('url') or None
+    }
+
+async def event_stream(events):
+    async with agent_slots():
+        async for event, data in events:
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    return StreamingResponse(event_stream(events), media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+async def getClarify(request):
+    data = await request.json()
+    async with agent_slots():
+        return JSONResponse(await CHAT_AGENT_ASYNC(data.get('sessionId'), data.get('userMessage'), **request_scope(data)))
+
+async def getSuggestion(request):
+    data = await request.json()
+    async with agent_slots():
+        return JSONResponse(await SUGGESTION_AGENT_ASYNC(data.get('sessionId'), **request_scope(data)))
+
+async def getQuestion(request):
+    data = await request.json()
+    async with agent_slots():
+        return JSONResponse(await CLARIFY_AGENT_ASYNC(**request_scope(data)))
+
+async def getClarifyStream(request):
+    data = await request.json()
+    return sse_response(CHAT_AGENT_STREAM_ASYNC(data.get('sessionId'), data.get('userMessage'), **request_scope(data)))
+
+async def getSuggestionStream(request):
+    data = await request.json()
+    return sse_response(SUGGESTION_AGENT_STREAM_ASYNC(data.get('sessionId'), **request_scope(data)))
+
+async def getQuestionStream(request):
+    data = await request.json()
+    return sse_response(CLARIFY_AGENT_STREAM_ASYNC(**request_scope(data)))
+
+@asynccontextmanager
+async def lifespan(app):
+    # The default of min(32, cpus + 4) threads would serialize the agent calls in flight
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=SERVE_AGENT_CONCURRENCY, thread_name_prefix='serve'))
+    await asyncio.to_thread(connect_to_mongodb)
+    yield
+
+asgi_app = Starlette(
+    routes=[
+        Route('/getClarify', getClarify, methods=['POST']),
+        Route('/getSuggestion', getSuggestion, methods=['POST']),
+        Route('/getQuestion', getQuestion, methods=['POST']),
+        Route('/getClarifyStream', getClarifyStream, methods=['POST']),
+        Route('/getSuggestionStream', getSuggestionStream, methods=['POST']),
+        Route('/getQuestionStream', getQuestionStream, methods=['POST']),
+        Mount('/', app=ThreadedWsgiToAsgi(flask_app)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    uvicorn.run('serve:asgi_app', host=SERVE_HOST, port=SERVE_PORT, workers=SERVE_WORKERS, limit_concurrency=SERVE_MAX_CONNECTIONS)
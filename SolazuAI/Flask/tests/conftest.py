@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+import mongomock
+import pytest
+
+# ---------------------------- TEST SETUP ----------------------------
+'''
+Tests import the Flask modules directly and run against an in-memory mongomock.
+Run from SolazuAI/Flask with: python -m pytest -q tests
+'''
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ.setdefault('CHROMA_PERSIST_DIR', tempfile.mkdtemp())
+os.environ.setdefault('ANONYMIZED_TELEMETRY', 'False')
+os.environ.setdefault('EMBEDDING_CACHE_PATH', os.path.join(tempfile.mkdtemp(), 'embeddings.sqlite3'))
+
+import database
+
+@pytest.fixture
+def db(monkeypatch):
+    '''
+    A fresh mongomock database behind database.get_db, with the indexes created
+    '''
+    monkeypatch.setattr(database, '_mongo_client', mongomock.MongoClient())
+    database.ensure_indexes()
+    return database.get_db()
+
+@pytest.fixture
+def async_db(db, monkeypatch):
+    '''
+    The same mongomock database behind asyncdatabase's motor client
+    '''
+    mongomock_motor = pytest.importorskip('mongomock_motor')
+    import asyncdatabase
+    monkeypatch.setattr(asyncdatabase, '_motor_client', mongomock_motor.AsyncMongoMockClient(mock_mongo_client=database._mongo_client))
+    return db
@@ -0,0 +1,119 @@
+import asyncio
+import pytest
+import agent
+import database
+
+class TokenChain:
+    '''
+    Answers with fixed tokens, under key if given, like a chain with message history
+    '''
+    def __init__(self, tokens, key=None, fail_after=None):
+        self.tokens = tokens
+        self.key = key
+        self.fail_after = fail_after
+        self.inputs = []
+
+    def chunk(self, token):
+        return token if self.key is None else {self.key: token}
+
+    def invoke(self, inputs, config=None):
+        self.inputs.append((inputs, config))
+        return self.chunk("".join(self.tokens))
+
+    def stream(self, inputs, config=None):
+        self.inputs.append((inputs, config))
+        for position, token in enumerate(self.tokens):
+            if position == self.fail_after:
+                raise RuntimeError("generation failed")
+            yield self.chunk(token)
+
+    async def ainvoke(self, inputs, config=None):
+        return self.invoke(inputs, config)
+
+    async def astream(self, inputs, config=None):
+        for chunk in self.stream(inputs, config):
+            yield chunk
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = {"messages": [], "questions": [], "chains": {}}
+
+    def get_rag_chain(role, project_name, epic_key, ticket_key=None, url=None):
+        return calls["chains"][role]
+
+    async def aget_question(*args):
+        return "Which browsers?"
+
+    async def aget_version(*args):
+        return None
+
+    monkeypatch.setattr(agent, 'get_rag_chain', get_rag_chain)
+    monkeypatch.setattr(agent, 'agetPromptVersion', aget_version)
+    monkeypatch.setattr(agent, 'agetIndexVersion', aget_version)
+    monkeypatch.setattr(agent, 'getClarifyQuestionHistory', lambda *args: "Which browsers?")
+    monkeypatch.setattr(agent, 'agetClarifyQuestionHistory', aget_question)
+    monkeypatch.setattr(agent, 'store_message', lambda session_id, sender, content, input_token, output_token: calls["messages"].append((session_id, sender, content)))
+    monkeypatch.setattr(agent, 'insertClarifyQuestionHistory', calls["questions"].extend)
+    return calls
+
+def collect(events):
+    if hasattr(events, '__aiter__'):
+        async def drain():
+            return [event async for event in events]
+        return asyncio.run(drain())
+    return list(events)
+
+def without_session_ids(result):
+    return {**result, "questions": [question["question"] for question in result["questions"]]} if "questions" in result else result
+
+def test_variants_return_the_same_result(calls):
+    calls["chains"] = {"CLARIFY": TokenChain(["1. Why?", "\n2. ", "How?"]), "SUGGESTION": TokenChain(["Use ", "Chrome"]), "CHAT": TokenChain(["Chrome ", "only"], key="answer")}
+    agents = {
+        "CLARIFY": ((agent.CLARIFY_AGENT, agent.CLARIFY_AGENT_ASYNC, agent.CLARIFY_AGENT_STREAM, agent.CLARIFY_AGENT_STREAM_ASYNC), ("P", "E1", "T1")),
+        "SUGGESTION": ((agent.SUGGESTION_AGENT, agent.SUGGESTION_AGENT_ASYNC, agent.SUGGESTION_AGENT_STREAM, agent.SUGGESTION_AGENT_STREAM_ASYNC), ("s1", "P", "E1", "T1")),
+        "CHAT": ((agent.CHAT_AGENT, agent.CHAT_AGENT_ASYNC, agent.CHAT_AGENT_STREAM, agent.CHAT_AGENT_STREAM_ASYNC), ("s1", "Which ones?", "P", "E1", "T1"))
+    }
+    for role, ((run, arun, stream, astream), args) in agents.items():
+        result = without_session_ids(run(*args))
+        assert "error" not in result
+        assert without_session_ids(asyncio.run(arun(*args))) == result
+        for events in (collect(stream(*args)), collect(astream(*args))):
+            event, done = events[-1]
+            assert event == "done"
+            assert [data["token"] for event, data in events[:-1]] == calls["chains"][role].tokens
+            assert without_session_ids({key: value for key, value in done.items() if not key.endswith("_tokens")}) == result
+            assert done["output_tokens"] == agent.count_tokens(done["response"])
+
+    assert len(calls["questions"]) == 8
+    assert calls["messages"] == [("s1", "human", "Which ones?"), ("s1", "agent", "Chrome only")] * 4
+    inputs, config = calls["chains"]["CHAT"].inputs[0]
+    assert inputs["question"] == "Which browsers?" and config == {"configurable": {"session_id": "s1"}}
+
+def test_errors_are_payloads(calls):
+    calls["chains"] = {"SUGGESTION": TokenChain(["Use"], fail_after=0)}
+    assert collect(agent.SUGGESTION_AGENT_STREAM("s1", "P", "E1")) == [("error", {"error": "generation failed"})]
+    assert collect(agent.SUGGESTION_AGENT_STREAM_ASYNC("s1", "P", "E1")) == [("error", {"error": "generation failed"})]
+    assert asyncio.run(agent.CLARIFY_AGENT_ASYNC("P", "E1")) == {"error": "'CLARIFY'"}
+
+@pytest.mark.parametrize("variant", [agent.CHAT_AGENT_STREAM, agent.CHAT_AGENT_STREAM_ASYNC])
+def test_chat_keeps_a_partial_answer(calls, variant):
+    calls["chains"] = {"CHAT": TokenChain(["Chrome ", "only"], key="answer", fail_after=1)}
+    events = collect(variant("s1", "Which ones?", "P", "E1"))
+    assert events == [("token", {"token": "Chrome "}), ("error", {"error": "generation failed"})]
+    assert calls["messages"] == [("s1", "human", "Which ones?"), ("s1", "agent", "Chrome ")]
+
+def test_cached_chain_is_found_on_the_event_loop(async_db, monkeypatch):
+    database.setPromptwithAgent("Rewrite", "Answer from {context}", "CLARIFY")
+    async_db['projects'].insert_one({"project_name": "P", "index_version": 3})
+    monkeypatch.setattr(agent, '_chains', agent.OrderedDict())
+    monkeypatch.setattr(agent, 'rag_chains_without_history', lambda *args: "chain")
+    assert agent.get_rag_chain("CLARIFY", "P", "E1") == "chain"
+
+    async def no_thread(*args):
+        raise AssertionError("left the event loop")
+    monkeypatch.setattr(agent.asyncio, 'to_thread', no_thread)
+    assert asyncio.run(agent.aget_rag_chain("CLARIFY", "P", "E1")) == "chain"
+    # Another process synced the index: the chain is rebuilt, in a worker thread
+    database.bumpIndexVersion("P")
+    with pytest.raises(AssertionError):
+        asyncio.run(agent.aget_rag_chain("CLARIFY", "P", "E1"))
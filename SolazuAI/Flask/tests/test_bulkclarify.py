@@ -0,0 +1,43 @@
+import pytest
+from langchain_core.runnables import RunnableLambda
+import agent
+import database
+
+@pytest.fixture
+def project(db, monkeypatch):
+    db['issues'].insert_many([
+        {"project_name": "P", "key": key, "parent": "PROJ-1", "issue_type": "Task"}
+        for key in ("PROJ-10", "PROJ-2", "PROJ-1000", "PROJ-9", "OTHER-3")
+    ])
+
+    def answer(inputs):
+        if inputs['ticket_key'] == "PROJ-9":
+            raise RuntimeError("generation failed")
+        return f"1. What about {inputs['ticket_key'] or 'the epic'}?\n2. Who tests {inputs['ticket_key'] or 'the epic'}?"
+
+    monkeypatch.setattr(agent, 'get_project_index', lambda project_name, build=False: None)
+    monkeypatch.setattr(agent, 'rag_chains_for_scopes', lambda role, project_name: RunnableLambda(answer))
+    return db
+
+def test_ticket_keys_sort_by_number(project):
+    assert database.getEpicTicketKeys("P", "PROJ-1") == ["OTHER-3", "PROJ-2", "PROJ-9", "PROJ-10", "PROJ-1000"]
+
+def test_each_result_carries_stored_session_ids(project):
+    events = []
+    for event, data in agent.CLARIFY_AGENT_BULK("P", "PROJ-1"):
+        if event == "result":
+            # Replying is possible as soon as the result arrives
+            for question in data["questions"]:
+                assert database.getClarifyQuestionHistory(question["sessionId"], "P", "PROJ-1", data["ticket_key"]) == question["question"]
+        events.append((event, data))
+
+    results = {data["ticket_key"]: data for event, data in events if event == "result"}
+    assert set(results) == {None, "OTHER-3", "PROJ-2", "PROJ-10", "PROJ-1000"}
+    assert all(data["stored"] for data in results.values())
+    assert [question["question"] for question in results["PROJ-10"]["questions"]][1:] == ["Who tests PROJ-10?"]
+    session_ids = [question["sessionId"] for data in results.values() for question in data["questions"]]
+    assert len(set(session_ids)) == len(session_ids) == 10
+
+    assert [data["ticket_key"] for event, data in events if event == "error"] == ["PROJ-9"]
+    assert events[-1] == ("done", {"tickets": 6, "failed": 1, "questions": 10, "stored": True})
+    assert project['history'].count_documents({"project_name": "P"}) == 10
@@ -0,0 +1,50 @@
+import pytest
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+import contextbudget
+from contextbudget import ContextAssembler, MESSAGE_OVERHEAD_TOKENS, count_tokens, message_tokens
+
+def words(count):
+    return " ".join(["word"] * count)  # one cl100k token per word
+
+def test_count_tokens_is_memoized(monkeypatch):
+    text = words(7) + " memoized"
+    count = count_tokens(text)
+    monkeypatch.setattr(contextbudget.tokenizer, 'encode', lambda text: pytest.fail("encoded twice"))
+    assert count_tokens(text) == count
+
+def test_message_tokens_adds_the_per_message_overhead():
+    assert message_tokens(HumanMessage(content=words(5))) == 5 + MESSAGE_OVERHEAD_TOKENS
+    assert message_tokens(words(5)) == 5 + MESSAGE_OVERHEAD_TOKENS
+
+def test_available_subtracts_prompt_input_question_and_reserve():
+    assembler = ContextAssembler(words(10), budget=100, reserve=20)
+    assert assembler.available({"input": words(6)}) == 100 - 20 - 10 - (6 + MESSAGE_OVERHEAD_TOKENS)
+    assert assembler.available({"input": words(6), "question": words(5)}) == 100 - 20 - 10 - (6 + MESSAGE_OVERHEAD_TOKENS) - 5
+    assert ContextAssembler(words(10), budget=10, reserve=20).available({"input": ""}) == 0
+
+def test_history_keeps_the_newest_turns_within_its_share():
+    history = [HumanMessage(content=words(6)), AIMessage(content=words(6)), HumanMessage(content=words(6)), AIMessage(content=words(6))]
+    # 100 available, 25% for history: the last two messages (2 x 10) fit, a third would not
+    assembler = ContextAssembler("", budget=100 + MESSAGE_OVERHEAD_TOKENS + 1, reserve=0, history_share=0.25)
+    trimmed = assembler.trim_history({"input": "q", "chat_history": history})
+    assert trimmed["chat_history"] == history[2:]
+
+def test_history_does_not_start_with_an_answer():
+    history = [HumanMessage(content=words(6)), AIMessage(content=words(6)), HumanMessage(content=words(6)), AIMessage(content=words(6))]
+    # The last three messages fit, and the answer they start with is dropped
+    assembler = ContextAssembler("", budget=100 + MESSAGE_OVERHEAD_TOKENS + 1, reserve=0, history_share=0.35)
+    assert assembler.trim_history({"input": "q", "chat_history": history})["chat_history"] == history[2:]
+
+def test_inputs_without_history_are_left_alone():
+    assembler = ContextAssembler("", budget=100, reserve=0)
+    assert assembler.trim_history({"input": "q"}) == {"input": "q"}
+
+def test_documents_keep_their_ranking_within_what_history_leaves():
+    documents = [Document(page_content=words(30)), Document(page_content=words(30)), Document(page_content=words(30)), Document(page_content=words(5))]
+    history = [HumanMessage(content=words(16))]
+    assembler = ContextAssembler("", budget=100, reserve=0)
+    # 100 - 5 for the input - 20 for history leaves 75: two chunks fit, the third does not and the rest go with it
+    kept = assembler.trim_documents({"input": "q", "chat_history": history, "context": documents})["context"]
+    assert kept == documents[:2]
+    assert assembler.trim_documents({"input": "q", "context": documents})["context"] == documents
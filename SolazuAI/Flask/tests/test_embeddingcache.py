@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+from embeddingcache import CachedEmbeddings
+
+class CountingEmbeddings(Embeddings):
+    '''
+    Deterministic embeddings that record every text they are asked for
+    '''
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[len(text), 0.1, 1 / 3] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+@pytest.fixture
+def inner():
+    return CountingEmbeddings()
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'embeddings.sqlite3')
+
+def test_misses_are_deduplicated_and_batched(inner, path):
+    cache = CachedEmbeddings(inner, path=path, batch_size=2, model='m')
+    vectors = cache.embed_documents(["a", "bb", "a", "ccc"])
+    assert inner.calls == [["a", "bb"], ["ccc"]]
+    assert vectors[0] == vectors[2]
+    assert cache.stats()["misses"] == 4
+
+def test_hits_are_not_embedded_again_and_match_the_miss(inner, path):
+    cache = CachedEmbeddings(inner, path=path, model='m')
+    first = cache.embed_documents(["a", "bb"])
+    assert cache.embed_documents(["bb", "a"]) == [first[1], first[0]]
+    assert cache.embed_query("a") == first[0]
+    assert len(inner.calls) == 1
+    assert cache.stats()["hits"] == 3
+    # float32, whether cached or not
+    assert first[0] == np.asarray([1, 0.1, 1 / 3], dtype=np.float32).tolist()
+
+def test_cache_persists_across_instances(inner, path):
+    CachedEmbeddings(inner, path=path, model='m').embed_documents(["a"])
+    cache = CachedEmbeddings(inner, path=path, model='m')
+    cache.embed_documents(["a"])
+    assert len(inner.calls) == 1
+    assert cache.stats()["entries"] == 1
+
+def test_models_do_not_share_vectors(inner, path):
+    CachedEmbeddings(inner, path=path, model='m').embed_documents(["a"])
+    CachedEmbeddings(inner, path=path, model='other').embed_documents(["a"])
+    assert len(inner.calls) == 2
+
+def test_least_recently_used_are_evicted(inner, path, monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr('embeddingcache.time.time', lambda: next(clock))
+    cache = CachedEmbeddings(inner, path=path, max_entries=2, model='m')
+    cache.embed_documents(["a"])
+    cache.embed_documents(["bb"])
+    cache.embed_documents(["a"])  # "bb" is now the least recently used
+    cache.embed_documents(["ccc"])
+    assert cache.stats()["entries"] == 2
+    inner.calls.clear()
+    cache.embed_documents(["a", "ccc"])
+    assert inner.calls == []
+    cache.embed_documents(["bb"])
+    assert inner.calls == [["bb"]]
@@ -0,0 +1,43 @@
+import pytest
+import database
+from utils import build_issue_tree
+
+def issue(key, issue_type, parent=None):
+    return {"key": key, "summary": f"Summary {key}", "description": "", "issue_type": issue_type, "parent": parent, "source": {}}
+
+def project(links, issues):
+    return {
+        "project_name": "P",
+        "github_link": [{"url": url} for url in links],
+        "jira_link": [],
+        "docs_link": [],
+        "confluence_link": [],
+        "issues": build_issue_tree(issues),
+        "confluence_pages": []
+    }
+
+@pytest.fixture
+def rebuilds(db, monkeypatch):
+    database.addDataToMongoDB(project(["https://github.com/a/b"], [issue("E1", "Epic"), issue("T1", "Task", "E1"), issue("E2", "Epic")]))
+    calls = []
+    rebuild = database.rebuildEpicViews
+    def recording_rebuild(projectName, epicKeys=None):
+        calls.append(None if epicKeys is None else set(epicKeys))
+        return rebuild(projectName, epicKeys)
+    monkeypatch.setattr(database, 'rebuildEpicViews', recording_rebuild)
+    return calls
+
+def test_known_links_only_rebuild_the_touched_epics(rebuilds):
+    database.addDataToMongoDB(project(["https://github.com/a/b"], [issue("T1", "Task", "E1")]), replaceIssues=False)
+    assert rebuilds == [{"T1", "E1"}]
+
+def test_new_link_rebuilds_every_epic(rebuilds):
+    database.addDataToMongoDB(project(["https://github.com/a/b", "https://github.com/a/c"], [issue("T1", "Task", "E1")]), replaceIssues=False)
+    assert rebuilds == [None]
+    assert [link["url"] for link in database.getLinkfromDatabase("P", "E2")[0]["links_status"]] == ["https://github.com/a/b", "https://github.com/a/c"]
+
+def test_links_added():
+    stored = {"github_link": [{"url": "a"}], "jira_link": None}
+    assert not database.linksAdded(stored, {"github_link": [{"url": "a"}], "jira_link": []})
+    assert database.linksAdded(stored, {"jira_link": [{"url": "j"}]})
+    assert database.linksAdded({}, {"docs_link": [{"url": "d"}]})
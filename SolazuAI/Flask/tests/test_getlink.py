@@ -0,0 +1,92 @@
+import pytest
+import database
+from utils import build_issue_tree
+
+def issue(key, issue_type, parent=None, links=()):
+    return {
+        "key": key,
+        "summary": f"Summary {key}",
+        "reporter": "reporter",
+        "description": f"Description {key}",
+        "status": "To Do",
+        "issue_type": issue_type,
+        "assignee": None,
+        "parent": parent,
+        "source": {"confluence": [], "googleDocs": [], "otherLinks": [{"url": url} for url in links]}
+    }
+
+@pytest.fixture
+def client(db):
+    from app import app
+    flat_issues = [
+        issue("E1", "Epic", links=["https://e1/a", "https://e1/b"]),
+        issue("T1", "Task", "E1", links=["https://t1/a", "https://t1/b", "https://t1/c"]),
+        issue("T2", "Task", "E1", links=["https://t2/a"]),
+        issue("E2", "Epic", links=["https://e2/a"]),
+        issue("T3", "Task", "E2", links=["https://t3/a"])
+    ]
+    with app.app_context():
+        database.addDataToMongoDB({
+            "project_name": "P",
+            "github_link": [{"url": "https://github.com/a/b"}],
+            "jira_link": [{"url": "https://jira/P"}],
+            "docs_link": [],
+            "confluence_link": [],
+            "issues": build_issue_tree(flat_issues),
+            "confluence_pages": []
+        })
+    return app.test_client()
+
+def get_all_links(client, limit, **scope):
+    urls = []
+    cursor = None
+    while True:
+        response = client.post('/getLink', json={"projectName": "P", "limit": limit, "cursor": cursor, **scope})
+        assert response.status_code == 200
+        page = response.get_json()[0]
+        assert len(page["links_status"]) <= limit
+        urls += [link["url"] for link in page["links_status"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return urls
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 100])
+def test_pages_cover_every_link_once_in_order(client, limit):
+    assert get_all_links(client, limit) == get_all_links(client, 100)
+    assert sorted(get_all_links(client, limit)) == sorted([
+        "https://github.com/a/b", "https://jira/P",
+        "https://e1/a", "https://e1/b", "https://t1/a", "https://t1/b", "https://t1/c", "https://t2/a",
+        "https://e2/a", "https://t3/a"
+    ])
+
+@pytest.mark.parametrize("limit", [1, 4])
+def test_epic_pages_list_project_then_epic_then_tickets(client, limit):
+    assert get_all_links(client, limit, epicKey="E1") == [
+        "https://github.com/a/b", "https://jira/P",
+        "https://e1/a", "https://e1/b",
+        "https://t1/a", "https://t1/b", "https://t1/c", "https://t2/a"
+    ]
+
+def test_ticket_pages_leave_out_other_tickets(client):
+    assert get_all_links(client, 2, epicKey="E1", ticketKey="T2") == [
+        "https://github.com/a/b", "https://jira/P", "https://e1/a", "https://e1/b", "https://t2/a"
+    ]
+
+def test_cursor_round_trip():
+    row = {"group": 2, "_id": database.ObjectId(), "idx": 7}
+    assert database.decodeLinkCursor(database.encodeLinkCursor(row)) == (2, row["_id"], 7)
+
+@pytest.mark.parametrize("body, error", [
+    ({"limit": "ten"}, "Limit must be an integer"),
+    ({"limit": [1]}, "Limit must be an integer"),
+    ({"cursor": "not a cursor"}, "Invalid cursor"),
+    ({"cursor": "WzEsICJ4IiwgMF0="}, "Invalid cursor"),  # [1, "x", 0]
+    ({"cursor": 5}, "Invalid cursor")
+])
+def test_malformed_limit_or_cursor_is_400(client, body, error):
+    response = client.post('/getLink', json={"projectName": "P", **body})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": error}
+
+def test_unknown_project_is_404(client):
+    assert client.post('/getLink', json={"projectName": "Q"}).status_code == 404
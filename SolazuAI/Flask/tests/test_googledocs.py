@@ -0,0 +1,34 @@
+import logging
+import pytest
+import utils
+
+def text(content):
+    return {"paragraph": {"elements": [{"textRun": {"content": content}}, {"inlineObjectElement": {}}]}}
+
+def test_read_structural_elements_reads_tables_and_contents_in_order():
+    body = [
+        text("Title\n"),
+        {"tableOfContents": {"content": [text("Contents\n")]}},
+        {"table": {"tableRows": [{"tableCells": [{"content": [text("a")]}, {"content": [text("b")]}]}]}},
+        {"sectionBreak": {}},
+        text("End\n")
+    ]
+    assert utils.read_structural_elements(body) == "Title\nContents\nabEnd\n"
+
+@pytest.fixture
+def no_credentials(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # no token.json here
+    monkeypatch.setattr(utils, '_docs_service', None)
+    monkeypatch.setattr(utils.tools, 'run_flow', lambda *args, **kwargs: pytest.fail("interactive flow started"))
+
+def test_ingestion_without_credentials_keeps_bare_links(no_credentials, caplog):
+    issues = [{"key": "T1", "source": {"googleDocs": [{"url": "https://docs.google.com/document/d/abc/edit"}]}}]
+    with caplog.at_level(logging.WARNING, logger='utils'):
+        utils.attach_google_docs_details(issues)
+    assert issues[0]["source"]["googleDocs"] == [{"url": "https://docs.google.com/document/d/abc/edit"}]
+    assert "Skipping details of 1 Google Docs links" in caplog.text
+
+def test_details_without_credentials_is_an_error(no_credentials):
+    details = utils.get_google_docs_details("https://docs.google.com/document/d/abc/edit")
+    assert details["error"] == "Failed to fetch Google Docs details"
+    assert "token.json" in details["details"]
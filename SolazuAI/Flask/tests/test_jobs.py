@@ -0,0 +1,67 @@
+import threading
+import time
+import pytest
+import database
+import jobs
+
+@pytest.fixture
+def blocked_run(db):
+    '''
+    A job run that reports a phase and waits until released
+    '''
+    release = threading.Event()
+    def run(job, result):
+        job.update('fetching', 3)
+        release.wait(5)
+        job.result = result
+    yield run, release
+    release.set()
+
+def wait_finished(job_id):
+    for _ in range(100):
+        job = jobs.get_job(job_id)
+        if job.finished_at is not None:
+            return job
+        time.sleep(0.02)
+    pytest.fail("job did not finish")
+
+def test_status_and_dedupe_are_shared_through_the_database(blocked_run):
+    run, release = blocked_run
+    job, attached = jobs.submit_job("P", run, {"stored": 1})
+    assert not attached
+    # Another process sees the running job only through the database
+    again, attached = jobs.submit_job("P", run, {"stored": 2})
+    assert attached and again.id == job.id
+    assert database.get_db()['ingestion_jobs'].count_documents({}) == 1
+
+    release.set()
+    finished = wait_finished(job.id)
+    assert finished.status()["phase"] == "done"
+    assert finished.status()["issues_processed"] == 3
+    assert finished.status()["result"] == {"stored": 1}
+    assert database.get_db()['ingestion_locks'].count_documents({}) == 0
+
+    after, attached = jobs.submit_job("P", run, {"stored": 3})
+    assert not attached and after.id != job.id
+
+def test_lock_of_a_dead_process_is_taken_over(db):
+    database.get_db()['ingestion_locks'].insert_one({"_id": "P", "job_id": "gone", "heartbeat": time.time() - database.INGESTION_LOCK_SECONDS - 1})
+    assert database.claimIngestion("P", "new") is None
+    assert database.claimIngestion("P", "other") == "new"
+
+def test_failures_are_stored(db):
+    def run(job):
+        raise RuntimeError("crawl failed")
+    job, _ = jobs.submit_job("P", run)
+    assert wait_finished(job.id).status()["errors"] == [{"error": "Ingestion failed", "details": "crawl failed"}]
+
+def test_only_the_newest_finished_jobs_are_kept(db, monkeypatch):
+    monkeypatch.setattr(jobs, 'INGESTION_JOB_HISTORY', 2)
+    ids = []
+    for number in range(4):
+        job, _ = jobs.submit_job(f"P{number}", lambda job: None)
+        wait_finished(job.id)
+        ids.append(job.id)
+    jobs.submit_job("P", lambda job: None)
+    assert jobs.get_job(ids[0]) is None and jobs.get_job(ids[1]) is None
+    assert jobs.get_job(ids[3]) is not None
@@ -0,0 +1,59 @@
+import math
+import pytest
+from langchain_core.documents import Document
+from lexical import BM25Index, BM25Retriever, HybridRetriever, tokenize
+
+DOCUMENTS = [
+    Document(id="cart", page_content="Validate the cart before checkout"),
+    Document(id="discount", page_content="Apply the discount code at checkout checkout"),
+    Document(id="receipt", page_content="Email the receipt to the customer"),
+]
+
+def bm25(term_frequency, document_frequency, count, length, average_length, k1=1.5, b=0.75):
+    idf = math.log(1 + (count - document_frequency + 0.5) / (document_frequency + 0.5))
+    return idf * term_frequency * (k1 + 1) / (term_frequency + k1 * (1 - b + b * length / average_length))
+
+def test_tokenize_lowercases_and_drops_punctuation():
+    assert tokenize("Apply DISCOUNT-code, now!") == ["apply", "discount", "code", "now"]
+
+def test_scores_match_okapi_bm25():
+    index = BM25Index(DOCUMENTS)
+    average_length = (5 + 7 + 6) / 3
+    scores = index.scores("checkout receipt")
+    assert scores[0] == pytest.approx(bm25(1, 2, 3, 5, average_length), rel=1e-5)
+    assert scores[1] == pytest.approx(bm25(2, 2, 3, 7, average_length), rel=1e-5)
+    assert scores[2] == pytest.approx(bm25(1, 1, 3, 6, average_length), rel=1e-5)
+
+def test_search_ranks_and_drops_documents_without_a_match():
+    index = BM25Index(DOCUMENTS)
+    assert [document.id for document, _ in index.search("discount checkout", k=4)] == ["discount", "cart"]
+    assert [document.id for document, _ in index.search("discount checkout", k=1)] == ["discount"]
+    assert index.search("unrelated") == []
+
+def test_empty_index():
+    index = BM25Index([])
+    assert len(index) == 0
+    assert index.search("checkout") == []
+
+def test_bm25_retriever():
+    retriever = BM25Retriever(index=BM25Index(DOCUMENTS), k=1)
+    assert [document.id for document in retriever.invoke("email the customer")] == ["receipt"]
+
+class FixedVectorStore:
+    '''
+    similarity_search_with_score returning fixed cosine similarities by document id
+    '''
+    def __init__(self, similarities):
+        self.similarities = similarities
+
+    def similarity_search_with_score(self, query, k):
+        return [(document, self.similarities[document.id]) for document in DOCUMENTS][:k]
+
+def test_hybrid_alpha_moves_between_lexical_and_vector_ranking():
+    index = BM25Index(DOCUMENTS)
+    vectorstore = FixedVectorStore({"cart": -1.0, "discount": 0.0, "receipt": 1.0})
+    def ranking(alpha):
+        return [document.id for document in HybridRetriever(index=index, vectorstore=vectorstore, alpha=alpha, k=3).invoke("discount")]
+    assert ranking(1.0)[0] == "discount"
+    assert ranking(0.0) == ["receipt", "discount", "cart"]
+    assert ranking(0.5) == ["discount", "receipt", "cart"]
@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+import database
+import resultcache
+from resultcache import CachedGeneration, get_result_cache_stats
+
+CONTEXT = [Document(page_content="Checkout rules", metadata={"source_id": "issue:T1"})]
+
+class CountingGeneration:
+    def __init__(self):
+        self.calls = 0
+
+    def answer(self, inputs):
+        self.calls += 1
+        return f"answer {self.calls} to {inputs['input']}"
+
+    def runnable(self):
+        return RunnableLambda(self.answer)
+
+@pytest.fixture
+def generation(db):
+    return CountingGeneration()
+
+def cached(generation, prompt_version=1, embeddings=None):
+    return CachedGeneration(generation.runnable(), "CLARIFY", prompt_version, "model", "P", embeddings)
+
+def stats_delta(before):
+    after = get_result_cache_stats()
+    return {name: after[name] - before[name] for name in after}
+
+def test_same_question_and_context_is_generated_once(generation):
+    before = get_result_cache_stats()
+    first = cached(generation).invoke({"context": CONTEXT, "input": "q"})
+    assert cached(generation).invoke({"context": CONTEXT, "input": "q"}) == first
+    assert generation.calls == 1
+    assert stats_delta(before) == {"hits": 1, "semantic_hits": 0, "misses": 1}
+
+@pytest.mark.parametrize("change", [
+    {"input": "other"},
+    {"context": [Document(page_content="Other rules", metadata={"source_id": "issue:T1"})]},
+])
+def test_other_question_or_context_is_generated_again(generation, change):
+    cached(generation).invoke({"context": CONTEXT, "input": "q"})
+    cached(generation).invoke({"context": CONTEXT, "input": "q", **change})
+    assert generation.calls == 2
+
+def test_other_prompt_version_is_generated_again(generation):
+    cached(generation, prompt_version=1).invoke({"context": CONTEXT, "input": "q"})
+    cached(generation, prompt_version=2).invoke({"context": CONTEXT, "input": "q"})
+    assert generation.calls == 2
+
+def test_nothing_is_cached_without_a_prompt_version(generation, db):
+    cached(generation, prompt_version=None).invoke({"context": CONTEXT, "input": "q"})
+    cached(generation, prompt_version=None).invoke({"context": CONTEXT, "input": "q"})
+    assert generation.calls == 2
+    assert db['agent_results'].count_documents({}) == 0
+
+def test_stream_stores_the_joined_answer(generation):
+    streamed = "".join(cached(generation).stream({"context": CONTEXT, "input": "q"}))
+    assert cached(generation).invoke({"context": CONTEXT, "input": "q"}) == streamed
+    assert generation.calls == 1
+
+def test_async_calls_share_the_cache(generation, async_db):
+    async def run():
+        first = await cached(generation).ainvoke({"context": CONTEXT, "input": "q"})
+        tokens = [token async for token in cached(generation).astream({"context": CONTEXT, "input": "q"})]
+        return first, "".join(tokens)
+    first, streamed = asyncio.run(run())
+    assert first == streamed
+    assert cached(generation).invoke({"context": CONTEXT, "input": "q"}) == first
+    assert generation.calls == 1
+
+def test_async_lookup_stays_on_the_event_loop(generation, async_db, monkeypatch):
+    monkeypatch.setattr(resultcache, 'getAgentResult', lambda key: pytest.fail("blocking read"))
+    monkeypatch.setattr(resultcache, 'storeAgentResult', lambda result: pytest.fail("blocking write"))
+    async def run():
+        return [await cached(generation).ainvoke({"context": CONTEXT, "input": "q"}) for _ in range(2)]
+    first, second = asyncio.run(run())
+    assert first == second
+    assert generation.calls == 1
+
+def test_invalidated_sources_are_generated_again(generation):
+    cached(generation).invoke({"context": CONTEXT, "input": "q"})
+    assert database.invalidateAgentResults("P", ["issue:T1"]) == 1
+    cached(generation).invoke({"context": CONTEXT, "input": "q"})
+    assert generation.calls == 2
+
+class KeywordEmbeddings:
+    def embed_query(self, text):
+        return [1.0, 0.0] if "checkout" in text else [0.0, 1.0]
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+def test_similar_question_reuses_the_answer_above_the_threshold(generation, monkeypatch):
+    monkeypatch.setattr(resultcache, 'AGENT_RESULT_SEMANTIC_THRESHOLD', 0.9)
+    embeddings = KeywordEmbeddings()
+    before = get_result_cache_stats()
+    first = cached(generation, embeddings=embeddings).invoke({"context": CONTEXT, "input": "how does checkout work"})
+    assert cached(generation, embeddings=embeddings).invoke({"context": CONTEXT, "input": "explain checkout"}) == first
+    cached(generation, embeddings=embeddings).invoke({"context": CONTEXT, "input": "who is the reporter"})
+    assert generation.calls == 2
+    assert stats_delta(before) == {"hits": 0, "semantic_hits": 1, "misses": 2}
+
+def test_async_semantic_lookup(generation, async_db, monkeypatch):
+    monkeypatch.setattr(resultcache, 'AGENT_RESULT_SEMANTIC_THRESHOLD', 0.9)
+    embeddings = KeywordEmbeddings()
+    first = cached(generation, embeddings=embeddings).invoke({"context": CONTEXT, "input": "how does checkout work"})
+    assert asyncio.run(cached(generation, embeddings=embeddings).ainvoke({"context": CONTEXT, "input": "explain checkout"})) == first
+    assert generation.calls == 1
@@ -0,0 +1,26 @@
+import asyncio
+import time
+import httpx
+import pytest
+from flask import Flask
+
+serve = pytest.importorskip('serve')
+
+def test_flask_routes_run_side_by_side():
+    flask_app = Flask(__name__)
+
+    @flask_app.route('/slow')
+    def slow():
+        time.sleep(0.3)
+        return {"ok": True}
+
+    async def run():
+        transport = httpx.ASGITransport(app=serve.ThreadedWsgiToAsgi(flask_app))
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            started = time.perf_counter()
+            responses = await asyncio.gather(*(client.get('/slow') for _ in range(4)))
+            return responses, time.perf_counter() - started
+    responses, elapsed = asyncio.run(run())
+    assert [response.json() for response in responses] == [{"ok": True}] * 4
+    # One shared thread would take 1.2 s
+    assert elapsed < 0.9
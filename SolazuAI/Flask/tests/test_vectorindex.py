@@ -0,0 +1,134 @@
+import hashlib
+import pytest
+from langchain_core.embeddings import Embeddings
+import database
+import vectorindex
+from utils import build_issue_tree
+
+class CountingEmbeddings(Embeddings):
+    '''
+    Hash-based vectors; records every text embedded
+    '''
+    def __init__(self):
+        self.texts = []
+
+    def vector(self, text):
+        return [byte / 255 for byte in hashlib.sha256(text.encode('utf-8')).digest()[:16]]
+
+    def embed_documents(self, texts):
+        self.texts.extend(texts)
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.vector(text)
+
+def issue(key, issue_type, parent=None, description=None):
+    return {"key": key, "summary": f"Summary {key}", "description": description or f"Description {key}", "issue_type": issue_type, "parent": parent, "source": {}}
+
+def store(issues, replaceIssues=True):
+    return database.storeProjectData({"project_name": "P", "github_link": [], "jira_link": [], "docs_link": [], "confluence_link": [], "issues": build_issue_tree(issues), "confluence_pages": []}, replaceIssues)[1]
+
+@pytest.fixture
+def embeddings(db, tmp_path, monkeypatch):
+    embeddings = CountingEmbeddings()
+    monkeypatch.setattr(vectorindex, '_embeddings', embeddings)
+    monkeypatch.setattr(vectorindex, '_indexes', {})
+    monkeypatch.setattr(vectorindex, 'CHROMA_PERSIST_DIR', str(tmp_path))
+    return embeddings
+
+@pytest.fixture
+def source_reads(monkeypatch):
+    reads = []
+    read = vectorindex.getIndexSources
+    def recording_read(project_name, keys=None):
+        reads.append(keys)
+        return read(project_name, keys)
+    monkeypatch.setattr(vectorindex, 'getIndexSources', recording_read)
+    return reads
+
+def indexed_texts(project_name="P"):
+    return sorted(vectorindex.get_project_index(project_name).get(include=['documents'])['documents'])
+
+def test_delta_sync_only_embeds_the_touched_issues(embeddings, source_reads):
+    store([issue("E1", "Epic"), issue("T1", "Task", "E1"), issue("T2", "Task", "E1")])
+    assert vectorindex.sync_project_index("P")["sources_indexed"] == 3
+    embeddings.texts.clear()
+
+    touched = store([issue("T1", "Task", "E1", description="Changed")], replaceIssues=False)
+    assert touched == {"T1", "E1"}
+    assert vectorindex.sync_project_index("P", touched) == {"sources_indexed": 1, "sources_removed": 0, "chunks_added": 1, "results_invalidated": 0}
+    assert embeddings.texts == ["Title: Summary T1\nContent: Changed"]
+    assert source_reads[-1] == {"T1", "E1"}
+    assert indexed_texts() == ["Title: Summary E1\nContent: Description E1", "Title: Summary T1\nContent: Changed", "Title: Summary T2\nContent: Description T2"]
+
+def test_delta_sync_without_changes_reads_nothing(embeddings, source_reads):
+    store([issue("E1", "Epic")])
+    vectorindex.sync_project_index("P")
+    version = database.getIndexVersion("P")
+    source_reads.clear()
+    assert vectorindex.sync_project_index("P", set())["sources_indexed"] == 0
+    assert source_reads == []
+    assert database.getIndexVersion("P") == version
+
+def test_delta_sync_of_an_unbuilt_index_compares_everything(embeddings, source_reads):
+    store([issue("E1", "Epic"), issue("T1", "Task", "E1")])
+    assert vectorindex.sync_project_index("P", {"T1"})["sources_indexed"] == 2
+    assert source_reads == [None]
+
+def test_chunks_indexed_without_an_issue_key_are_replaced(embeddings):
+    store([issue("E1", "Epic"), issue("T1", "Task", "E1")])
+    vectorindex.sync_project_index("P")
+    index = vectorindex.get_project_index("P")
+    # As written before chunks carried issue_key
+    stored = index.get(include=['documents', 'metadatas', 'embeddings'])
+    index.delete(ids=stored['ids'])
+    index._collection.add(ids=stored['ids'], documents=stored['documents'], embeddings=stored['embeddings'], metadatas=[{k: v for k, v in metadata.items() if k != 'issue_key'} for metadata in stored['metadatas']])
+    assert not index.get(where={"issue_key": "T1"})['ids']
+
+    touched = store([issue("T1", "Task", "E1", description="Changed")], replaceIssues=False)
+    vectorindex.sync_project_index("P", touched)
+    assert indexed_texts() == ["Title: Summary E1\nContent: Description E1", "Title: Summary T1\nContent: Changed"]
+
+def test_project_without_sources_is_synced_once(embeddings, source_reads):
+    store([])
+    vectorindex.get_project_index("P", build=True)
+    vectorindex.get_project_index("P", build=True)
+    assert source_reads == [None]
+    assert database.getIndexVersion("P") == 1
+
+@pytest.fixture
+def scope_reads(embeddings, monkeypatch):
+    monkeypatch.setattr(vectorindex, '_scope_stores', vectorindex.OrderedDict())
+    store([issue("E1", "Epic"), issue("T1", "Task", "E1")])
+    vectorindex.sync_project_index("P")
+    reads = []
+    index = vectorindex.get_project_index("P")
+    read = index.get
+    def recording_get(*args, **kwargs):
+        reads.append(kwargs.get('where'))
+        return read(*args, **kwargs)
+    monkeypatch.setattr(index, 'get', recording_get)
+    return reads
+
+def test_cached_scope_does_not_query_the_index(scope_reads):
+    first = vectorindex.get_scope_store("P", "E1")
+    bm25 = vectorindex.get_scope_bm25("P", "E1")
+    reads = len(scope_reads)
+    assert vectorindex.get_scope_store("P", "E1") is first
+    assert vectorindex.get_scope_bm25("P", "E1") is bm25
+    assert len(scope_reads) == reads and set(map(str, scope_reads)) == {str({"epic_key": "E1"})}
+
+def test_scope_is_rebuilt_after_a_sync_in_another_process(scope_reads):
+    first = vectorindex.get_scope_bm25("P", "E1")
+    version = vectorindex.corpus_version("P")
+    # Another worker synced: only the persisted version tells this process
+    database.bumpIndexVersion("P")
+    assert vectorindex.corpus_version("P") != version
+    assert vectorindex.get_scope_bm25("P", "E1") is not first
+    assert len(scope_reads) == 2
+
+def test_scope_store_is_loaded_page_by_page(scope_reads, monkeypatch):
+    monkeypatch.setattr(vectorindex, 'SCOPE_LOAD_PAGE_SIZE', 1)
+    store = vectorindex.get_scope_store("P", "E1")
+    assert len(store) == 2 and len(scope_reads) == 3
+    assert sorted(document.page_content for document, _ in store.similarity_search_with_score("Summary T1", k=2)) == indexed_texts()
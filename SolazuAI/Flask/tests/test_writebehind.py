@@ -0,0 +1,97 @@
+import threading
+import pytest
+import database
+import writebehind
+from writebehind import WriteBehindBuffer
+
+class RecordingFlush:
+    '''
+    flush callable that records its batches and fails the first `failures` calls
+    '''
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+        self.called = threading.Event()
+
+    def __call__(self, batch):
+        self.called.set()
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("write failed")
+        self.batches.append(list(batch))
+
+    @property
+    def items(self):
+        return [item for batch in self.batches for item in batch]
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(writebehind, 'WRITE_BEHIND_RETRY_DELAY', 0)
+
+def test_flush_writes_everything_in_order_in_batches():
+    flush = RecordingFlush()
+    buffer = WriteBehindBuffer(flush, batch_size=3, interval=60)
+    for number in range(7):
+        buffer.add(number)
+    buffer.flush()
+    assert flush.items == list(range(7))
+    assert all(len(batch) <= 3 for batch in flush.batches)
+    buffer.close()
+
+def test_full_batch_is_written_without_waiting_for_the_interval():
+    flush = RecordingFlush()
+    buffer = WriteBehindBuffer(flush, batch_size=2, interval=60)
+    buffer.add("a")
+    buffer.add("b")
+    assert flush.called.wait(5)
+    buffer.close()
+    assert flush.batches == [["a", "b"]]
+
+def test_items_stay_pending_until_written():
+    release = threading.Event()
+    written = []
+
+    def slow_flush(batch):
+        release.wait(5)
+        written.extend(batch)
+
+    buffer = WriteBehindBuffer(slow_flush, batch_size=1, interval=0)
+    buffer.add(("message", 1))
+    buffer.add(("question", 2))
+    assert buffer.pending(lambda item: item[0] == "message") == [("message", 1)]
+    release.set()
+    buffer.flush()
+    assert buffer.pending(lambda item: True) == []
+    assert written == [("message", 1), ("question", 2)]
+    buffer.close()
+
+def test_failed_batch_is_retried_ahead_of_newer_items():
+    flush = RecordingFlush(failures=1)
+    buffer = WriteBehindBuffer(flush, batch_size=2, interval=60)
+    buffer.add(1)
+    buffer.add(2)
+    buffer.flush()  # returns on the failure
+    buffer.add(3)
+    buffer.flush()
+    assert flush.items == [1, 2, 3]
+    buffer.close()
+
+def test_close_writes_what_is_left():
+    flush = RecordingFlush()
+    buffer = WriteBehindBuffer(flush, batch_size=100, interval=60)
+    buffer.add(1)
+    buffer.close()
+    assert flush.items == [1]
+
+def test_session_history_sees_queued_messages(db, monkeypatch):
+    monkeypatch.setattr(database, '_history_writes', WriteBehindBuffer(database.flushHistoryWrites, interval=60))
+    database.store_message("s1", "human", "question", 1, 0)
+    database.store_message("s1", "ai", "answer", 0, 1)
+    assert [message.content for message in database.get_session_history("s1").messages] == ["question", "answer"]
+    assert db['history_messages'].count_documents({}) == 0
+
+    database._history_writes.flush()
+    database.store_message("s1", "human", "follow-up", 1, 0)
+    assert [message.content for message in database.get_session_history("s1").messages] == ["question", "answer", "follow-up"]
+    database._history_writes.close()
+    assert [message['seq'] for message in db['history_messages'].find({"sessionID": "s1"}).sort("seq", 1)] == [1, 2, 3]
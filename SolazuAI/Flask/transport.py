@@ -0,0 +1,150 @@
+import os
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 10))  # hosts with a pool of their own
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 20))  # keep-alive connections per host
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 5))
+HTTP_BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', 0.5))  # seconds
+HTTP_BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', 30))
+HTTP_RATE_LIMIT_MAX_WAIT = float(os.getenv('HTTP_RATE_LIMIT_MAX_WAIT', 120))  # longer waits give the response back
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 30))
+
+RETRY_STATUSES = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+# ---------------------------- REQUEST COUNTERS ----------------------------
+
+_counters_lock = threading.Lock()
+_counters = defaultdict(Counter)
+
+def record(host, name):
+    with _counters_lock:
+        _counters[host][name] += 1
+
+def get_request_counters():
+    '''
+    Return the per-host counters: requests, retries, rate_limited, errors and status_<code>
+    '''
+    with _counters_lock:
+        return {host: dict(counter) for host, counter in _counters.items()}
+
+# ---------------------------- RETRY POLICY ----------------------------
+
+def backoff_delay(attempt):
+    # Full jitter: anywhere between 0 and the exponential cap
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+def rate_limit_delay(response):
+    '''
+    Seconds the server asks us to wait, from Retry-After or X-RateLimit-Reset, or None
+    '''
+    retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        if retry_after.isdigit():
+            return float(retry_after)
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    if response.headers.get('X-RateLimit-Remaining') == '0' and response.headers.get('X-RateLimit-Reset'):
+        try:
+            return max(0.0, float(response.headers['X-RateLimit-Reset']) - time.time())
+        except ValueError:
+            pass
+    return None
+
+def retry_delay(response, attempt, method):
+    '''
+    Seconds to wait before retrying the response, or None when it should be returned as is.
+    Server errors are only retried for idempotent methods, a POST may already have taken effect
+    '''
+    if response.status_code == 429 or response.status_code == 403:
+        delay = rate_limit_delay(response)
+        if delay is None:
+            if response.status_code == 403 and 'rate limit' not in response.text.lower():
+                return None  # a genuine permission error
+            delay = backoff_delay(attempt)
+        if delay > HTTP_RATE_LIMIT_MAX_WAIT:
+            return None
+        return delay + random.uniform(0, HTTP_BACKOFF_BASE)
+    if response.status_code in RETRY_STATUSES and method in IDEMPOTENT_METHODS:
+        return backoff_delay(attempt)
+    return None
+
+class RetryingAdapter(HTTPAdapter):
+    '''
+    Pooled adapter that retries rate-limited and failed requests with jittered
+    backoff and counts every attempt per host
+    '''
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).netloc
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = HTTP_TIMEOUT
+        attempt = 0
+        while True:
+            record(host, 'requests')
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                record(host, 'errors')
+                if attempt >= HTTP_MAX_RETRIES or request.method not in IDEMPOTENT_METHODS:
+                    raise
+                delay = backoff_delay(attempt)
+            else:
+                record(host, f"status_{response.status_code}")
+                delay = retry_delay(response, attempt, request.method) if attempt < HTTP_MAX_RETRIES else None
+                if delay is None:
+                    return response
+                if response.status_code in (403, 429):
+                    record(host, 'rate_limited')
+                response.close()
+            record(host, 'retries')
+            time.sleep(delay)
+            attempt += 1
+
+# One adapter, and so one set of per-host connection pools, for every connector
+_adapter = RetryingAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+
+def mount(session):
+    '''
+    Route a session, including one owned by a client library, through the shared adapter
+    '''
+    session.mount('https://', _adapter)
+    session.mount('http://', _adapter)
+    return session
+
+def create_session():
+    '''
+    Return a new session on the shared pools. Sessions carry their own auth and headers,
+    so give each connector its own
+    '''
+    return mount(requests.Session())
+
+class PooledHttp:
+    '''
+    httplib2.Http stand-in for googleapiclient and oauth2client that sends its
+    requests through the shared transport
+    '''
+    def __init__(self):
+        self.session = create_session()
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        response = self.session.request(method, uri, data=body, headers=headers, allow_redirects=redirections > 0)
+        # requests has already decoded the body, so its encoding headers no longer apply
+        info = {k.lower(): v for k, v in response.headers.items() if k.lower() not in ('content-encoding', 'content-length')}
+        info['status'] = response.status_code
+        return httplib2.Response(info), response.content
+
+    def close(self):
+        self.session.close()
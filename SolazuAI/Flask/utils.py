@@ -1,74 +1,264 @@
-import requests
 import os 
 from jira import JIRA
 import googleapiclient.discovery as discovery
-from httplib2 import Http
 from oauth2client import client
 from oauth2client import file
 from oauth2client import tools
 from atlassian import Confluence
 from dotenv import load_dotenv
 from flask import jsonify
-from datetime import datetime
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+import threading
+import hashlib
+import json
 import re
+import logging
+from transport import create_session, mount, PooledHttp
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Concurrency limits for the Jira ingestion pipeline
+JIRA_PAGE_SIZE = int(os.getenv('JIRA_PAGE_SIZE', 100))
+JIRA_LINK_WORKERS = int(os.getenv('JIRA_LINK_WORKERS', 8))
+CONFLUENCE_WORKERS = int(os.getenv('CONFLUENCE_WORKERS', 4))
+# Delta syncs re-read issues updated this many minutes before the stored watermark
+JIRA_SYNC_OVERLAP_MINUTES = int(os.getenv('JIRA_SYNC_OVERLAP_MINUTES', 5))
+
+# ---------------------------- SHARED CLIENTS ----------------------------
+
+_client_lock = threading.Lock()
+_jira_client = None
+_confluence_client = None
+
+def get_jira_client():
+    '''
+    Return the process-wide JIRA client, authenticating on first use
+    '''
+    global _jira_client
+    if _jira_client is None:
+        with _client_lock:
+            if _jira_client is None:
+                jiraOptions = {'server': os.getenv('JIRA_SERVER')}
+                # Retries and rate limits are handled by the shared transport
+                jira = JIRA(options=jiraOptions, basic_auth=(os.getenv('JIRA_USERNAME'), os.getenv('JIRA_API_TOKEN')), max_retries=0)
+                mount(jira._session)
+                _jira_client = jira
+    return _jira_client
+
+def get_confluence_client():
+    '''
+    Return the process-wide Confluence client, creating it on first use
+    '''
+    global _confluence_client
+    if _confluence_client is None:
+        with _client_lock:
+            if _confluence_client is None:
+                _confluence_client = Confluence(
+                    url=os.getenv('CONFLUENCE_URL'),
+                    username=os.getenv('CONFLUENCE_USERNAME'),
+                    password=os.getenv('CONFLUENCE_API_TOKEN'),
+                    session=create_session()
+                )
+    return _confluence_client
+
 # ---------------------------- FETCH GITHUB CONTENTS BY LINK ----------------------------
 
-def fetch_directory_contents(url, headers):
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        contents = response.json()
-        directory_contents = {}
-        for item in contents:
-            if item['type'] == 'file':
-                file_response = requests.get(item['download_url'], headers=headers)
-                if file_response.status_code == 200:
-                    directory_contents[item['name']] = file_response.text
-                else:
-                    directory_contents[item['name']] = {'error': 'Failed to fetch file', 'status': file_response.status_code}
-            elif item['type'] == 'dir':
-                # Make sure only one question mark is used, and parameters are separated by ampersands
-                subdir_url = f"{item['url']}&recursive=1"
-                directory_contents[item['name']] = fetch_directory_contents(subdir_url, headers)
-        return directory_contents
+GITHUB_API_URL = 'https://api.github.com'
+GITHUB_FETCH_WORKERS = int(os.getenv('GITHUB_FETCH_WORKERS', 8))
+GITHUB_MAX_FILE_SIZE = int(os.getenv('GITHUB_MAX_FILE_SIZE', 1024 * 1024))  # bytes
+GITHUB_CACHE_DIR = os.getenv('GITHUB_CACHE_DIR', '.github_cache')
+GITHUB_STREAM_WINDOW = int(os.getenv('GITHUB_STREAM_WINDOW', 16))  # files held in memory while streaming
+BINARY_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.ico', '.webp', '.pdf', '.zip', '.gz', '.tar', '.tgz',
+    '.7z', '.rar', '.jar', '.war', '.class', '.exe', '.dll', '.so', '.dylib', '.bin', '.o', '.a',
+    '.woff', '.woff2', '.ttf', '.otf', '.eot', '.mp3', '.mp4', '.mov', '.avi', '.wav', '.psd',
+    '.pyc', '.sqlite', '.db'
+}
+
+github_session = create_session()
+
+def write_cache_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def github_get_json(url, headers):
+    '''
+    GET a GitHub API url, revalidating the cached response with If-None-Match.
+    Returns (status_code, body); a 304 is answered from the cache as a 200
+    '''
+    cache_path = os.path.join(GITHUB_CACHE_DIR, 'etags', hashlib.sha1(url.encode()).hexdigest() + '.json')
+    cached = None
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cached = json.load(f)
+
+    request_headers = dict(headers)
+    if cached:
+        request_headers['If-None-Match'] = cached['etag']
+    response = github_session.get(url, headers=request_headers)
+
+    if response.status_code == 304 and cached:
+        return 200, cached['body']
+    if response.status_code != 200:
+        return response.status_code, response.text
+
+    body = response.json()
+    if response.headers.get('ETag'):
+        write_cache_file(cache_path, json.dumps({'etag': response.headers['ETag'], 'body': body}).encode())
+    return 200, body
+
+def list_repository_tree(owner, repo, headers):
+    '''
+    List every file of the default branch with a single recursive trees call.
+    Returns (entries, error)
+    '''
+    status, repository = github_get_json(f"{GITHUB_API_URL}/repos/{owner}/{repo}", headers)
+    if status != 200:
+        print(f"Failed to fetch repository {owner}/{repo}, Status Code: {status}, Response: {repository}")
+        return None, {'error': f"Failed to fetch repository with status: {status}"}
+
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/git/trees/{repository['default_branch']}?recursive=1"
+    status, tree = github_get_json(url, headers)
+    if status != 200:
+        print(f"Failed to fetch, URL: {url}, Status Code: {status}, Response: {tree}")
+        return None, {'error': f"Failed to fetch directory with status: {status}"}
+    if tree.get('truncated'):
+        print(f"Tree of {owner}/{repo} is truncated, some files are missing")
+
+    return [entry for entry in tree['tree'] if entry['type'] == 'blob'], None
+
+def fetch_repository_file(owner, repo, entry, headers):
+    '''
+    Fetch one file of the tree by blob SHA. Returns a record with path, size, sha and
+    either content, error or the reason it was skipped
+    '''
+    record = {'path': entry['path'], 'size': entry.get('size', 0), 'sha': entry['sha']}
+    if os.path.splitext(entry['path'])[1].lower() in BINARY_EXTENSIONS:
+        return {**record, 'skipped': 'binary'}
+    if record['size'] > GITHUB_MAX_FILE_SIZE:
+        return {**record, 'skipped': 'too large'}
+
+    # Blobs are addressed by SHA, so a cached copy never needs revalidating
+    cache_path = os.path.join(GITHUB_CACHE_DIR, 'blobs', entry['sha'])
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            data = f.read()
     else:
-        print(f"Failed to fetch, URL: {url}, Status Code: {response.status_code}, Response: {response.text}")
-        return {'error': f"Failed to fetch directory with status: {response.status_code}"}
+        response = github_session.get(f"{GITHUB_API_URL}/repos/{owner}/{repo}/git/blobs/{entry['sha']}",
+                                      headers={**headers, 'Accept': 'application/vnd.github.raw'})
+        if response.status_code != 200:
+            return {**record, 'error': 'Failed to fetch file', 'status': response.status_code}
+        data = response.content
+        write_cache_file(cache_path, data)
+
+    if b'\0' in data:
+        return {**record, 'skipped': 'binary'}
+    try:
+        return {**record, 'content': data.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {**record, 'skipped': 'binary'}
+
+def parse_github_url(github_url):
+    '''
+    Return (owner, repo) of a GitHub repository link, or None
+    '''
+    match = re.search(r'github\.com/([^/]+)/([^/]+)', github_url or '')
+    return match.groups() if match else None
+
+def github_request_headers():
+    GITHUB_TOKEN = os.getenv('GITHUB_TOKEN')  # Should be secured differently
+    return {
+        'Authorization': f'token {GITHUB_TOKEN}',
+        'Accept': 'application/vnd.github.v3+json'
+    }
     
 def load_repository_contents(github_url):
-    GITHUB_TOKEN = os.getenv('GITHUB_TOKEN')  # Should be secured differently
     if not github_url:
         return jsonify({'error': 'GitHub URL is required'}), 400
 
-    match = re.search(r'github\.com/([^/]+)/([^/]+)', github_url)
-    if not match:
+    repository = parse_github_url(github_url)
+    if not repository:
         return jsonify({'error': 'Invalid GitHub URL'}), 400
 
-    owner, repo = match.groups()
-    url = f"https://api.github.com/repos/{owner}/{repo}/contents?recursive=1"
-    headers = {
-        'Authorization': f'token {GITHUB_TOKEN}',
-        'Accept': 'application/vnd.github.v3+json'
-    }
+    owner, repo = repository
+    headers = github_request_headers()
 
-    repository_contents = fetch_directory_contents(url, headers)
-    if 'error' not in repository_contents:
-        return jsonify(repository_contents)
-    else:
+    entries, error = list_repository_tree(owner, repo, headers)
+    if error:
         return jsonify({'error': 'Failed to retrieve repository contents'})
 
+    # Nest the files by directory, the layout the frontend expects
+    repository_contents = {}
+    with ThreadPoolExecutor(max_workers=GITHUB_FETCH_WORKERS) as pool:
+        for record in pool.map(lambda entry: fetch_repository_file(owner, repo, entry, headers), entries):
+            *directories, name = record['path'].split('/')
+            directory_contents = repository_contents
+            for directory in directories:
+                directory_contents = directory_contents.setdefault(directory, {})
+            if 'content' in record:
+                directory_contents[name] = record['content']
+            elif 'error' in record:
+                directory_contents[name] = {'error': record['error'], 'status': record['status']}
+            else:
+                directory_contents[name] = {'skipped': record['skipped']}
+    return jsonify(repository_contents)
+
+def stream_repository_contents(owner, repo):
+    '''
+    Yield one NDJSON record per file as soon as it is fetched. At most
+    GITHUB_STREAM_WINDOW files are in flight or waiting to be sent at a time
+    '''
+    headers = github_request_headers()
+    entries, error = list_repository_tree(owner, repo, headers)
+    if error:
+        yield json.dumps(error) + '\n'
+        return
+
+    entries = iter(entries)
+    with ThreadPoolExecutor(max_workers=GITHUB_FETCH_WORKERS) as pool:
+        pending = {pool.submit(fetch_repository_file, owner, repo, entry, headers) for entry in islice(entries, GITHUB_STREAM_WINDOW)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield json.dumps(future.result()) + '\n'
+                entry = next(entries, None)
+                if entry is not None:
+                    pending.add(pool.submit(fetch_repository_file, owner, repo, entry, headers))
+
 # ---------------------------- GET CONFLUENCE DETAILS BY LINK ----------------------------
+
+CONFLUENCE_CACHE_DIR = os.getenv('CONFLUENCE_CACHE_DIR', '.confluence_cache')
+
+def read_cached_confluence_page(page_id):
+    cache_path = os.path.join(CONFLUENCE_CACHE_DIR, f"{page_id}.json")
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path) as f:
+        return json.load(f)
+
 def get_confluence_details(url):
-    confluence = Confluence(
-        url=os.getenv('CONFLUENCE_URL'),
-        username=os.getenv('CONFLUENCE_USERNAME'),
-        password=os.getenv('CONFLUENCE_API_TOKEN')
-    )
+    '''
+    Return the details of a Confluence page. A locally cached copy is reused when
+    a version-only lookup shows the page has not changed since it was cached
+    '''
+    confluence = get_confluence_client()
     page_id = url.split('=')[-1]  # Extract page ID from URL
     print(page_id)
     try:
+        cached = read_cached_confluence_page(page_id)
+        if cached:
+            version = confluence.get_page_by_id(page_id, expand='version').get('version', {}).get('number')
+            if version == cached.get('version'):
+                return cached
+
         page = confluence.get_page_by_id(page_id, expand='body.storage,version,metadata,ancestors,space')
         content = page.get('body', {}).get('storage', {}).get('value', '')
         page_details = {
@@ -79,10 +269,37 @@ def get_confluence_details(url):
             "created_by": page.get('version', {}).get('by', {}).get('displayName'),
             "created_date": page.get('version', {}).get('when'),
         }
+        write_cache_file(os.path.join(CONFLUENCE_CACHE_DIR, f"{page_id}.json"), json.dumps(page_details).encode())
         return page_details
     except Exception as e:
         return {"error": "Failed to fetch Confluence page details", "details": str(e)}
 
+class ConfluencePageFetcher:
+    '''
+    Fetch every Confluence page at most once per ingestion run, however many issues
+    link to it. Pages are fetched on pool when given, otherwise right away
+    '''
+    def __init__(self, pool=None):
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.futures = {}
+
+    def submit(self, url):
+        page_id = url.split('=')[-1]
+        with self.lock:
+            if page_id not in self.futures:
+                if self.pool:
+                    self.futures[page_id] = self.pool.submit(get_confluence_details, url)
+                else:
+                    self.futures[page_id] = Future()
+                    self.futures[page_id].set_result(get_confluence_details(url))
+            return self.futures[page_id]
+
+    def pages(self):
+        '''
+        Return the successfully fetched pages, including their content
+        '''
+        return [future.result() for future in self.futures.values() if 'error' not in future.result()]
 
 # ---------------------------- GET GOOGLE DOCS DETAILS BY LINK --------------------------------
 def read_paragraph_element(element):
@@ -92,53 +309,135 @@ def read_paragraph_element(element):
         return ''
     return text_run.get('content')
 
-def read_structural_elements(elements):
-    """Recurses through a list of Structural Elements to read a document's text where text may be in nested elements."""
-    text = ''
+def collect_structural_elements(elements, fragments):
+    """Appends the text of a list of Structural Elements to fragments, recursing into tables and tables of contents."""
     for value in elements:
         if 'paragraph' in value:
             elements = value.get('paragraph').get('elements')
             for elem in elements:
-                text += read_paragraph_element(elem)
+                fragments.append(read_paragraph_element(elem))
         elif 'table' in value:
             table = value.get('table')
             for row in table.get('tableRows'):
                 cells = row.get('tableCells')
                 for cell in cells:
-                    text += read_structural_elements(cell.get('content'))
+                    collect_structural_elements(cell.get('content'), fragments)
         elif 'tableOfContents' in value:
             toc = value.get('tableOfContents')
-            text += read_structural_elements(toc.get('content'))
-    return text
+            collect_structural_elements(toc.get('content'), fragments)
 
-def get_google_docs_details(url):
+def read_structural_elements(elements):
+    """Reads a document's text where text may be in nested elements, joining the fragments once."""
+    fragments = []
+    collect_structural_elements(elements, fragments)
+    return ''.join(fragments)
+
+GOOGLE_DOCS_BATCH_SIZE = 50  # the batch endpoint accepts at most 100 calls
+
+# Guards building the shared service and refreshing its token; fetches run without it
+_docs_lock = threading.Lock()
+_docs_service = None
+_docs_credentials = None
+
+class DocsCredentialsUnavailable(Exception):
+    pass
+
+def get_docs_service():
+    '''
+    Return the process-wide Docs service, building it on first use and refreshing the
+    access token once it has expired. Raises DocsCredentialsUnavailable when token.json
+    is missing or invalid: the consent flow is interactive, so it is only started by
+    authorize_google_docs, never from a request or an ingestion job
+    '''
+    global _docs_service, _docs_credentials
+    with _docs_lock:
+        if _docs_service is None:
+            DISCOVERY_DOC = os.getenv('DISCOVERY_DOC')
+            credentials = file.Storage('token.json').get()
+            if not credentials or credentials.invalid:
+                raise DocsCredentialsUnavailable("No valid Google credentials in token.json, run utils.authorize_google_docs()")
+
+            http = credentials.authorize(PooledHttp())
+            _docs_service = discovery.build(
+                'docs', 'v1', http=http, discoveryServiceUrl=DISCOVERY_DOC)
+            _docs_credentials = credentials
+        elif _docs_credentials.access_token_expired:
+            # The refreshed token is written back to token.json by the credential store
+            _docs_credentials.refresh(PooledHttp())
+        return _docs_service
+
+def authorize_google_docs():
+    '''
+    Run the OAuth consent flow in a terminal and store the credentials in token.json
+    '''
     SCOPES = os.getenv('SCOPES')
-    DISCOVERY_DOC = os.getenv('DISCOVERY_DOC')
+    flow = client.flow_from_clientsecrets('credentials.json', SCOPES)
+    return tools.run_flow(flow, file.Storage('token.json'))
+
+def google_docs_details(doc):
+    doc_content = doc.get('body').get('content')
+    return {
+        "id": doc.get('documentId'),
+        "title": doc.get('title'),
+        "content": read_structural_elements(doc_content)
+    }
+
+def get_google_docs_details(url):
     try:
         document_id = url.split('/')[5]  # Extract document ID from URL
         print(document_id)
-        store = file.Storage('token.json')
-        credentials = store.get()
+        docs_service = get_docs_service()
+        doc = docs_service.documents().get(documentId=document_id).execute()
+        return google_docs_details(doc)
+    except Exception as e:
+        return {"error": "Failed to fetch Google Docs details", "details": str(e)}
 
-        if not credentials or credentials.invalid:
-            flow = client.flow_from_clientsecrets('credentials.json', SCOPES)
-            credentials = tools.run_flow(flow, store)
+def get_google_docs_details_batch(urls):
+    '''
+    Fetch several documents through batch requests. Results are in the order of urls
+    '''
+    results = [None] * len(urls)
 
-        http = credentials.authorize(Http())
-        docs_service = discovery.build(
-            'docs', 'v1', http=http, discoveryServiceUrl=DISCOVERY_DOC)
-        doc = docs_service.documents().get(documentId=document_id).execute()
-        doc_content = doc.get('body').get('content')
+    def callback(request_id, doc, exception):
+        if exception is not None:
+            results[int(request_id)] = {"error": "Failed to fetch Google Docs details", "details": str(exception)}
+        else:
+            results[int(request_id)] = google_docs_details(doc)
 
-        text = read_structural_elements(doc_content)
-        doc_details = {
-            "id": doc.get('documentId'),
-            "title": doc.get('title'),
-            "content": text
-        }
-        return doc_details
+    try:
+        docs_service = get_docs_service()
+        for start in range(0, len(urls), GOOGLE_DOCS_BATCH_SIZE):
+            batch = docs_service.new_batch_http_request(callback=callback)
+            for i in range(start, min(start + GOOGLE_DOCS_BATCH_SIZE, len(urls))):
+                try:
+                    document_id = urls[i].split('/')[5]  # Extract document ID from URL
+                except IndexError:
+                    results[i] = {"error": "Failed to fetch Google Docs details", "details": "Invalid Google Docs URL"}
+                    continue
+                batch.add(docs_service.documents().get(documentId=document_id), request_id=str(i))
+            batch.execute()
     except Exception as e:
-        return {"error": "Failed to fetch Google Docs details", "details": str(e)}
+        return [result or {"error": "Failed to fetch Google Docs details", "details": str(e)} for result in results]
+    return results
+
+def attach_google_docs_details(flat_issues):
+    '''
+    Add the id and title of every Google Doc linked from the issues. Each document is
+    fetched once, in batches; like Confluence links, the links keep no content. Without
+    Google credentials the links are kept as bare urls
+    '''
+    links = [link for issue in flat_issues if isinstance(issue['source'], dict) for link in issue['source'].get('googleDocs', [])]
+    urls = list(dict.fromkeys(link['url'] for link in links))
+    if not urls:
+        return
+    try:
+        get_docs_service()
+    except DocsCredentialsUnavailable as e:
+        logger.warning("Skipping details of %d Google Docs links: %s", len(urls), e)
+        return
+    details = dict(zip(urls, get_google_docs_details_batch(urls)))
+    for link in links:
+        link.update({k: v for k, v in details[link['url']].items() if k != 'content'})
     
 
 # ---------------------------- HANDLE WEBHOOK ----------------------------
@@ -162,10 +461,13 @@ def addLinks(link_data):
             })
     return entry
 
-def get_remote_links(issue_key):
-    jiraOptions = {'server': os.getenv('JIRA_SERVER')}
+def get_remote_links(issue_key, page_fetcher=None):
+    '''
+    Fetch and classify the remote links of an issue. Confluence links keep the page
+    metadata only; the page content is collected once by page_fetcher
+    '''
     try:
-        jira = JIRA(options=jiraOptions, basic_auth=(os.getenv('JIRA_USERNAME'), os.getenv('JIRA_API_TOKEN')))
+        jira = get_jira_client()
     except Exception as e:
         return {"error": "Failed to authenticate with JIRA", "details": str(e)}
 
@@ -179,70 +481,127 @@ def get_remote_links(issue_key):
             'otherLinks': []
         }
         
+        confluence_urls = []
         for link in remote_links:
             url = link.object.url
             if 'test-company-webhook.atlassian.net' in url:
-                confluence_details = get_confluence_details(url)
-                classified_links['confluence'].append({'url': url, **confluence_details})
+                confluence_urls.append(url)
+            elif 'docs.google.com/document' in url:
+                classified_links['googleDocs'].append({'url': url})
             else:
                 classified_links['otherLinks'].append({'url': url})
+
+        if page_fetcher is None:
+            page_fetcher = ConfluencePageFetcher()
+        pages = [page_fetcher.submit(url) for url in confluence_urls]
+        for url, page in zip(confluence_urls, pages):
+            confluence_details = {k: v for k, v in page.result().items() if k != 'content'}
+            classified_links['confluence'].append({'url': url, **confluence_details})
         
         return classified_links
 
     except Exception as e:
         return {"error": "Failed to fetch remote issue links from JIRA", "details": str(e)}
+
+def search_issues_paged(jira, queryString, pageSize=JIRA_PAGE_SIZE):
+    '''
+    Yield the issues matching the JQL query, one page of pageSize issues at a time
+    '''
+    startAt = 0
+    while True:
+        page = jira.search_issues(jql_str=queryString, startAt=startAt, maxResults=pageSize)
+        for issue in page:
+            yield issue
+        startAt += len(page)
+        if len(page) == 0 or startAt >= page.total:
+            break
     
-def handle_webhook(projectName, githubLink = None, jiraLink = None, confluenceLink = None, docsLink = None):
+def format_jql_datetime(moment):
     '''
-    Handle the webhook data and return the formatted data
+    Format an aware datetime for a JQL date clause, in the timezone Jira evaluates it in
     '''
-    jiraOptions = {'server': os.getenv('JIRA_SERVER')}
-    try:
-        jira = JIRA(options=jiraOptions, basic_auth=(os.getenv('JIRA_USERNAME'), os.getenv('JIRA_API_TOKEN')))
-    except Exception as e:
-        return jsonify({"error": "Failed to authenticate with JIRA", "details": str(e)}), 403
+    return moment.astimezone(ZoneInfo(os.getenv('JIRA_TIMEZONE', 'UTC'))).strftime('%Y/%m/%d %H:%M')
 
+def build_issue_tree(flat_issues):
+    '''
+    Nest tasks under their epic and subtasks under their task, in the stored layout
+    '''
     issues = []
     epics = {}
     tasks = {}
 
+    for issue_data in flat_issues:
+        if issue_data['issue_type'] == 'Epic':
+            epics[issue_data['key']] = issue_data
+        elif issue_data['issue_type'] == 'Task':
+            tasks[issue_data['key']] = issue_data
+        else:
+            issues.append(issue_data)
+
+    for task_key, task_data in tasks.items():
+        if task_data['parent'] in epics:
+            if 'tasks' not in epics[task_data['parent']]:
+                epics[task_data['parent']]['tasks'] = []
+            epics[task_data['parent']]['tasks'].append(task_data)
+        else:
+            issues.append(task_data)
+
+    for issue_data in issues:
+        if issue_data['parent'] in tasks:
+            if 'subtasks' not in tasks[issue_data['parent']]:
+                tasks[issue_data['parent']]['subtasks'] = []
+            tasks[issue_data['parent']]['subtasks'].append(issue_data)
+
+    return list(epics.values()) + [task for task in tasks.values() if task['parent'] not in epics] + [issue for issue in issues if issue['parent'] not in tasks]
+
+def handle_webhook(projectName, githubLink = None, jiraLink = None, confluenceLink = None, docsLink = None, updatedSince = None, progress = None):
+    '''
+    Handle the webhook data and return the formatted data.
+    With updatedSince (an aware datetime) only issues updated since then are fetched.
+    progress, when given, is called with (phase, issues processed so far)
+    '''
+    try:
+        jira = get_jira_client()
+    except Exception as e:
+        return jsonify({"error": "Failed to authenticate with JIRA", "details": str(e)}), 403
+
+    flat_issues = []
+
     try:
         queryString = 'project = ' + projectName
-        for issue in jira.search_issues(jql_str=queryString, maxResults=False):
-            description = issue.fields.description or ""
-
-            issue_data = {
-                'key': issue.key,
-                'summary': issue.fields.summary,
-                'reporter': issue.fields.reporter.displayName,
-                'description': description,
-                'status': issue.fields.status.name,
-                'issue_type': issue.fields.issuetype.name,
-                'assignee': issue.fields.assignee.displayName if issue.fields.assignee else None,
-                'parent': issue.fields.parent.key if 'parent' in issue.fields.__dict__ else None,
-                'source': get_remote_links(issue.key)
-            }
-
-            if issue.fields.issuetype.name == 'Epic':
-                epics[issue.key] = issue_data
-            elif issue.fields.issuetype.name == 'Task':
-                tasks[issue.key] = issue_data
-            else:
-                issues.append(issue_data)
+        if updatedSince is not None:
+            since = updatedSince - timedelta(minutes=JIRA_SYNC_OVERLAP_MINUTES)
+            queryString += f' AND updated >= "{format_jql_datetime(since)}"'
+        # Remote links and Confluence pages are fetched on their own pools while the
+        # search keeps paging; results are collected back in search order.
+        with ThreadPoolExecutor(max_workers=JIRA_LINK_WORKERS) as link_pool, \
+                ThreadPoolExecutor(max_workers=CONFLUENCE_WORKERS) as confluence_pool:
+            page_fetcher = ConfluencePageFetcher(confluence_pool)
+            if progress:
+                progress('searching', 0)
+            pending = [
+                (issue, link_pool.submit(get_remote_links, issue.key, page_fetcher))
+                for issue in search_issues_paged(jira, queryString)
+            ]
 
-        for task_key, task_data in tasks.items():
-            if task_data['parent'] in epics:
-                if 'tasks' not in epics[task_data['parent']]:
-                    epics[task_data['parent']]['tasks'] = []
-                epics[task_data['parent']]['tasks'].append(task_data)
-            else:
-                issues.append(task_data)
+            for issue, source in pending:
+                description = issue.fields.description or ""
+
+                flat_issues.append({
+                    'key': issue.key,
+                    'summary': issue.fields.summary,
+                    'reporter': issue.fields.reporter.displayName,
+                    'description': description,
+                    'status': issue.fields.status.name,
+                    'issue_type': issue.fields.issuetype.name,
+                    'assignee': issue.fields.assignee.displayName if issue.fields.assignee else None,
+                    'parent': issue.fields.parent.key if 'parent' in issue.fields.__dict__ else None,
+                    'source': source.result()
+                })
+                if progress:
+                    progress('fetching', len(flat_issues))
 
-        for issue_data in issues:
-            if issue_data['parent'] in tasks:
-                if 'subtasks' not in tasks[issue_data['parent']]:
-                    tasks[issue_data['parent']]['subtasks'] = []
-                tasks[issue_data['parent']]['subtasks'].append(issue_data)
+        attach_google_docs_details(flat_issues)
 
         result = {
             "project_name": projectName,
@@ -250,9 +609,9 @@ def handle_webhook(projectName, githubLink = None, jiraLink = None, confluenceLi
             "jira_link": addLinks(jiraLink),
             "docs_link": addLinks(docsLink),
             "confluence_link": addLinks(confluenceLink),
-            "issues": list(epics.values()) + [task for task in tasks.values() if task['parent'] not in epics] + [issue for issue in issues if issue['parent'] not in tasks]
+            "issues": build_issue_tree(flat_issues),
+            "confluence_pages": page_fetcher.pages()
         }
         return result
     except Exception as e:
         return jsonify({"error": "Failed to fetch issues from JIRA", "details": str(e)}), 500
-    
\ No newline at end of file
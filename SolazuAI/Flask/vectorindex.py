@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict, defaultdict
+import numpy as np
+from dotenv import load_dotenv
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_openai import OpenAIEmbeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from database import getIndexSources, getIndexVersion, bumpIndexVersion, invalidateAgentResults
+from embeddingcache import CachedEmbeddings
+from numpystore import NumpyVectorStore
+from lexical import BM25Index, BM25Retriever, HybridRetriever
+
+load_dotenv()
+
+CHROMA_PERSIST_DIR = os.getenv('CHROMA_PERSIST_DIR', '.chroma')
+INDEX_CHUNK_SIZE = int(os.getenv('INDEX_CHUNK_SIZE', 1000))
+INDEX_CHUNK_OVERLAP = int(os.getenv('INDEX_CHUNK_OVERLAP', 200))
+INDEX_ADD_BATCH_SIZE = int(os.getenv('INDEX_ADD_BATCH_SIZE', 500))  # chunks per Chroma upsert
+# 'chroma' queries the collection per request; 'numpy' loads each scope's vectors once
+# into an in-memory NumpyVectorStore and searches that
+VECTOR_STORE_BACKEND = os.getenv('VECTOR_STORE_BACKEND', 'chroma')
+VECTOR_STORE_QUANTIZE = os.getenv('VECTOR_STORE_QUANTIZE', 'false').lower() == 'true'
+SCOPE_STORE_CACHE_SIZE = int(os.getenv('SCOPE_STORE_CACHE_SIZE', 128))
+# Chunks read from Chroma at a time when loading a scope: Chroma hands vectors back through
+# Python lists, several times the size of the float32 rows kept
+SCOPE_LOAD_PAGE_SIZE = int(os.getenv('SCOPE_LOAD_PAGE_SIZE', 1000))
+# Retrieval per role: 'vector', 'bm25' (no embedding calls) or 'hybrid', set with RETRIEVAL_MODE_<ROLE>
+RETRIEVAL_MODES = {role: os.getenv(f'RETRIEVAL_MODE_{role}', 'vector') for role in ('CLARIFY', 'CHAT', 'SUGGESTION')}
+HYBRID_ALPHA = float(os.getenv('HYBRID_ALPHA', 0.5))  # weight of the BM25 score in hybrid mode
+
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=INDEX_CHUNK_SIZE, chunk_overlap=INDEX_CHUNK_OVERLAP)
+
+# ---------------------------- PROJECT INDEXES ----------------------------
+
+_lock = threading.Lock()
+_indexes = {}
+_sync_locks = defaultdict(threading.Lock)
+_scope_stores = OrderedDict()
+_embeddings = None
+
+def get_embeddings():
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = CachedEmbeddings(OpenAIEmbeddings())
+    return _embeddings
+
+def collection_name(project_name):
+    # Chroma only accepts short alphanumeric names, so project names are hashed
+    return "project-" + hashlib.sha1(project_name.encode('utf-8')).hexdigest()[:16]
+
+def get_project_index(project_name, build=False):
+    '''
+    Return the project's persistent Chroma collection. With build, a project whose index
+    was never synced is filled from the database first, for projects ingested before the
+    index existed
+    '''
+    with _lock:
+        index = _indexes.get(project_name)
+        if index is None:
+            index = Chroma(
+                collection_name=collection_name(project_name),
+                embedding_function=get_embeddings(),
+                persist_directory=CHROMA_PERSIST_DIR,
+                collection_metadata={"project_name": project_name}
+            )
+            _indexes[project_name] = index
+    if build and getIndexVersion(project_name) is None:
+        sync_project_index(project_name)
+    return index
+
+def source_hash(source):
+    return hashlib.sha256(f"{source['title']}\0{source['content']}".encode('utf-8')).hexdigest()
+
+def stored_chunks_filter(sources, keys):
+    '''
+    Chroma filter for the stored chunks of the given issues: by issue_key, and by
+    source_id for chunks indexed before chunks carried their issue key
+    '''
+    source_ids = [f"issue:{key}" for key in keys] + [source['source_id'] for source in sources]
+    return {"$or": [{"issue_key": {"$in": list(keys)}}, {"source_id": {"$in": source_ids}}]}
+
+def sync_project_index(project_name, keys=None):
+    '''
+    Bring the project's index in line with the database. Only sources whose title or
+    content changed are split and embedded again; sources no longer stored are removed.
+    With keys, only the sources of those issues are compared, as after a delta sync
+    '''
+    with _sync_locks[project_name]:
+        index = get_project_index(project_name)
+        built = getIndexVersion(project_name) is not None
+        if not built:
+            # Never built: compare every source, not only the changed ones
+            keys = None
+        if keys is not None and not keys:
+            sources = []
+            stored = {"ids": [], "metadatas": []}
+        elif keys is not None:
+            sources = list(getIndexSources(project_name, keys))
+            stored = index.get(where=stored_chunks_filter(sources, keys), include=['metadatas'])
+        else:
+            sources = getIndexSources(project_name)
+            stored = index.get(include=['metadatas'])
+        stored_hashes = {}
+        stored_ids = defaultdict(list)
+        for chunk_id, metadata in zip(stored['ids'], stored['metadatas']):
+            stored_hashes[metadata['source_id']] = metadata['source_hash']
+            stored_ids[metadata['source_id']].append(chunk_id)
+
+        seen = set()
+        changed = []
+        documents = []
+        for source in sources:
+            source_id = source['source_id']
+            seen.add(source_id)
+            digest = source_hash(source)
+            if stored_hashes.get(source_id) == digest:
+                continue
+            changed.append(source_id)
+            metadata = {
+                "project_name": project_name,
+                "source_id": source_id,
+                "source_hash": digest,
+                "issue_key": source['issue_key'],
+                "epic_key": source['epic_key'],
+                "ticket_key": source['ticket_key'],
+                "url": source['url'],
+                "title": source['title']
+            }
+            chunks = text_splitter.split_text(f"Title: {source['title']}\nContent: {source['content']}")
+            documents.extend(Document(page_content=chunk, metadata=metadata) for chunk in chunks)
+
+        removed = [source_id for source_id in stored_hashes if source_id not in seen]
+        stale = [chunk_id for source_id in changed + removed for chunk_id in stored_ids.get(source_id, [])]
+        if stale:
+            index.delete(ids=stale)
+        for start in range(0, len(documents), INDEX_ADD_BATCH_SIZE):
+            batch = documents[start:start + INDEX_ADD_BATCH_SIZE]
+            index.add_documents(batch, ids=[f"{document.metadata['source_id']}:{position}" for position, document in enumerate(batch, start)])
+        # The first sync records that the index is built, even for a project without sources
+        if stale or documents or not built:
+            bumpIndexVersion(project_name)
+        # Cached agent answers built on changed sources are dropped
+        invalidated = invalidateAgentResults(project_name, [source_id for source_id in changed + removed if source_id in stored_hashes])
+        return {"sources_indexed": len(changed), "sources_removed": len(removed), "chunks_added": len(documents), "results_invalidated": invalidated}
+
+def retrieval_filter(epic_key, ticket_key=None, url=None):
+    '''
+    Chroma metadata filter for the scope a request asks about
+    '''
+    conditions = [{"epic_key": epic_key}]
+    if ticket_key is not None:
+        conditions.append({"ticket_key": ticket_key})
+    elif url is not None:
+        conditions.append({"url": url})
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+def built_index_version(project_name):
+    '''
+    Persisted version of the project's index, syncing an index that was never built
+    first
+    '''
+    version = getIndexVersion(project_name)
+    if version is None:
+        get_project_index(project_name, build=True)
+        version = getIndexVersion(project_name)
+    return version
+
+def cached_scope(kind, project_name, where, build):
+    '''
+    Per-scope object of the given kind, built once from the project's index and kept
+    in an LRU until the index version changes, by a sync in any process
+    '''
+    key = (kind, project_name, built_index_version(project_name), json.dumps(where, sort_keys=True))
+    with _lock:
+        value = _scope_stores.get(key)
+        if value is not None:
+            _scope_stores.move_to_end(key)
+            return value
+    value = build(get_project_index(project_name))
+    with _lock:
+        _scope_stores[key] = value
+        while len(_scope_stores) > SCOPE_STORE_CACHE_SIZE:
+            _scope_stores.popitem(last=False)
+    return value
+
+def get_scope_store(project_name, epic_key, ticket_key=None, url=None):
+    '''
+    NumpyVectorStore holding the chunks of one request scope, loaded with their stored
+    vectors from the project's index
+    '''
+    where = retrieval_filter(epic_key, ticket_key, url)
+
+    return cached_scope('numpy', project_name, where, lambda index: load_scope_store(index, where))
+
+def load_scope_store(index, where, quantize=VECTOR_STORE_QUANTIZE):
+    '''
+    NumpyVectorStore of the index's chunks matching where, read SCOPE_LOAD_PAGE_SIZE at
+    a time
+    '''
+    # Rows are copied straight into one matrix sized from the ids, not gathered and joined
+    count = len(index.get(where=where, include=[])['ids'])
+    texts, metadatas, ids = [], [], []
+    matrix = None
+    while len(ids) < count:
+        chunks = index.get(where=where, include=['documents', 'metadatas', 'embeddings'], limit=min(SCOPE_LOAD_PAGE_SIZE, count - len(ids)), offset=len(ids))
+        if not chunks['ids']:
+            break
+        page = np.asarray(chunks['embeddings'], dtype=np.float32)
+        if matrix is None:
+            matrix = np.empty((count, page.shape[1]), dtype=np.float32)
+        matrix[len(ids):len(ids) + len(page)] = page
+        texts.extend(chunks['documents'])
+        metadatas.extend(chunks['metadatas'])
+        ids.extend(chunks['ids'])
+        del chunks, page
+    store = NumpyVectorStore(index.embeddings, quantize=quantize)
+    if ids:
+        store.add_embeddings(texts, matrix[:len(ids)], metadatas, ids)
+    return store
+
+def get_scope_bm25(project_name, epic_key, ticket_key=None, url=None):
+    '''
+    BM25Index over the chunks of one request scope, the same split chunks the vector
+    index holds
+    '''
+    where = retrieval_filter(epic_key, ticket_key, url)
+
+    def build(index):
+        chunks = index.get(where=where, include=['documents', 'metadatas'])
+        return BM25Index(Document(page_content=text, metadata=metadata, id=chunk_id) for chunk_id, text, metadata in zip(chunks['ids'], chunks['documents'], chunks['metadatas']))
+    return cached_scope('bm25', project_name, where, build)
+
+def corpus_version(project_name, role=None):
+    '''
+    Identity of what a role's retriever for the project searches: the retrieval mode
+    and backend, and the persisted index version
+    '''
+    return retrieval_version(role, getIndexVersion(project_name))
+
+def retrieval_version(role, index_version):
+    # corpus_version for an index version already read, as with motor on the async server
+    return (RETRIEVAL_MODES.get(role, 'vector'), VECTOR_STORE_BACKEND, index_version)
+
+def get_retriever(project_name, epic_key, ticket_key=None, url=None, role=None):
+    mode = RETRIEVAL_MODES.get(role, 'vector')
+    if mode == 'bm25':
+        return BM25Retriever(index=get_scope_bm25(project_name, epic_key, ticket_key, url))
+    if mode == 'hybrid':
+        return HybridRetriever(
+            index=get_scope_bm25(project_name, epic_key, ticket_key, url),
+            vectorstore=get_scope_store(project_name, epic_key, ticket_key, url),
+            alpha=HYBRID_ALPHA
+        )
+    if VECTOR_STORE_BACKEND == 'numpy':
+        return get_scope_store(project_name, epic_key, ticket_key, url).as_retriever()
+    vectorstore = get_project_index(project_name, build=True)
+    return vectorstore.as_retriever(search_kwargs={"filter": retrieval_filter(epic_key, ticket_key, url)})
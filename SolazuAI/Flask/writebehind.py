@@ -0,0 +1,126 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', 100))  # flush as soon as this many are queued
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', 0.5))  # seconds an item may wait
+WRITE_BEHIND_RETRY_DELAY = float(os.getenv('WRITE_BEHIND_RETRY_DELAY', 2))
+WRITE_BEHIND_SHUTDOWN_ATTEMPTS = int(os.getenv('WRITE_BEHIND_SHUTDOWN_ATTEMPTS', 3))
+
+# ---------------------------- WRITE-BEHIND BUFFER ----------------------------
+
+class WriteBehindBuffer:
+    '''
+    Queue of writes handed to flush(batch) by one background thread, in the order they
+    were added. A failed batch goes back to the front of the queue, so flush must be
+    safe to repeat. Queued and in-flight items stay visible through pending()
+    '''
+    def __init__(self, flush, batch_size=WRITE_BEHIND_BATCH_SIZE, interval=WRITE_BEHIND_FLUSH_INTERVAL):
+        self._flush = flush
+        self.batch_size = batch_size
+        self.interval = interval
+        self._condition = threading.Condition()
+        self._queue = []
+        self._inflight = []
+        self._oldest = 0.0  # when the oldest queued item was added
+        self._failures = 0
+        self._flush_requested = False
+        self._closed = False
+        self._thread = None
+        atexit.register(self.close)
+
+    def add(self, item):
+        with self._condition:
+            if not self._queue:
+                self._oldest = time.monotonic()
+            self._queue.append(item)
+            if self._thread is None:
+                # Started on first use, so forked workers each get their own thread
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def pending(self, predicate):
+        '''
+        Items not yet confirmed written that match predicate, oldest first
+        '''
+        with self._condition:
+            return [item for item in self._inflight + self._queue if predicate(item)]
+
+    def flush(self):
+        '''
+        Block until everything queued has been written, or until a write fails
+        '''
+        with self._condition:
+            if self._thread is not None:
+                failures = self._failures
+                self._flush_requested = True
+                self._condition.notify_all()
+                while (self._queue or self._inflight) and self._failures == failures:
+                    self._condition.wait()
+                self._flush_requested = False
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        # Whatever is left gets a few more attempts before the process exits
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            if not any(self._write(batch) for _ in range(WRITE_BEHIND_SHUTDOWN_ATTEMPTS)):
+                logger.error("Dropping %d unwritten items", len(batch))
+
+    def _take(self):
+        with self._condition:
+            batch = self._queue[:self.batch_size]
+            del self._queue[:len(batch)]
+            self._inflight = batch
+            return batch
+
+    def _write(self, batch, requeue=False):
+        try:
+            self._flush(batch)
+            return True
+        except Exception:
+            logger.exception("Write-behind flush of %d items failed", len(batch))
+            with self._condition:
+                self._failures += 1
+                if requeue:
+                    self._queue[:0] = batch
+            return False
+        finally:
+            with self._condition:
+                self._inflight = []
+                self._condition.notify_all()
+
+    def _wait_for_batch(self):
+        '''
+        Wait until a batch is due. Returns False once the buffer is closed
+        '''
+        with self._condition:
+            while not self._closed:
+                if self._queue:
+                    remaining = self._oldest + self.interval - time.monotonic()
+                    if self._flush_requested or len(self._queue) >= self.batch_size or remaining <= 0:
+                        return True
+                    self._condition.wait(remaining)
+                else:
+                    self._condition.wait()
+            return False
+
+    def _run(self):
+        while self._wait_for_batch():
+            batch = self._take()
+            if not self._write(batch, requeue=True):
+                time.sleep(WRITE_BEHIND_RETRY_DELAY)
@@ -40,13 +40,15 @@ document.addEventListener("DOMContentLoaded", function () {
 
     fetchLinks(projectName, epicKey, ticketKey);
   });
-  function fetchLinks(projectName, epicKey, ticketKey) {
+  // Links are paged: each page carries the cursor of the next one
+  function fetchLinks(projectName, epicKey, ticketKey, cursor = null) {
     console.log("fetchLinks called");
 
     const requestData = {
       projectName: projectName,
       epicKey: epicKey,
       ticketKey: ticketKey,
+      cursor: cursor,
     };
 
     fetch(`http://127.0.0.1:5000/getLink`, {
@@ -66,7 +68,9 @@ document.addEventListener("DOMContentLoaded", function () {
         console.log("Links fetched from server:", data);
 
         const datasetTableBody = document.getElementById("datasetTableBody");
-        datasetTableBody.innerHTML = ""; // Clear any existing rows
+        if (!cursor) {
+          datasetTableBody.innerHTML = ""; // Clear any existing rows
+        }
 
         if (data && data.length > 0 && data[0].links_status) {
           data[0].links_status.forEach((item) => {
@@ -90,6 +94,9 @@ document.addEventListener("DOMContentLoaded", function () {
 
             datasetTableBody.appendChild(row);
           });
+          if (data[0].next_cursor) {
+            fetchLinks(projectName, epicKey, ticketKey, data[0].next_cursor);
+          }
         } else {
           console.error("links_status is undefined or empty:", data);
           const noDataRow = document.createElement("tr");
@@ -322,6 +329,39 @@ function showDiv1() {
   document.getElementById("chat-container").classList.add("hidden");
 }
 
+// Câu hỏi clarify đang hiển thị, cùng session chat và scope của nó
+let currentQuestion = null;
+
+// Project, epic và ticket nhập ở thanh tìm kiếm của trang requirement
+function requirementScope() {
+  const [project, epic, ticket] = document.querySelectorAll(
+    ".Search .search-input"
+  );
+  return {
+    projectName: project.value.trim(),
+    epicKey: epic.value.trim(),
+    ticketKey: ticket.value.trim() || null,
+  };
+}
+
+const clarifyButton = document.querySelector(".clarify-button");
+if (clarifyButton) {
+  clarifyButton.addEventListener("click", function () {
+    const scope = requirementScope();
+    if (!scope.projectName || !scope.epicKey) {
+      alert("Vui lòng nhập project và epic.");
+      return;
+    }
+    const questionText = document.querySelector("#question h2");
+    generateQuestions(scope, questionText, (questions) => {
+      currentQuestion = questions.length ? { ...scope, ...questions[0] } : null;
+      if (currentQuestion) {
+        questionText.textContent = currentQuestion.question;
+      }
+    });
+  });
+}
+
 // Gán sự kiện click cho nút
 document.getElementById("reply").addEventListener("click", showDiv2);
 document.getElementById("Back").addEventListener("click", showDiv1);
@@ -336,6 +376,15 @@ document.getElementById("send-button").addEventListener("click", function () {
     userMessage.innerHTML = "<p>" + messageText + "</p>";
     document.getElementById("chat-messages").appendChild(userMessage);
 
+    // Câu trả lời của agent hiện dần trong một tin nhắn mới
+    if (currentQuestion) {
+      var botMessage = document.createElement("div");
+      botMessage.className = "message bot-message";
+      botMessage.innerHTML = "<p></p>";
+      document.getElementById("chat-messages").appendChild(botMessage);
+      askClarify(currentQuestion, messageText, botMessage.querySelector("p"));
+    }
+
     // Scroll to the bottom
     document.getElementById("chat-messages").scrollTop =
       document.getElementById("chat-messages").scrollHeight;
@@ -404,6 +453,10 @@ function submitData(projectName, epicKey, ticketKey) {
 
   console.log("Data to be sent:", data);
 
+  if (data.githubLink) {
+    renderRepositoryContents(data.githubLink);
+  }
+
   fetch("http://127.0.0.1:5000/addToDatabase", {
     method: "POST",
     headers: {
@@ -417,13 +470,37 @@ function submitData(projectName, epicKey, ticketKey) {
       if (data.error) {
         alert(data.error);
       } else {
+        pollIngestionJob(data.jobId, projectName, epicKey, ticketKey);
+      }
+    })
+    .catch((error) => {
+      console.error("Error:", error);
+      alert("Đã xảy ra lỗi khi gửi dữ liệu.");
+    });
+}
+
+// Theo dõi tiến trình job thêm dữ liệu cho đến khi xong
+function pollIngestionJob(jobId, projectName, epicKey, ticketKey) {
+  fetch(`http://127.0.0.1:5000/ingestionStatus?jobId=${jobId}`)
+    .then((response) => response.json())
+    .then((job) => {
+      console.log("Ingestion job:", job);
+      if (job.phase === "done") {
         alert("Dữ liệu đã được thêm hoặc cập nhật thành công");
         fetchLinks(projectName, epicKey, ticketKey);
+      } else if (job.phase === "failed" || job.error) {
+        const errors = job.errors || [job];
+        alert(errors.map((e) => e.error).join("\n"));
+      } else {
+        setTimeout(
+          () => pollIngestionJob(jobId, projectName, epicKey, ticketKey),
+          2000
+        );
       }
     })
     .catch((error) => {
       console.error("Error:", error);
-      alert("Đã xảy ra lỗi khi gửi dữ liệu.");
+      alert("Đã xảy ra lỗi khi lấy trạng thái dữ liệu.");
     });
 }
 
@@ -455,3 +532,155 @@ document.getElementById("epicSelect").addEventListener("change", function () {
 });
 
 //click submit mới xem được links
+
+// Đọc nội dung repo GitHub dạng NDJSON, gọi onRecord cho từng file ngay khi nhận được
+function streamRepositoryContents(githubLink, onRecord) {
+  return fetch(
+    `http://127.0.0.1:5000/loadGithubStream?githubLink=${encodeURIComponent(
+      githubLink
+    )}`
+  ).then((response) => {
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    function read() {
+      return reader.read().then(({ done, value }) => {
+        buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+        const lines = buffer.split("\n");
+        buffer = done ? "" : lines.pop();
+        lines
+          .filter((line) => line.trim() !== "")
+          .forEach((line) => onRecord(JSON.parse(line)));
+        return done ? undefined : read();
+      });
+    }
+    return read();
+  });
+}
+
+// Hiển thị từng file của repo GitHub vào bảng dữ liệu ngay khi nhận được
+function renderRepositoryContents(githubLink) {
+  const datasetTableBody = document.getElementById("datasetTableBody");
+  datasetTableBody.innerHTML = "";
+  return streamRepositoryContents(githubLink, (record) => {
+    const row = document.createElement("tr");
+
+    const fileNameCell = document.createElement("td");
+    fileNameCell.innerText = record.path || githubLink;
+    row.appendChild(fileNameCell);
+
+    const dateCell = document.createElement("td");
+    dateCell.innerText = "N/A";
+    row.appendChild(dateCell);
+
+    const statusCell = document.createElement("td");
+    statusCell.className = "status";
+    if (record.error) {
+      statusCell.innerText = record.error;
+    } else if (record.skipped) {
+      statusCell.innerText = `Skipped (${record.skipped})`;
+    } else {
+      statusCell.innerText = "OK";
+    }
+    row.appendChild(statusCell);
+
+    datasetTableBody.appendChild(row);
+  }).catch((error) => {
+    console.error("Error:", error);
+    alert("Đã xảy ra lỗi khi tải nội dung repo: " + error.message);
+  });
+}
+
+// Gọi endpoint agent dạng Server-Sent Events: onToken cho từng token, onDone với kết quả cuối
+function streamAgent(path, payload, { onToken, onDone, onError } = {}) {
+  return fetch(`http://127.0.0.1:5000/${path}`, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify(payload),
+  }).then((response) => {
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const handlers = { token: onToken, done: onDone, error: onError };
+    let buffer = "";
+
+    function dispatch(block) {
+      let event = "message";
+      const data = [];
+      block.split("\n").forEach((line) => {
+        if (line.startsWith("event:")) {
+          event = line.slice(6).trim();
+        } else if (line.startsWith("data:")) {
+          data.push(line.slice(5).trim());
+        }
+      });
+      if (data.length && handlers[event]) {
+        handlers[event](JSON.parse(data.join("\n")));
+      }
+    }
+
+    function read() {
+      return reader.read().then(({ done, value }) => {
+        buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+        const blocks = buffer.split("\n\n");
+        buffer = done ? "" : blocks.pop();
+        blocks.filter((block) => block.trim() !== "").forEach(dispatch);
+        return done ? undefined : read();
+      });
+    }
+    return read();
+  });
+}
+
+// Hiển thị dần câu trả lời của agent vào element khi token về tới
+function renderAgentStream(path, payload, element, onDone) {
+  element.textContent = "";
+  return streamAgent(path, payload, {
+    onToken: (data) => {
+      element.textContent += data.token;
+    },
+    onDone: (data) => {
+      console.log("Tokens:", data.input_tokens, data.output_tokens);
+      if (onDone) {
+        onDone(data);
+      }
+    },
+    onError: (data) => {
+      console.error("Error:", data.error);
+      alert(data.error);
+    },
+  }).catch((error) => {
+    console.error("Error:", error);
+    alert("Đã xảy ra lỗi khi nhận câu trả lời.");
+  });
+}
+
+// Trả lời trong session chat của câu hỏi clarify
+function askClarify(question, userMessage, element) {
+  return renderAgentStream(
+    "getClarifyStream",
+    {
+      sessionId: question.sessionId,
+      userMessage,
+      projectName: question.projectName,
+      epicKey: question.epicKey,
+      ticketKey: question.ticketKey,
+    },
+    element
+  );
+}
+
+// Sinh câu hỏi clarify cho scope; onQuestions nhận các câu hỏi kèm sessionId
+function generateQuestions(scope, element, onQuestions) {
+  return renderAgentStream("getQuestionStream", scope, element, (data) =>
+    onQuestions(data.questions || [])
+  );
+}